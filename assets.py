@@ -0,0 +1,129 @@
+#assets.py
+#Copyright (C) 2011 PyTeam
+
+'''Loading and caching of the game's images.'''
+
+import hashlib
+import os
+import struct
+import pygame
+
+IMAGE_DIR = 'Data'
+#: data directory -> (manifest, directories) shared by all its managers
+_manifests = {}
+
+
+def scan(root):
+    '''Builds the manifest of a data directory.
+    @returns: relative path -> (mtime, size) of every file under the root, and relative directory path -> sorted names of its entries
+    @rtype: tuple(dict, dict)'''
+    manifest = {}
+    directories = {}
+    for path, dirs, files in os.walk(root):
+        rel = os.path.relpath(path, root)
+        rel = '' if rel == os.curdir else rel
+        directories[rel] = sorted(dirs+files)
+        for name in files:
+            info = os.stat(os.path.join(path, name))
+            manifest[os.path.join(rel, name)] = (int(info.st_mtime), info.st_size)
+    return manifest, directories
+
+
+class AssetManager(object):
+    '''Knows every file under the data directory and hands out images scaled to a needed size.
+    The directory is scanned into a manifest once per process; the headless worlds of the server, of the rollback clients
+    and of replays all share it, so creating a world does not touch the disk. Each image is decoded at most once,
+    and each scaled variant is kept for the rest of the run, keyed by (file, size),
+    so loading another level with the same tile side costs nothing.
+    If a cache directory is given, scaled images are also stored there as raw pixels,
+    so later runs skip both decoding and smoothscale.
+    '''
+    #: version of the on-disk format, part of every cache key
+    cache_version = 1
+
+    def __init__(self, root=IMAGE_DIR, cache_dir=None):
+        '''@param root: the data directory
+           @type root: str
+           @param cache_dir: directory for scaled images which survive restarts, nothing is stored if omitted
+           @type cache_dir: str'''
+        self.root = root
+        self.cache_dir = cache_dir
+        if root not in _manifests:
+            _manifests[root] = scan(root)
+        #: relative path -> (mtime, size) of every file under the root
+        #: and relative directory path -> sorted names of its entries, shared by the managers of the root
+        self.manifest, self.directories = _manifests[root]
+        self._decoded = {}
+        self._scaled = {}
+
+    def scan(self):
+        '''Builds the manifest of the data directory again, for all its managers.'''
+        manifest, directories = scan(self.root)
+        self.manifest.clear()
+        self.manifest.update(manifest)
+        self.directories.clear()
+        self.directories.update(directories)
+
+    def listdir(self, path):
+        '''Returns the sorted names of the entries of a directory of the manifest.'''
+        return self.directories[os.path.normpath(path)]
+
+    def decode(self, file_name):
+        '''Returns the image at its original size, decoding it on the first request.'''
+        image = self._decoded.get(file_name)
+        if image is None:
+            image = self._decoded[file_name] = pygame.image.load(os.path.join(self.root, file_name))
+        return image
+
+    def image(self, file_name, size):
+        '''Returns the image scaled to the size.
+        @type size: tuple(int, int)
+        @rtype: pygame.Surface
+        '''
+        key = (file_name, size)
+        image = self._scaled.get(key)
+        if image is None:
+            image = self._load_cached(file_name, size)
+            if image is None:
+                image = pygame.transform.smoothscale(self.decode(file_name), size)
+                self._store_cached(file_name, size, image)
+            self._scaled[key] = image
+        return image
+
+    def _cache_path(self, file_name, size):
+        mtime, length = self.manifest.get(os.path.normpath(file_name), (0, 0))
+        key = '%d|%s|%dx%d|%d|%d'%(self.cache_version, file_name, size[0], size[1], mtime, length)
+        return os.path.join(self.cache_dir, hashlib.md5(key).hexdigest()+'.raw')
+
+    def _load_cached(self, file_name, size):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(file_name, size), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        fmt = 'RGBA' if data[:1] == 'A' else 'RGB'
+        width, height = struct.unpack('<HH', data[1:5])
+        if (width, height) != tuple(size):
+            return None
+        return pygame.image.fromstring(data[5:], (width, height), fmt)
+
+    def _store_cached(self, file_name, size, image):
+        if self.cache_dir is None:
+            return
+        alpha = bool(image.get_flags() & pygame.SRCALPHA)
+        header = ('A' if alpha else 'C')+struct.pack('<HH', image.get_width(), image.get_height())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            path = self._cache_path(file_name, size)
+            if os.path.exists(path):
+                return
+            #write to a temporary file first so a concurrent run never reads a half-written image
+            with open(path+'.tmp', 'wb') as f:
+                f.write(header+pygame.image.tostring(image, 'RGBA' if alpha else 'RGB'))
+            os.rename(path+'.tmp', path)
+        except (IOError, OSError):
+            #the cache is only an optimization
+            pass
@@ -0,0 +1,405 @@
+#benchmark.py
+#Copyright (C) 2011 PyTeam
+
+'''Scripted benchmarks of the game and a gate against performance regressions.
+Each scenario plays a fixed workload: players walking on every map of the Maps directory and on a large generated one,
+boxes destroyed all over a level, chain explosions of 36 bombs, eight bots fighting, the main menu left idle, a local match drawn
+on the screen and a match on a level much larger than the screen, shown by the camera. The time spent in each subsystem is measured by wrapping its methods while the scenario runs;
+times are inclusive and calls nested in a method of the same subsystem are counted once.
+The counters of the worlds' object pools are reported as well.
+The results are printed as JSON and compared with a stored baseline. Each scenario is run several times and the median
+run counts. A short calibration loop is timed before and after each run and the timings are compared in units of its time,
+so a baseline taken on one machine can still be used on another one, and a machine which slows down for a while slows
+down the calibration as well. Slowdowns smaller than a noise floor of a few milliseconds are ignored.
+
+Running the benchmarks and failing if any of them got slower than the baseline by more than 25%:
+    python benchmark.py
+Storing the results as the new baseline:
+    python benchmark.py --save-baseline
+The baseline should only be stored on purpose, in a commit of its own, after checking that no scenario got slower;
+storing it along with other changes would hide the regressions the comparison is there to catch.
+'''
+
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import sys
+from cStringIO import StringIO
+from timeit import default_timer
+#the results are printed to the standard output, where pygame would greet the user
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import bots
+import controllers
+import gameobjects
+import maps
+import pools
+import render
+import spatial
+import ui
+from simulation import Simulation, RandomScript
+
+BASELINE = 'benchmark_baseline.json'
+#: version of the format of the results
+VERSION = 2
+
+#: subsystem -> the methods whose time is counted for it
+SUBSYSTEMS = (
+    ('update', ((Simulation, 'update'), )),
+    ('movement', ((gameobjects.GameObject, 'move'), )),
+    ('spatial', ((spatial.SpatialIndex, 'query'), )),
+    ('explosions', ((Simulation, 'resolve_explosions'), )),
+    ('bots', ((bots.Bot, 'commands'), )),
+    ('objects', ((gameobjects.GameObject, '__init__'), )),
+    ('menus', ((ui.TextBox, 'update'), (ui.TextBox, 'compose'))),
+    ('render', ((render.FullRenderer, 'draw'), (render.DirtyRenderer, 'draw'))),
+)
+
+
+class Probe(object):
+    '''Measures the time spent in the methods of a subsystem and the number of the calls.'''
+
+    def __init__(self, name, methods):
+        self.name = name
+        self.methods = methods
+        self.seconds = 0.0
+        self.calls = 0
+        self._depth = 0
+        self._originals = []
+
+    def install(self):
+        for klass, name in self.methods:
+            original = klass.__dict__[name]
+            self._originals.append((klass, name, original))
+            setattr(klass, name, self.wrap(original))
+
+    def remove(self):
+        for klass, name, original in reversed(self._originals):
+            setattr(klass, name, original)
+        self._originals = []
+
+    def wrap(self, func):
+        probe = self
+        def wrapper(*args, **kwargs):
+            if probe._depth:
+                return func(*args, **kwargs)
+            probe._depth += 1
+            probe.calls += 1
+            started = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                probe.seconds += default_timer()-started
+                probe._depth -= 1
+        wrapper.__name__, wrapper.__doc__ = func.__name__, func.__doc__
+        return wrapper
+
+
+def generate_map(width, height, boxes=0.0, pillars=True, spawns=8, seed=0):
+    '''Returns the contents of a map file with walls around the level, optionally walls on every other cell
+    as on the usual maps, and boxes put at random. The spawn points are kept clear.
+    @param boxes: the part of the free cells which get a box
+    @type boxes: float
+    '''
+    rnd = random.Random(seed)
+    rows = [[' ']*width for y in range(height)]
+    for y in range(height):
+        for x in range(width):
+            if x in (0, width-1) or y in (0, height-1) or (pillars and x%2 == 0 and y%2 == 0):
+                rows[y][x] = 'W'
+            elif rnd.random() < boxes:
+                rows[y][x] = 'B'
+    corners = [(1, 1), (width-2, height-2), (width-2, 1), (1, height-2),
+               (width//2 | 1, 1), (width//2 | 1, height-2), (1, height//2 | 1), (width-2, height//2 | 1)]
+    for x, y in corners[:spawns]:
+        for cx, cy in ((x, y), (x+1, y), (x-1, y), (x, y+1), (x, y-1)):
+            if rows[cy][cx] == 'B':
+                rows[cy][cx] = ' '
+        rows[y][x] = 'S'
+    return '%d %d %d\n'%(height, width, spawns)+'\n'.join(''.join(row) for row in rows)+'\n'
+
+
+def new_world(level, players, seed=1, world=None):
+    '''Starts a match in a new world, or in the given one after ending its last match.'''
+    if world is None:
+        world = Simulation()
+    elif not world.finished:
+        world.end_game()
+    world.start_match(StringIO(level), players, seed)
+    return world
+
+
+def walk(level, ticks=1500):
+    '''Up to 8 players walking around the level without bombs.'''
+    def scenario():
+        world = new_world(level, min(8, int(level.split(None, 3)[2])))
+        world.run(RandomScript(1, bomb_rate=0.0), ticks)
+        return {'ticks': world.ticks, 'pools': world.pools.stats()}
+    return scenario
+
+
+def mass_destruction():
+    '''Bombs with a long reach all over a level full of boxes, exploding at the same time.'''
+    world = new_world(generate_map(81, 81, boxes=1.0, spawns=2), 2)
+    for player in world.players:
+        player.radius = 3
+    for y in range(5, world.height-5, 4):
+        for x in range(5, world.width-5, 4):
+            world.remove_tile(x, y)
+            bomb = gameobjects.Bomb(world.players[0], world, x, y, groups=(world.all, world.bombs, world.destroyable))
+            bomb.time = 0.5
+    boxes = world.grid.tiles.count(chr(spatial.BOX))
+    world.run(None, 120)
+    return {'ticks': world.ticks, 'boxes_destroyed': boxes-world.grid.tiles.count(chr(spatial.BOX)), 'pools': world.pools.stats()}
+
+
+def chain_explosion(rounds=10):
+    '''36 bombs in a square, each in the reach of its neighbours, set off by the first one; played several times in the same world.'''
+    def scenario():
+        ticks = bombs_left = 0
+        level = generate_map(31, 19, pillars=False, spawns=2)
+        world = None
+        for round in range(rounds):
+            world = new_world(level, 2, world=world)
+            world.players[0].radius = 2
+            bombs = []
+            for y in range(4, 16, 2):
+                for x in range(10, 22, 2):
+                    bombs.append(gameobjects.Bomb(world.players[0], world, x, y, groups=(world.all, world.bombs, world.destroyable)))
+            bombs[0].time = 0.05
+            world.run(None, 80)
+            ticks += world.ticks
+            bombs_left += len(world.bombs)
+        return {'ticks': ticks, 'bombs': len(bombs)*rounds, 'bombs_left': bombs_left, 'pools': world.pools.stats()}
+    return scenario
+
+
+def bot_match(ticks=1500):
+    '''Eight bots fighting on a 63x63 level with boxes. The slowest tick is reported too, it must stay well within a frame.'''
+    def scenario():
+        world = new_world(generate_map(63, 63, boxes=0.3), 8)
+        world.bots = controllers.BotController(world, range(8), 1)
+        slowest = 0.0
+        while not world.finished and world.ticks < ticks:
+            started = default_timer()
+            world.step()
+            slowest = max(slowest, default_timer()-started)
+        return {'ticks': world.ticks, 'slowest_tick': slowest, 'players_alive': world.players_alive, 'pools': world.pools.stats()}
+    return scenario
+
+
+def game():
+    '''Returns the game drawing on a screen of a fixed size and playing no sounds; a dummy display is used unless another one is set up.'''
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pyberman
+    if pyberman.Game._instance is None:
+        pyberman.Game.config['screen'] = {'width': 1280, 'height': 720}
+        pyberman.Game.config['sound']['backend'] = 'null'
+    game = pyberman.Game.instance()
+    for sprite in game.all.sprites():
+        sprite.kill()
+    game.create_groups()
+    game.session = None
+    #every run starts with empty pools, as in a new world
+    game.pools = pools.Pools()
+    return game
+
+
+def menu_idle(frames=5000):
+    '''The main menu shown while nobody touches anything.'''
+    def scenario():
+        world = game()
+        ui.MainMenu(world)
+        for frame in range(frames):
+            world.step()
+            world.redraw()
+        return {'ticks': frames, 'pools': world.pools.stats()}
+    return scenario
+
+
+def local_match(frames=1000):
+    '''Two players walking and bombing in a local match which is drawn every tick.'''
+    def scenario():
+        world = game()
+        world.start_local_game(os.path.join('Maps', 'map2.bff'))
+        script = RandomScript(1)
+        for frame in range(frames):
+            if world.finished:
+                break
+            script(world)
+            world.step()
+            world.redraw()
+        return {'ticks': frame+1, 'pools': world.pools.stats()}
+    return scenario
+
+
+def large_arena(frames=1000):
+    '''Four players walking and bombing on a 121x121 level which is drawn every tick through the camera.'''
+    def scenario():
+        world = game()
+        world.start_match(maps.Map.parse(generate_map(121, 121, boxes=0.3, spawns=4)), 4, 1)
+        script = RandomScript(1, bomb_rate=0.005)
+        for frame in range(frames):
+            if world.finished:
+                break
+            script(world)
+            world.step()
+            world.redraw()
+        return {'ticks': frame+1, 'pools': world.pools.stats()}
+    return scenario
+
+
+def scenarios():
+    '''Returns the scenarios by their names, in the order they are run.'''
+    found = [('walk:%s'%os.path.basename(path), walk(open(path).read())) for path in sorted(glob.glob(os.path.join('Maps', '*.bff')))]
+    found.extend([
+        ('walk:generated-63x63', walk(generate_map(63, 63, boxes=0.3))),
+        ('mass_destruction', mass_destruction),
+        ('chain_explosion', chain_explosion()),
+        ('bot_match', bot_match()),
+        ('menu_idle', menu_idle()),
+        ('local_match', local_match()),
+        ('large_arena', large_arena()),
+    ])
+    return found
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values)//2
+    return values[middle] if len(values)%2 else (values[middle-1]+values[middle])/2.0
+
+
+def calibrate(attempts=5):
+    '''Returns the time of a fixed pure Python workload, the unit the timings are compared in.'''
+    best = None
+    for attempt in range(attempts):
+        started = default_timer()
+        table = {}
+        for i in xrange(200000):
+            table[i & 1023] = table.get(i & 1023, 0)+i*3
+        elapsed = default_timer()-started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(scenario, repeat):
+    '''Runs the scenario several times and returns the results of the median run.
+    The calibration is timed before and after each run, and the times of the run are also given in units of the mean
+    of the two, which follows the speed of the machine while the run went on. The units of the scenario and of its
+    subsystems are the medians of those of the runs.'''
+    runs = []
+    calibrations = [calibrate(1)]
+    for attempt in range(repeat):
+        probes = [Probe(name, methods) for name, methods in SUBSYSTEMS]
+        gc.collect()
+        objects = len(gc.get_objects())
+        for probe in probes:
+            probe.install()
+        try:
+            started = default_timer()
+            result = scenario()
+            seconds = default_timer()-started
+        finally:
+            for probe in reversed(probes):
+                probe.remove()
+        calibrations.append(calibrate(1))
+        calibration = (calibrations[-2]+calibrations[-1])/2
+        result['seconds'] = seconds
+        result['units'] = seconds/calibration
+        result['ticks_per_second'] = result['ticks']/max(seconds, 1e-9)
+        #objects taken from a pool are initialized again, but not allocated
+        reused = sum(pool['hits'] for pool in result.get('pools', {}).itervalues())
+        result['objects_created'] = probes[[name for name, methods in SUBSYSTEMS].index('objects')].calls-reused
+        #objects which the garbage collector tracks and which were still alive when the scenario was over
+        result['gc_objects'] = len(gc.get_objects())-objects
+        result['subsystems'] = dict((probe.name, {'seconds': probe.seconds, 'units': probe.seconds/calibration, 'calls': probe.calls})
+                                    for probe in probes if probe.calls)
+        runs.append(result)
+    runs.sort(key=lambda result: result['units'])
+    result = runs[len(runs)//2]
+    for subsystem, timing in result['subsystems'].iteritems():
+        for key in ('seconds', 'units'):
+            timing[key] = median([run['subsystems'].get(subsystem, {key: 0.0})[key] for run in runs])
+        timing['fastest'] = min(run['subsystems'].get(subsystem, {'units': 0.0})['units'] for run in runs)
+    result['units'] = median([run['units'] for run in runs])
+    result['fastest'] = runs[0]['units']
+    #how much the runs differed, as a part of the median
+    result['spread'] = (runs[-1]['units']-runs[0]['units'])/max(result['units'], 1e-9)
+    result['calibration'] = median(calibrations)
+    return result
+
+
+def run(names=None, repeat=5):
+    '''Runs the scenarios whose names start with one of the names, all of them if omitted.
+    @rtype: dict'''
+    results = {'version': VERSION, 'python': platform.python_version(), 'scenarios': {}}
+    for name, scenario in scenarios():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        results['scenarios'][name] = measure(scenario, repeat)
+        sys.stderr.write('%-28s %8.3f s %10.0f ticks/s\n'%(name, results['scenarios'][name]['seconds'], results['scenarios'][name]['ticks_per_second']))
+    results['calibration'] = median([result['calibration'] for result in results['scenarios'].itervalues()] or [calibrate()])
+    return results
+
+
+def compare(results, baseline, threshold=0.25, min_seconds=0.01, noise=0.02):
+    '''Returns descriptions of the timings which are slower than in the baseline by more than the threshold.
+    The timings are compared in the units of the calibration. Both the median and the fastest run have to be slower:
+    a busy machine can slow down most of the runs, but hardly all of them. Subsystems which took less than min_seconds
+    in the baseline are too noisy to be compared.
+    @param noise: seconds, at the speed of the baseline, a timing may get slower by whatever the threshold;
+    the time of short scenarios, which is mostly spent setting them up, varies by a few milliseconds
+    @rtype: list
+    '''
+    if baseline.get('version') != results['version']:
+        return ['the baseline is in another format and cannot be compared, store a new one']
+    floor = noise/baseline['calibration']
+    regressions = []
+    def check(what, timing, base):
+        if (timing['units'] > base['units']*(1+threshold) and timing['fastest'] > base['fastest']*(1+threshold)
+                and timing['units']-base['units'] > floor):
+            regressions.append('%s: %.3f s, %.0f%% slower than the baseline'%(what, timing['seconds'], (timing['units']/base['units']-1)*100))
+    for name, result in sorted(results['scenarios'].iteritems()):
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        check(name, result, base)
+        for subsystem, timing in sorted(result['subsystems'].iteritems()):
+            base_timing = base['subsystems'].get(subsystem)
+            if base_timing is not None and base_timing['seconds'] >= min_seconds:
+                check('%s/%s'%(name, subsystem), timing, base_timing)
+    return regressions
+
+
+if __name__=="__main__":
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--scenario', action='append', dest='scenarios', help='run only the scenarios whose names start with this, may be repeated')
+    parser.add_option('-r', '--repeat', type='int', default=5, help='runs of each scenario, the median one counts')
+    parser.add_option('-o', '--output', help='write the results into this file instead of the standard output')
+    parser.add_option('-b', '--baseline', default=BASELINE, help='file with the baseline results')
+    parser.add_option('-t', '--threshold', type='float', default=0.25, help='slowdown which fails the comparison, 0.25 is 25%')
+    parser.add_option('--noise', type='float', default=0.02, help='seconds a timing may get slower by whatever the threshold')
+    parser.add_option('--save-baseline', action='store_true', help='store the results as the baseline instead of comparing them')
+    options, args = parser.parse_args()
+    results = run(options.scenarios, options.repeat)
+    output = json.dumps(results, indent=2, sort_keys=True, separators=(',', ': '))
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output+'\n')
+    else:
+        print output
+    if options.save_baseline:
+        with open(options.baseline, 'w') as f:
+            f.write(output+'\n')
+    elif os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.threshold, noise=options.noise)
+        for regression in regressions:
+            sys.stderr.write('REGRESSION %s\n'%regression)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,357 @@
+#bots.py
+#Copyright (C) 2011 PyTeam
+
+'''Computer players.
+DangerMap knows when each cell of the level is going to burn. It is kept up to date by the world as bombs are placed,
+moved and exploded, fires appear and go out and boxes are destroyed, so asking about a cell costs a dictionary lookup
+instead of tracing the blast of every bomb.
+Bot decides what a player does, searching the tile grid breadth first for a safe cell, a box to blow up or an enemy.
+A bot only thinks when its player has walked to the middle of a cell, and each search looks at a bounded number of cells,
+so the bots cost little however large the level is. See controllers.BotController, which drives them.
+'''
+
+import heapq
+from gameobjects import Bomb, Bonus, Fire
+import spatial
+
+#: directions of the moves with the commands making them
+MOVES = ((0, -1, 'go_up'), (0, 1, 'go_down'), (-1, 0, 'go_left'), (1, 0, 'go_right'))
+#: seconds a bomb burns for after it explodes, see Fire
+FIRE_TIME = 1.0
+#: a bomb explodes when its time drops below this, see Bomb.update
+FUSE_END = 0.1
+#: seconds a new bomb waits before it explodes, see Bomb
+BOMB_TIME = 7
+
+
+def cell_of(obj):
+    return int(round(obj.x)), int(round(obj.y))
+
+
+class DangerMap(object):
+    '''When the cells of the level burn, by the bombs lying on it and the fires burning on it.
+    The world tells the map about its objects and tiles; the time is the world's time in seconds, ticks*tick_length.
+    '''
+
+    def __init__(self, world):
+        self.world = world
+        #: bomb -> (its cell, the cells its blast reaches)
+        self.blasts = {}
+        #: cell -> {bomb: None} of the bombs whose blasts reach it
+        self.cover = {}
+        #: cell -> {bomb: None} of the bombs lying on it
+        self.bombs_at = {}
+        #: cell of a box -> {bomb: None} of the bombs whose rays stop at the box
+        self.stops = {}
+        #: bomb -> the time it explodes if nothing sets it off earlier
+        self.fuses = {}
+        #: player -> (the radius the blasts of its bombs were traced with, {bomb: None} of its bombs)
+        self.owners = {}
+        #: cell -> {fire: the time it goes out}
+        self.fires = {}
+        #: cell -> {bonus: None} of the bonuses lying on it
+        self.bonuses = {}
+        self._deadlines = None
+        for obj in world.all:
+            if obj.collidable:
+                self.added(obj)
+
+    @property
+    def now(self):
+        return self.world.ticks*self.world.tick_length
+
+    def ray_cells(self, x, y, radius):
+        '''Returns the cells a blast from the cell reaches on the tile grid and the boxes which stop it.'''
+        world, grid = self.world, self.world.grid
+        cells, boxes = [], []
+        for dx, dy, first in Bomb.rays:
+            for distance in range(first, radius+1):
+                cx, cy = x+dx*distance, y+dy*distance
+                if not (0<cx<world.width-1 and 0<cy<world.height-1):
+                    break
+                tile = grid.get(cx, cy)
+                if tile == spatial.WALL:
+                    break
+                cells.append((cx, cy))
+                if tile == spatial.BOX:
+                    boxes.append((cx, cy))
+                    break
+        return cells, boxes
+
+    def added(self, obj):
+        '''Called when an object appears on the level.'''
+        if isinstance(obj, Bomb):
+            self.fuses[obj] = self.now+obj.time-FUSE_END
+            self._place(obj)
+        elif isinstance(obj, Fire):
+            self.fires.setdefault(cell_of(obj), {})[obj] = self.now+obj.time
+        elif isinstance(obj, Bonus):
+            self.bonuses.setdefault(cell_of(obj), {})[obj] = None
+
+    def removed(self, obj):
+        '''Called when an object leaves the level. Objects the map does not know are ignored;
+        an object may be removed more times, for example a bomb which was set off and then killed.'''
+        if obj in self.blasts:
+            self._lift(obj)
+            del self.fuses[obj]
+            return
+        for index in (self.fires, self.bonuses):
+            members = index.get(cell_of(obj))
+            if members is not None and obj in members:
+                del members[obj]
+                if not members:
+                    del index[cell_of(obj)]
+
+    def moved(self, obj):
+        '''Called when an object has moved. A bomb may get to another cell; a player, which is moved
+        on every tick, may have got a bonus changing the reach of its bombs, which explode with its current radius.'''
+        blast = self.blasts.get(obj)
+        if blast is not None:
+            if blast[0] != cell_of(obj):
+                self._lift(obj)
+                self._place(obj)
+            return
+        owned = self.owners.get(obj)
+        if owned is not None and owned[0] != obj.radius:
+            for bomb in list(owned[1]):
+                self._lift(bomb)
+                self._place(bomb)
+
+    def tile_removed(self, x, y):
+        '''Called when a box is destroyed: the rays it stopped go further now.'''
+        bombs = self.stops.get((x, y))
+        if bombs:
+            for bomb in list(bombs):
+                self._lift(bomb)
+                self._place(bomb)
+
+    def _place(self, bomb):
+        cell, player = cell_of(bomb), bomb.player
+        cells, boxes = self.ray_cells(cell[0], cell[1], player.radius)
+        self.blasts[bomb] = (cell, cells, boxes)
+        owned = self.owners.get(player)
+        if owned is None or owned[0] != player.radius:
+            owned = self.owners[player] = (player.radius, owned[1] if owned is not None else {})
+        owned[1][bomb] = None
+        self.bombs_at.setdefault(cell, {})[bomb] = None
+        for c in cells:
+            self.cover.setdefault(c, {})[bomb] = None
+        for c in boxes:
+            self.stops.setdefault(c, {})[bomb] = None
+        self._deadlines = None
+
+    def _lift(self, bomb):
+        cell, cells, boxes = self.blasts.pop(bomb)
+        owned = self.owners[bomb.player][1]
+        del owned[bomb]
+        if not owned:
+            del self.owners[bomb.player]
+        for index, where in ((self.bombs_at, (cell, )), (self.cover, cells), (self.stops, boxes)):
+            for c in where:
+                members = index[c]
+                del members[bomb]
+                if not members:
+                    del index[c]
+        self._deadlines = None
+
+    def deadlines(self):
+        '''Returns bomb -> the time it explodes, earlier than its own fuse if the blast of another bomb sets it off.'''
+        if self._deadlines is None:
+            deadlines = dict(self.fuses)
+            #the bombs are set off in the order of their deadlines, as by Dijkstra's algorithm
+            queue = [(deadline, bomb.net_id, bomb) for bomb, deadline in deadlines.iteritems()]
+            heapq.heapify(queue)
+            while queue:
+                deadline, net_id, bomb = heapq.heappop(queue)
+                if deadline > deadlines[bomb]:
+                    continue
+                for c in self.blasts[bomb][1]:
+                    for other in self.bombs_at.get(c, ()):
+                        if deadlines[other] > deadline:
+                            deadlines[other] = deadline
+                            heapq.heappush(queue, (deadline, other.net_id, other))
+            self._deadlines = deadlines
+        return self._deadlines
+
+    def burning(self, cell):
+        '''Returns (start, end) of the time the cell burns next, None if nothing threatens it.'''
+        start = end = None
+        bombs = self.cover.get(cell)
+        if bombs:
+            deadlines = self.deadlines()
+            start = min(deadlines[bomb] for bomb in bombs)
+            end = start+FIRE_TIME
+        fires = self.fires.get(cell)
+        if fires:
+            start, end = self.now, max(max(fires.itervalues()), end)
+        if start is None:
+            return None
+        return start, end
+
+    def has_bomb(self, cell):
+        return cell in self.bombs_at
+
+
+class Bot(object):
+    '''Decides what one player does.
+    It runs away from the cells which are going to burn, puts bombs next to boxes and enemies when it can escape
+    their blast, and walks towards boxes, bonuses and enemies otherwise.
+    '''
+    #: the most cells one search looks at
+    max_search = 400
+    #: seconds kept between the bot and the fire
+    margin = 0.15
+    #: ticks a bot which has found nothing to do waits before it looks again
+    rest = 10
+
+    def __init__(self, world, player, random):
+        '''@param random: random generator of the bot, the world's one must not be touched'''
+        self.world = world
+        self.player = player
+        self.random = random
+        self._resting = 0
+        #: where the player was when it was last told to walk
+        self._walked_from = None
+
+    def commands(self):
+        '''Returns the commands of the player for this tick.'''
+        player = self.player
+        if not player.alive() or player.steps or player.time_moving > 0:
+            return []
+        if self._resting > 0:
+            self._resting -= 1
+            return []
+        world = self.world
+        x, y = cell_of(player)
+        stuck, self._walked_from = self._walked_from == (player.x, player.y), (player.x, player.y)
+        #walking is stopped in the middle of a cell, a player pushed away from it by whole steps goes back first;
+        #what is left of a step is less than the slack between the player and the tiles
+        offset_x, offset_y = x-player.x, y-player.y
+        if abs(offset_x) > abs(offset_y):
+            steps, dx, dy = int(round(abs(offset_x)/world.step_length)), cmp(offset_x, 0), 0
+        else:
+            steps, dx, dy = int(round(abs(offset_y)/world.step_length)), 0, cmp(offset_y, 0)
+        if steps and not stuck:
+            return self.walk(dx, dy, steps)
+        if stuck:
+            #the last walk was blocked, bumping into whatever is around puts the player back in line
+            dx, dy, command = self.random.choice(MOVES)
+            return self.walk(dx, dy, 1)
+        danger = world.danger_map()
+        safe = lambda cell: danger.burning(cell) is None
+        if not safe((x, y)):
+            path = self.search((x, y), safe)
+        else:
+            if player.bombs > 0 and self.worth_bombing((x, y)):
+                escape = self.search((x, y), safe, bomb=(x, y))
+                if escape:
+                    return ['put_bomb']+self.follow(escape)
+            path = self.search((x, y), self.is_target)
+            if path is None:
+                #nothing to do in reach, a random safe neighbour is as good as any
+                cells = [(x+dx, y+dy) for dx, dy, command in MOVES if self.passable((x+dx, y+dy)) and safe((x+dx, y+dy))]
+                if cells:
+                    path = [(x, y), self.random.choice(cells)]
+        if path is None:
+            self._resting = self.rest
+            self._walked_from = None
+            return []
+        return self.follow(path)
+
+    def walk(self, dx, dy, steps):
+        for mx, my, command in MOVES:
+            if (mx, my) == (dx, dy):
+                return [command]*steps+['stop']
+        return []
+
+    def follow(self, path):
+        '''Returns the commands walking to the second cell of the path, where the next decision is made.'''
+        (x, y), (nx, ny) = path[0], path[1]
+        return self.walk(nx-x, ny-y, int(round(1.0/self.world.step_length)))
+
+    def passable(self, cell):
+        world = self.world
+        return world.grid.get(*cell) == spatial.EMPTY and not world.danger_map().has_bomb(cell)
+
+    def safe(self, cell, arrive, leave, bomb_cells, bomb_time):
+        '''Returns whether nothing burns the cell while the player passes it.'''
+        burning = self.world.danger_map().burning(cell)
+        if burning is not None and burning[0]-self.margin < leave and arrive < burning[1]+self.margin:
+            return False
+        if cell in bomb_cells and bomb_time-self.margin < leave and arrive < bomb_time+FIRE_TIME+self.margin:
+            return False
+        return True
+
+    def search(self, start, goal, bomb=None):
+        '''Searches breadth first for the nearest cell, other than the start, meeting the goal which can be reached without getting burnt.
+        @param bomb: cell of a bomb the player is about to put, its blast is taken into account
+        @returns: the cells of the path from the start, None if there is no such cell within max_search cells
+        @rtype: list
+        '''
+        world, player = self.world, self.player
+        danger = world.danger_map()
+        tiles, bombs_at, safe = world.grid.get, danger.bombs_at, self.safe
+        tile_time = 1.0/player.speed
+        now = danger.now+world.tick_length
+        bomb_cells, bomb_time = (), None
+        if bomb is not None:
+            bomb_cells = set(danger.ray_cells(bomb[0], bomb[1], player.radius)[0])
+            bomb_time = now+BOMB_TIME-FUSE_END
+        parents = {start: None}
+        frontier = [start]
+        distance = 0
+        looked_at = 0
+        while frontier and looked_at < self.max_search:
+            next_frontier = []
+            for cell in frontier:
+                looked_at += 1
+                if cell != start and cell not in bomb_cells and goal(cell):
+                    path = []
+                    while cell is not None:
+                        path.append(cell)
+                        cell = parents[cell]
+                    path.reverse()
+                    return path
+                arrive = now+(distance+1)*tile_time
+                for dx, dy, command in MOVES:
+                    neighbour = (cell[0]+dx, cell[1]+dy)
+                    if neighbour in parents or tiles(*neighbour) != spatial.EMPTY or neighbour in bombs_at:
+                        continue
+                    if not safe(neighbour, arrive-tile_time, arrive+tile_time, bomb_cells, bomb_time):
+                        continue
+                    parents[neighbour] = cell
+                    next_frontier.append(neighbour)
+            frontier = next_frontier
+            distance += 1
+        return None
+
+    def worth_bombing(self, cell):
+        '''Returns whether a bomb put at the cell would hit a box or an enemy.'''
+        cells, boxes = self.world.danger_map().ray_cells(cell[0], cell[1], self.player.radius)
+        if boxes:
+            return True
+        reached = set(cells)
+        return any(other is not self.player and other.alive() and cell_of(other) in reached for other in self.world.players)
+
+    def is_target(self, cell):
+        '''Whether the bot has something to do at the cell: a bonus to pick up, or a box or an enemy to blow up.
+        Only the neighbouring boxes and the enemies in line are looked for here, the whole blast is traced when the bot gets there.'''
+        world, player = self.world, self.player
+        danger = world.danger_map()
+        if danger.burning(cell) is not None:
+            return False
+        if cell in danger.bonuses:
+            return True
+        if player.bombs == 0:
+            return False
+        x, y = cell
+        grid = world.grid
+        for dx, dy, command in MOVES:
+            if grid.get(x+dx, y+dy) == spatial.BOX:
+                return True
+        for other in world.players:
+            if other is not player and other.alive():
+                ox, oy = cell_of(other)
+                if (ox == x and abs(oy-y) <= player.radius) or (oy == y and abs(ox-x) <= player.radius):
+                    return True
+        return False
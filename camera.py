@@ -0,0 +1,90 @@
+#camera.py
+#Copyright (C) 2011 PyTeam
+
+'''The camera which shows a part of a level larger than the screen.
+When the game uses a camera, tiles have a fixed side and the rects of level objects are in the pixels of the whole level,
+starting at its top left corner. The renderers move what they draw by the camera's position and skip the tiles
+and sprites which are out of its view.
+'''
+
+import pygame
+
+
+class Camera(object):
+    '''The part of the level shown on the screen. It follows the local players, moving only when they get
+    out of a zone in the middle of the screen, so the view stays still while they walk around in it.
+    '''
+    #: part of the screen's width and height, in the middle of it, where the followed players move without moving the camera
+    dead_zone = 0.3
+
+    def __init__(self, game, margin=1):
+        '''@param margin: tiles around the view in which sprites are still drawn and interpolated, so those moving in are not cut
+           @type margin: int'''
+        self.game = game
+        self.margin = margin
+        #: the shown part of the level, in level pixels
+        self.rect = pygame.Rect(0, 0, game.screen_width, game.screen_height)
+        #: number of times the camera has moved; renderers compare it with the last one they have seen
+        self.moves = 0
+        self._placed = False
+        self._bounds = None
+
+    @property
+    def bounds(self):
+        '''The view with its margin.'''
+        if self._bounds is None:
+            side = self.game.side*self.margin
+            self._bounds = self.rect.inflate(2*side, 2*side)
+        return self._bounds
+
+    def visible(self, rect):
+        '''Returns whether the rect is in the view or in its margin.'''
+        return self.bounds.colliderect(rect)
+
+    def to_screen(self, rect):
+        '''Returns where a rect of the level is on the screen.'''
+        return rect.move(-self.rect.x, -self.rect.y)
+
+    def tiles(self):
+        '''Returns the columns and rows of the tiles in the view and its margin as (left, top, right, bottom), right and bottom excluded.'''
+        game, bounds = self.game, self.bounds
+        side = game.side
+        return (max(0, bounds.left//side), max(0, bounds.top//side),
+                min(game.width, bounds.right//side+1), min(game.height, bounds.bottom//side+1))
+
+    def follow(self, sprites):
+        '''Moves the view so that the sprites are in its middle zone. It is centred on them the first time.
+        A level smaller than the screen is centred on it.'''
+        if not sprites:
+            return
+        area = sprites[0].rect.unionall([sprite.rect for sprite in sprites[1:]])
+        x, y = self.rect.topleft
+        if not self._placed:
+            self._placed = True
+            x, y = area.centerx-self.rect.width//2, area.centery-self.rect.height//2
+        else:
+            zone = self.rect.inflate(-int(self.rect.width*(1-self.dead_zone)), -int(self.rect.height*(1-self.dead_zone)))
+            if area.width > zone.width:
+                x = area.centerx-self.rect.width//2
+            elif area.left < zone.left:
+                x -= zone.left-area.left
+            elif area.right > zone.right:
+                x += area.right-zone.right
+            if area.height > zone.height:
+                y = area.centery-self.rect.height//2
+            elif area.top < zone.top:
+                y -= zone.top-area.top
+            elif area.bottom > zone.bottom:
+                y += area.bottom-zone.bottom
+        x = self.clamp(x, self.game.width*self.game.side, self.rect.width)
+        y = self.clamp(y, self.game.height*self.game.side, self.rect.height)
+        if (x, y) != self.rect.topleft:
+            self.rect.topleft = (x, y)
+            self._bounds = None
+            self.moves += 1
+
+    @staticmethod
+    def clamp(position, level, view):
+        if level <= view:
+            return (level-view)//2
+        return max(0, min(position, level-view))
@@ -3,14 +3,64 @@
 
 """Player controllers which dispatch physical events to players."""
 
+import random
 import time
 import pygame
 from pygame.locals import *
 from PodSixNet.Channel import Channel
 from PodSixNet.Server import Server
 from PodSixNet.Connection import connection, ConnectionListener
+import bots
 import events
-import gameobjects
+import replay
+from simulation import Simulation
+from snapshot import Snapshot, HISTORY
+
+class Outbox(object):
+    '''Messages waiting to be sent over a connection.
+    Game code only puts messages here; they are sent once per tick by flush(), together in one 'batch' message
+    if there are several of them, so no socket is touched in the middle of a step.
+    '''
+    #: actions of which only the latest message matters, earlier ones are dropped from the queue
+    latest_only = ('ack', 'snapshot')
+
+    def __init__(self, endpoint):
+        '''@param endpoint: the PodSixNet channel or the client's connection'''
+        self.endpoint = endpoint
+        self.messages = []
+
+    def put(self, data):
+        if data['action'] in self.latest_only:
+            self.messages = [message for message in self.messages if message['action'] != data['action']]
+        self.messages.append(data)
+
+    def flush(self):
+        '''Hands the messages to the endpoint, which sends them when it is pumped.'''
+        if not self.messages:
+            return
+        if len(self.messages) == 1:
+            self.endpoint.Send(self.messages[0])
+        else:
+            self.endpoint.Send({'action': 'batch', 'messages': self.messages})
+        self.messages = []
+
+
+def unpack_batch(listener, data):
+    '''Calls the Network_ methods of the listener for each message of a batch.'''
+    for message in data['messages']:
+        handler = getattr(listener, 'Network_'+message['action'], None)
+        if handler is not None:
+            handler(message)
+
+
+#: messages of this client to the server
+outbox = Outbox(connection)
+
+
+def send_inputs(tick, commands):
+    '''Sends the commands of the local player for a tick of a rollback match.'''
+    outbox.put({'action': 'inputs', 'tick': tick, 'commands': commands})
+
 
 class LocalController(events.AutoListeningObject):
     '''Class which catches the events from the keyboard and resents these events to players of local game'''
@@ -19,68 +69,251 @@ class LocalController(events.AutoListeningObject):
         self.player1 = player1
         self.player2 = player2
         self.actions={
-            K_UP:self.player1.go_up,
-            K_DOWN:self.player1.go_down,
-            K_LEFT:self.player1.go_left,
-            K_RIGHT: self.player1.go_right,
-            K_SPACE: self.player1.put_bomb,
-            K_w:self.player2.go_up,
-            K_s:self.player2.go_down,
-            K_a:self.player2.go_left,
-            K_d: self.player2.go_right,
-            K_LCTRL:self.player2.put_bomb
+            K_UP: (self.player1, 'go_up'),
+            K_DOWN: (self.player1, 'go_down'),
+            K_LEFT: (self.player1, 'go_left'),
+            K_RIGHT: (self.player1, 'go_right'),
+            K_SPACE: (self.player1, 'put_bomb'),
+            K_w: (self.player2, 'go_up'),
+            K_s: (self.player2, 'go_down'),
+            K_a: (self.player2, 'go_left'),
+            K_d: (self.player2, 'go_right'),
+            K_LCTRL: (self.player2, 'put_bomb')
         }
         super(LocalController, self).__init__()
 
+    def command(self, player, command):
+        '''Commands go through the game, which may record them.'''
+        player.game.command(player.id, command)
+
     def event_keydown(self, event):
         '''Manages to use the key down until it is released'''
-        func = self.actions.get(event.key, None)
-        if func is not None:
-            func()
+        action = self.actions.get(event.key, None)
+        if action is not None:
+            self.command(*action)
 
     def event_keyup(self, event):
         '''Release of currect key'''
         if event.key in [K_UP,K_DOWN,K_LEFT,K_RIGHT]: 
-            self.player1.stop()
+            self.command(self.player1, 'stop')
         elif event.key in [K_w,K_a,K_s,K_d]: 
-            self.player2.stop()
+            self.command(self.player2, 'stop')
 
 
 
 class NetworkController(events.AutoListeningObject):
-    '''Class which catches the events from the keyboard and resents these events to players of network game'''
+    '''Class which catches the events from the keyboard and sends them to the server as commands of the player'''
 
-    def __init__(self, player):
-        self.player = player
+    def __init__(self):
         self.actions={
-            K_UP:self.player.go_up,
-            K_DOWN:self.player.go_down,
-            K_LEFT:self.player.go_left,
-            K_RIGHT: self.player.go_right,
-            K_SPACE: self.player.put_bomb,
+            K_UP: 'go_up',
+            K_DOWN: 'go_down',
+            K_LEFT: 'go_left',
+            K_RIGHT: 'go_right',
+            K_SPACE: 'put_bomb',
         }
         super(NetworkController, self).__init__()
 
+    def send(self, command):
+        outbox.put({'action': 'input', 'command': command})
+
     def event_keydown(self, event):
         '''Manages to use the key down until it is released'''
-        func = self.actions.get(event.key, None)
-        if func is not None:
-            func()
+        command = self.actions.get(event.key, None)
+        if command is not None:
+            self.send(command)
 
     def event_keyup(self, event):
         '''Release of currect key'''
         if event.key in [K_UP,K_DOWN,K_LEFT,K_RIGHT]: 
-            self.player.stop()
+            self.send('stop')
+
+
+class RollbackController(NetworkController):
+    '''Gives the commands of the player to the client's rollback session, which applies them at once and sends them to the others.'''
+
+    def __init__(self, session):
+        self.session = session
+        super(RollbackController, self).__init__()
+
+    def send(self, command):
+        self.session.command(command)
+
+
+class BotController(object):
+    '''Drives the players of a world which have no one at the keyboard. The world calls it before each step, see Simulation.bots.
+    Commands go through the world like those of LocalController, so replays and network matches need nothing else.'''
+
+    def __init__(self, world, player_ids, seed=None):
+        '''@param player_ids: ids of the players the bots control
+           @param seed: seed of the bots' random generators, which are their own so the world's one is not disturbed'''
+        generator = random.Random(seed)
+        self.bots = [bots.Bot(world, world.players[id], random.Random(generator.getrandbits(32))) for id in player_ids]
+
+    def __call__(self, world):
+        for bot in self.bots:
+            if world.finished:
+                return
+            for command in bot.commands():
+                world.command(bot.player.id, command)
+
+
+class Match(object):
+    '''A network match: the world simulated by the server and the clients playing in it.
+    Clients send the commands of their players and receive a snapshot of the world after each step.
+    '''
+
+    def __init__(self, level, channels, seed=None, replay_dir=None, bots=0):
+        '''@type level: maps.Map
+           @param channels: connections to the clients, the n-th client controls the n-th player
+           @param replay_dir: directory to record the match into, it is not recorded if omitted
+           @param bots: number of players controlled by the server after those of the clients'''
+        seed = int(time.time()) if seed is None else seed
+        num_players = len(channels)+bots
+        self.world = Simulation()
+        self.world.start_match(level, num_players, seed)
+        if bots:
+            self.world.bots = BotController(self.world, range(len(channels), num_players), seed)
+        if replay_dir is not None:
+            replay.record(self.world, replay_dir)
+        self.channels = list(channels)
+        #: tick -> snapshots which clients may have acknowledged
+        self.history = {}
+        encoded = level.encode()
+        for id, channel in enumerate(self.channels):
+            channel.match, channel.player_id, channel.acked = self, id, None
+            channel.outbox.put({'action': 'start_game', 'map': encoded, 'player_id': id, 'num_players': num_players, 'random_seed': seed})
+
+    @property
+    def finished(self):
+        return self.world.finished
+
+    def command(self, channel, command):
+        '''Makes the player of the client do what the client asks.'''
+        if not self.world.finished:
+            self.world.command(channel.player_id, command)
+
+    def inputs(self, channel, tick, commands):
+        '''Commands tagged with ticks are sent by rollback clients; the server's world applies them at once.'''
+        for command in commands:
+            self.command(channel, command)
+
+    def leave(self, channel):
+        '''Stops sending snapshots to a client which has disconnected, its player stays on the level.'''
+        if channel in self.channels:
+            self.channels.remove(channel)
+        channel.match = None
+
+    def step(self):
+        '''Steps the world and queues for each client the difference against the last snapshot it has acknowledged.'''
+        self.world.step()
+        snapshot = Snapshot.capture(self.world)
+        self.history[snapshot.tick] = snapshot
+        for channel in self.channels:
+            channel.outbox.put({'action': 'snapshot', 'data': snapshot.encode(self.history.get(channel.acked))})
+        #snapshots older than every acknowledgement will never be a base again
+        oldest = min([channel.acked for channel in self.channels if channel.acked is not None] or [snapshot.tick])
+        for tick in self.history.keys():
+            if tick < max(oldest, snapshot.tick-HISTORY):
+                del self.history[tick]
+
+    def flush(self):
+        '''Hands the queued messages of the clients to their channels.'''
+        for channel in self.channels:
+            channel.outbox.flush()
+
+
+class RelayMatch(object):
+    '''A network match played with rollback netcode: every client simulates the world itself
+    and the server only passes the commands of each player to the other clients, see rollback.Rollback.
+    The match is over when all the clients have seen its end and disconnected.
+    '''
+
+    def __init__(self, level, channels, seed=None, replay_dir=None, bots=0):
+        '''@param replay_dir: not used, the server does not simulate the match and so cannot record it
+           @param bots: not used, there is no world on the server for bots to play in'''
+        seed = int(time.time()) if seed is None else seed
+        self.channels = list(channels)
+        #: player id -> the last tick whose commands of the player were passed on
+        self.ticks = {}
+        encoded = level.encode()
+        for id, channel in enumerate(self.channels):
+            channel.match, channel.player_id, channel.acked = self, id, None
+            channel.outbox.put({'action': 'start_game', 'map': encoded, 'player_id': id, 'num_players': len(self.channels),
+                                'random_seed': seed, 'netcode': 'rollback'})
+
+    @property
+    def finished(self):
+        return not self.channels
+
+    def command(self, channel, command):
+        '''Commands without a tick cannot be simulated by the others in the same way, so they are ignored.'''
+        pass
+
+    def inputs(self, channel, tick, commands):
+        self.ticks[channel.player_id] = tick
+        message = {'action': 'inputs', 'player': channel.player_id, 'tick': tick, 'commands': commands}
+        for other in self.channels:
+            if other is not channel:
+                other.outbox.put(message)
+
+    def leave(self, channel):
+        '''Tells the others that the client's player gives no more commands.'''
+        if channel in self.channels:
+            self.channels.remove(channel)
+            for other in self.channels:
+                other.outbox.put({'action': 'left', 'player': channel.player_id, 'tick': self.ticks.get(channel.player_id, -1)})
+        channel.match = None
+
+    def step(self):
+        pass
+
+    def flush(self):
+        for channel in self.channels:
+            channel.outbox.flush()
+
+
+#: kinds of network matches by the names of their netcode in the configuration
+matches = {
+    'snapshot': Match,
+    'rollback': RelayMatch,
+}
 
 
 class ClientChannel(Channel):
-    def Network(self, data):
-        self._server.send_to_all(data, exclude=self)
+    '''Connection of the server to a client.'''
+    #: the match the client plays in
+    match = None
+    #: the player the client controls
+    player_id = None
+    #: tick of the last snapshot the client has received
+    acked = None
+
+    def __init__(self, *args, **kwargs):
+        Channel.__init__(self, *args, **kwargs)
+        self.outbox = Outbox(self)
+
+    def Network_batch(self, data):
+        unpack_batch(self, data)
+
+    def Network_input(self, data):
+        if self.match is not None:
+            self.match.command(self, data['command'])
+
+    def Network_inputs(self, data):
+        if self.match is not None:
+            self.match.inputs(self, data['tick'], data['commands'])
+
+    def Network_ack(self, data):
+        self.acked = data['tick']
 
     def Close(self):
-        self._server.num_players-=1
+        if self.match is not None:
+            self.match.leave(self)
+        self._server.Disconnected(self)
 
 class GameServer(Server):
+    '''The server of a network game hosted by one of the players, it runs a single match.'''
     channelClass = ClientChannel
 
     def __init__(self, game, *args, **kwargs):
@@ -88,6 +321,8 @@ class GameServer(Server):
         Server.__init__(self, *args, **kwargs)
         self.game_started = False
         self.num_players = 0
+        #: the current match
+        self.match = None
 
     def Connected(self, channel, addr):
         if self.game_started:
@@ -96,12 +331,29 @@ class GameServer(Server):
         self.num_players+=1
         self.game.active_players.append("%d: from %s"%(self.num_players, addr[0]))
 
+    def Disconnected(self, channel):
+        self.num_players-=1
+
     def send_to_all(self, data, exclude=None):
         for channel in self.channels:
             if channel is not exclude:
                 channel.Send(data)
 
     def start_game(self, level):
-        for id, player in enumerate(self.channels):
-            player.Send({'action': 'start_game', 'level': level, 'player_id': id, 'num_players': self.num_players, 'random_seed': int(time.time())})
+        self.match = matches[self.game.config['server']['netcode']](level, self.channels, replay_dir=self.game.config['general']['replay_dir'])
         self.game_started = True
+        self.flush()
+
+    def step(self):
+        '''Makes a step of the match.'''
+        if not self.game_started:
+            return
+        self.match.step()
+        if self.match.finished:
+            self.game_started = False
+        self.flush()
+
+    def flush(self):
+        '''Hands the queued messages of all the clients to their channels.'''
+        for channel in self.channels:
+            channel.outbox.flush()
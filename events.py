@@ -4,9 +4,68 @@
 '''Contains the Event class.'''
 
 import weakref
+from collections import OrderedDict
 import pygame
 
 
+class HandlerRegistry(object):
+    '''Handlers of a single event, indexed by the objects they belong to.
+    Each object has at most one handler for an event, so both registering and unregistering are O(1).
+    Handlers are called in the order of registration. Changes made while the event is propagating
+    are applied when the propagation is over, so the handlers need not be copied for each event.
+    '''
+
+    def __init__(self):
+        #: id of the object -> (weak reference to the object, function)
+        self._handlers = OrderedDict()
+        #: (id of the object, entry or None for removal) made during propagation
+        self._pending = []
+        self._propagating = 0
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def _change(self, key, entry):
+        if self._propagating:
+            self._pending.append((key, entry))
+        elif entry is None:
+            self._handlers.pop(key, None)
+        else:
+            self._handlers[key] = entry
+
+    def add(self, obj, function):
+        '''Registers the function to be called with the object.'''
+        key = id(obj)
+        #store a weak reference in order not to prevent object from garbage colecting if it listens for events
+        self._change(key, (weakref.ref(obj, lambda ref: self._died(key, ref)), function))
+
+    def remove(self, obj):
+        '''Unregisters the handler of the object. Objects without a handler are ignored.'''
+        self._change(id(obj), None)
+
+    def _died(self, key, ref):
+        entry = self._handlers.get(key)
+        if entry is not None and entry[0] is ref:
+            self._change(key, None)
+
+    def propagate(self, event):
+        '''Calls the handlers until one of them stops the propagation.'''
+        self._propagating += 1
+        try:
+            for ref, function in self._handlers.itervalues():
+                obj = ref()
+                if obj is not None:
+                    function(obj, event)
+                if event.stop_propagating: #handler requested that the event should not be passed to other handlers
+                    break
+        finally:
+            self._propagating -= 1
+        if not self._propagating and self._pending:
+            pending, self._pending = self._pending, []
+            for key, entry in pending:
+                self._change(key, entry)
+
+
 class Event(object):
     '''Represents a game event.'''
     #: Used in automatic handler registration etc
@@ -14,6 +73,10 @@ class Event(object):
     #: should be filled by Event subclasses
     #actually, it is better to use metaclasses here so as not to retype same thing in each subclass, but I give you a chance to understand it :-)
     _event_handlers = {}
+    #: names of the arguments an event carries, each subclass declares its own
+    attributes = ()
+    #: events are created for every key press and mouse move, so they have no __dict__
+    __slots__ = ('sender', 'stop_propagating')
 
     def __init__(self, sender, **kwargs):
         """Creates an event.
@@ -25,22 +88,26 @@ class Event(object):
         self.sender = sender
         #: whether this event should not be propagated to other handlers
         self.stop_propagating = False
-        for k,v in kwargs.iteritems():
-            setattr(self, k, v)
+        for k in self.attributes:
+            setattr(self, k, kwargs.get(k))
+
+    @classmethod
+    def from_pygame(cls, sender, event):
+        '''Creates the event from a pygame event, copying only the declared attributes.'''
+        self = cls.__new__(cls)
+        self.sender = sender
+        self.stop_propagating = False
+        attributes = event.dict
+        for k in cls.attributes:
+            setattr(self, k, attributes.get(k))
+        return self
 
     def propagate(self, handlers):
         """Propagates this event to all registered handlers.
-        @param handlers: the list of handlers for this event
-        @type handlers: list
+        @param handlers: the handlers for this event
+        @type handlers: HandlerRegistry
         """
-        for handler in handlers[:]:
-            obj = handler[0]()
-            if obj is not None:
-                handler[1](obj, self)
-            else: #object died
-                handlers.remove(handler)
-            if self.stop_propagating: #handler requested that the event should not be passed to other handlers
-                break
+        handlers.propagate(self)
 
     @classmethod
     def register_event_handler(cls, event, handler):
@@ -48,19 +115,18 @@ class Event(object):
         Handler will be called when specified event occurs in the system, passing appropriate parameters.
         @param event: the event to register handler for
         @type event: str
-        @param handler: callable to call when event occurs
-        @type handler: callable
+        @param handler: bound method to call when event occurs
+        @type handler: instancemethod
         """                
         handlers = cls._event_handlers.get(event, None)
         if handlers is None:
-            raise RuntimeError("event '%s' is not supported")
-        #store a weak reference in order not to prevent object from garbage colecting if it listens for events
-        handlers.append((weakref.ref(handler.im_self), handler.im_func))
+            raise RuntimeError("event '%s' is not supported"%event)
+        handlers.add(handler.im_self, handler.im_func)
 
     @classmethod
     def unregister_event_handler(cls, event, handler):
         """Unregisters a specified event handler."""
-        cls._event_handlers[event].remove((weakref.ref(handler.im_self), handler.im_func))
+        cls._event_handlers[event].remove(handler.im_self)
 
     @classmethod
     def process_event(cls, event):
@@ -73,7 +139,10 @@ class KeyDownEvent(Event):
     attributes: unicode, key, mod
     '''
     name = 'keydown'
-    Event._event_handlers[name] = [] #It is obligatory for all Event subclasses!
+    pygame_type = pygame.KEYDOWN
+    attributes = ('unicode', 'key', 'mod')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry() #It is obligatory for all Event subclasses!
 
 
 class KeyUpEvent(Event):
@@ -81,13 +150,19 @@ class KeyUpEvent(Event):
     attributes: key, mod
     '''
     name = 'keyup'
-    Event._event_handlers[name] = [] #It is obligatory for all Event subclasses!
+    pygame_type = pygame.KEYUP
+    attributes = ('key', 'mod')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry() #It is obligatory for all Event subclasses!
 
 
 class QuitEvent(Event):
     '''User requests to quit.'''
     name = 'quit'
-    Event._event_handlers[name] = []
+    pygame_type = pygame.QUIT
+    attributes = ()
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
 
 
 class ActiveEvent(Event):
@@ -95,7 +170,30 @@ class ActiveEvent(Event):
     attributes: gain, state
     '''
     name = 'active'
-    Event._event_handlers[name] = []
+    pygame_type = pygame.ACTIVEEVENT
+    attributes = ('gain', 'state')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
+
+
+class VideoExposeEvent(Event):
+    '''The contents of the game window have been lost and have to be drawn again.'''
+    name = 'videoexpose'
+    pygame_type = pygame.VIDEOEXPOSE
+    attributes = ()
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
+
+
+class VideoResizeEvent(Event):
+    '''The game window has been resized, its contents have to be drawn again.
+    attributes: size, w, h
+    '''
+    name = 'videoresize'
+    pygame_type = pygame.VIDEORESIZE
+    attributes = ('size', 'w', 'h')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
 
 
 class MouseMotionEvent(Event):
@@ -103,7 +201,10 @@ class MouseMotionEvent(Event):
     attributes: pos, rel, buttons
     '''
     name = 'mousemotion'
-    Event._event_handlers[name] = []
+    pygame_type = pygame.MOUSEMOTION
+    attributes = ('pos', 'rel', 'buttons')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
 
 
 class MouseButtonDownEvent(Event):
@@ -111,7 +212,10 @@ class MouseButtonDownEvent(Event):
     attributes: pos, button
     '''
     name = 'mousebuttondown'
-    Event._event_handlers[name] = []
+    pygame_type = pygame.MOUSEBUTTONDOWN
+    attributes = ('pos', 'button')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
 
 
 class MouseButtonUpEvent(Event):
@@ -119,7 +223,10 @@ class MouseButtonUpEvent(Event):
     attributes: pos, button
     '''
     name = 'mousebuttonup'
-    Event._event_handlers[name] = []
+    pygame_type = pygame.MOUSEBUTTONUP
+    attributes = ('pos', 'button')
+    __slots__ = attributes
+    Event._event_handlers[name] = HandlerRegistry()
 
 class AutoListeningObject(object):
     '''A mixin which registers event handlers based on present methods.
@@ -132,41 +239,81 @@ class AutoListeningObject(object):
     your method event_keydown will be automatically registered as a handler of event type 'keydown'.
     Enjoy!
     '''
+    #: class -> tuple of (handlers, function) for the events the class handles
+    _handled_events = {}
+
+    @classmethod
+    def handled_events(cls):
+        '''Returns the registries and functions of the events handled by the class.
+        It is computed once per class, so objects without handlers pay nothing.'''
+        handled = AutoListeningObject._handled_events.get(cls)
+        if handled is None:
+            handled = []
+            for event_name, handlers in Event._event_handlers.iteritems():
+                handler = getattr(cls, 'event_%s'%event_name, None)
+                if handler is not None:
+                    handled.append((handlers, handler.im_func))
+            handled = AutoListeningObject._handled_events[cls] = tuple(handled)
+        return handled
 
     def __init__(self):
-        for event_name in Event._event_handlers:
-            handler = getattr(self, 'event_%s'%event_name, None)
-            if handler is not None:
-                Event.register_event_handler(event_name, handler)
+        for handlers, function in self.handled_events():
+            handlers.add(self, function)
         super(AutoListeningObject, self).__init__()
 
     def unregister_all_event_handlers(self):
-        for event_name in Event._event_handlers:
-            handler = getattr(self, 'event_%s'%event_name, None)
-            if handler is not None:
-                Event.unregister_event_handler(event_name, handler)
+        for handlers, function in self.handled_events():
+            handlers.remove(self)
 
                 
+#: pygame event type -> Event subclass, other types are blocked by allow_pygame_events
+pygame_events_to_event = dict((klass.pygame_type, klass) for klass in (
+    QuitEvent, ActiveEvent, VideoExposeEvent, VideoResizeEvent, MouseMotionEvent, MouseButtonUpEvent, MouseButtonDownEvent,
+    KeyDownEvent, KeyUpEvent))
+
+
+def allow_pygame_events():
+    '''Tells pygame to queue only the events the game translates, among them those telling that the window has to be drawn again.'''
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(list(pygame_events_to_event))
+
+
 def event_from_pygame_event(sender, event):
     '''Maps pygame event to an appropriate Event subclass.
     @param event: a pygame event to map
     @type event: pygame.event.Event
-    @returns: an instance of Event subclass
+    @returns: an instance of Event subclass or None if the event is not handled by the game
     @rtype: Event
     '''
-    pygame_events_to_event = {
-        'QUIT': QuitEvent,
-        'ACTIVEEVENT': ActiveEvent,
-        'MOUSEMOTION': MouseMotionEvent,
-        'MOUSEBUTTONUP    ': MouseButtonUpEvent,
-        'MOUSEBUTTONDOWN': MouseButtonDownEvent,
-        'KEYDOWN': KeyDownEvent,
-        'KEYUP': KeyUpEvent,
-    }
-    event_name = pygame.event.event_name(event.type).upper()
-    klass = pygame_events_to_event.get(event_name, None)
+    klass = pygame_events_to_event.get(event.type)
     if klass is None:
-        #raise RuntimeError("There is no Event class for event '%s'"%event_name)
-        #print("There is no Event class for event '%s'"%event_name)
         return None
-    return klass(sender, **event.dict)
+    return klass.from_pygame(sender, event)
+
+
+def events_from_pygame_events(sender, pygame_events):
+    '''Maps a batch of pygame events, for example all the events of a frame.
+    Each run of consecutive mouse motions is merged into one event with the last position,
+    the last buttons and the total relative motion.
+    @param pygame_events: events taken from the pygame queue
+    @type pygame_events: list
+    @returns: iterator over instances of Event subclasses
+    '''
+    motion = None
+    for event in pygame_events:
+        klass = pygame_events_to_event.get(event.type)
+        if klass is None:
+            continue
+        if klass is MouseMotionEvent:
+            if motion is None:
+                motion = klass.from_pygame(sender, event)
+            else:
+                motion.rel = (motion.rel[0]+event.rel[0], motion.rel[1]+event.rel[1])
+                motion.pos, motion.buttons = event.pos, event.buttons
+            continue
+        if motion is not None:
+            yield motion
+            motion = None
+        yield klass.from_pygame(sender, event)
+    if motion is not None:
+        yield motion
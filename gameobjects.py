@@ -5,20 +5,30 @@
 
 from collections import namedtuple
 import os
-from weakref import WeakSet 
-import random
 import pygame
-from PodSixNet.Connection import connection, ConnectionListener
 import events
+import spatial
 
-IMAGE_DIR = "Data"
 StepRecord=namedtuple('step_record', ('dest', 'cur_line'))
+
+#: images of the kinds of tiles kept in the game's tile grid
+TILE_IMAGES = {spatial.WALL: 'wall.jpg', spatial.BOX: 'box.jpg'}
 class GameObject(pygame.sprite.Sprite, events.AutoListeningObject):
     '''The base class for all visible entities in the game, which implements generic operations.
     See the base class documentation at http://pygame.org/docs/ref/sprite.html#pygame.sprite
     '''
     #: list of file names of images to load
     image_files=[]
+    #: whether the object takes part in collisions and is kept in the game's spatial index
+    collidable = True
+    #: (class, class of the other object) -> collision handler function or None, filled on demand
+    _collision_handlers = {}
+    #: (class, headless, width, height) -> images of the class, shared by all its instances
+    _shared_images = {}
+    #: (object, its id) the object collided with after its last move; it is only created for objects which move
+    _last_collided = ()
+    #: whether killed objects of the class are kept by the world's pools to be used again, see pools.py
+    pooled = False
 
     def __init__(self, game, x, y, groups=None):
         self.game = game
@@ -29,21 +39,35 @@ class GameObject(pygame.sprite.Sprite, events.AutoListeningObject):
         super(GameObject, self).__init__(*(groups if groups is not None else []))
         #Sprite doesn't call super, so we have to do it manually in order for AutoListeningObject gets initialized
         events.AutoListeningObject.__init__(self)
-        self.images=[]
-        for f in self.image_files:
-            self.images.append(self.load_image(f))
+        if self.collidable:
+            game.add_object(self)
+        self.images = self.shared_images()
         if self.images:
             self.image = self.images[0]
-        self._last_collided = WeakSet ()
+
+    def reset(self, *args, **kwargs):
+        '''Initializes a killed object again with the arguments of the constructor, making it the same as a new one.'''
+        self.__dict__.clear()
+        self.__init__(*args, **kwargs)
+
+    def shared_images(self):
+        '''Returns the images listed in image_files, which are loaded once per class and size.'''
+        key = (self.__class__, self.game.headless, self.width, self.height)
+        images = GameObject._shared_images.get(key)
+        if images is None:
+            images = GameObject._shared_images[key] = tuple(self.load_image(f) for f in self.image_files)
+        return images
 
     def update_rect(self):
         self.rect = pygame.rect.Rect(self.screen_x, self.screen_y, self.width, self.height)
+        if self.collidable:
+            self.game.object_moved(self)
 
     def update(self):
         """Updates the object's state.
-        It is called on each core frame."""
-        if self.image is not None:
-            self.update_rect()
+        It is called on each core frame. Objects keep their rects up to date when they move,
+        so there is nothing to do by default."""
+        pass
 
     @property
     def width(self):
@@ -54,20 +78,11 @@ class GameObject(pygame.sprite.Sprite, events.AutoListeningObject):
         return self.game.side-1
 
     def load_image(self, file_name):
-        """Manages caching and transformation of image."""
-        cache = getattr(GameObject, '_image_cache', {})
-        image = cache.get(file_name, None)
-        if image is None:
-            image = pygame.transform.smoothscale(pygame.image.load(os.path.join(IMAGE_DIR, file_name)), (self.width, self.height))
-            cache[file_name] = image
-            setattr(GameObject, '_image_cache', cache)
-        return image
-
-    @classmethod
-    def invalidate_cache(cls):
-        cache = getattr(cls, '_image_cache')
-        if cache is not None:
-            cache.clear()
+        """Returns the image scaled to the size of the object, the game's asset manager caches it.
+        Nothing is loaded if the game is headless."""
+        if self.game.headless:
+            return None
+        return self.game.assets.image(file_name, (self.width, self.height))
 
     @property
     def screen_x(self):
@@ -78,47 +93,97 @@ class GameObject(pygame.sprite.Sprite, events.AutoListeningObject):
         return self.game.ycoord_to_screen(self.y)
 
     def kill(self):
+        #an object may be killed more times, it is given to the pool only the first time
+        released = self.pooled and self.alive()
         super(GameObject, self).kill()
         self.unregister_all_event_handlers()
+        if self.collidable:
+            self.game.remove_object(self)
+        if released:
+            self.game.pools.release(self)
         
     def move(self,dx,dy):
-        '''Manages collision detection on movement.'''
+        '''Manages collision detection on movement.
+        The collisions are checked at the new position before the index is told about it, so the index is updated
+        once if the object moves and not at all if it is stopped.'''
         oldx, oldy, oldrect = self.x, self.y, self.rect
         self.x+=dx
         self.y+=dy
-        self.update_rect()
-        collides=pygame.sprite.spritecollide(self,self.game.all,False)
-        can_move=True
+        rect = self.rect = pygame.rect.Rect(self.screen_x, self.screen_y, self.width, self.height)
+        collides=[obj for obj in self.game.index.query(rect) if obj is not self]
+        can_move=not self.game.blocked(rect)
         for obj in collides:
-            if obj is not self:
-                can_move&=self.collide(obj)&obj.collide(self)
+            can_move&=self.collide(obj)&obj.collide(self)
+        #the rect the index knows: the old one, or the one a handler has moved the object to, as ExchangePlacesBonus does
+        indexed = oldrect if self.rect is rect else self.rect
         if not can_move:
             self.x, self.y, self.rect = oldx, oldy, oldrect
-        collides = WeakSet (collides)
-        stop_colliding = self._last_collided-collides
-        for obj in stop_colliding:
-            obj.stop_colliding(self)
-        self._last_collided=collides
+        if self.collidable and self.rect is not indexed:
+            self.game.object_moved(self)
+        if self._last_collided:
+            for obj, net_id in self._last_collided:
+                #an object which has been killed and used again by a pool since is another object
+                if obj.net_id == net_id and obj not in collides:
+                    obj.stop_colliding(self)
+        self._last_collided = tuple((obj, obj.net_id) for obj in collides)
         return can_move
 
+    @classmethod
+    def collision_handler(cls, other_class):
+        '''Finds the method handling collisions with objects of the other class.
+        A method named 'collide_otherclassname' is looked for, trying the other class and then its bases,
+        so a handler for a class also serves its subclasses. The result is remembered for the pair of classes.
+        @returns: the function of the method or None if the class has no handler
+        '''
+        key = (cls, other_class)
+        handlers = GameObject._collision_handlers
+        if key not in handlers:
+            func = None
+            for klass in other_class.__mro__:
+                method = getattr(cls, 'collide_%s'%klass.__name__, None)
+                if method is not None:
+                    func = method.im_func
+                    break
+            handlers[key] = func
+        return handlers[key]
+
     def collide(self, other):
         '''By default, it searches a method named 'collide_otherclassname' and calls it if exist.
         for example, if object implements method named 'collide_Player', it would be called when player collides with this object.
         @returns: whether the movement can be continued
         @rtype: bool
         '''
-        func = getattr(self, 'collide_%s'%other.__class__.__name__, None)
-        if func is not None:
-            return func(other)  
-        return True
+        try:
+            func = self._collision_handlers[self.__class__, other.__class__]
+        except KeyError:
+            func = self.collision_handler(other.__class__)
+        if func is None:
+            return True
+        return func(self, other)
 
     def stop_colliding(self, other):
         '''Called when obj moves out of self.'''
         pass
 
+    def get_state(self):
+        '''Returns a copy of the object's attributes which set_state() can bring back.
+        The values are not copied, so subclasses have to copy the ones they change in place.'''
+        state = self.__dict__.copy()
+        #the groups the object is in are kept by the game
+        del state['_Sprite__g']
+        return state
+
+    def set_state(self, state):
+        '''Restores the attributes saved by get_state().'''
+        groups = self._Sprite__g
+        self.__dict__.clear()
+        self.__dict__.update(state)
+        self._Sprite__g = groups
+
 
 class Bonus(GameObject):
     '''Represents an item which affects the player on collision and then disappears.'''
+    pooled = True
 
     def __init__(self, game, x, y, groups=None):
         super(Bonus,self).__init__(game, x, y, groups)
@@ -146,7 +211,6 @@ class Bonus(GameObject):
     def update(self):
         self.cur_ind = (self.cur_ind + 1) % len(self.image_files)
         self.image = self.images[self.cur_ind]
-        super(Bonus,self).update()
 
 class SpeedUpBonus(Bonus):
     '''Class representing bonus, increasing the player's speed by 0.5'''
@@ -216,8 +280,8 @@ class ExchangePlacesBonus(Bonus):
     
     def affect_player(self, player):
         tempx, tempy = player.x, player.y
-        rand_player = random.choice(self.game.players[:self.game.players_alive ])
-        while rand_player == player:  rand_player=random.choice(self.game.players[:self.game.players_alive])
+        rand_player = self.game.random.choice(self.game.players[:self.game.players_alive ])
+        while rand_player == player:  rand_player=self.game.random.choice(self.game.players[:self.game.players_alive])
         player.x = rand_player.x
         player.y = rand_player.y
         rand_player.x = tempx
@@ -230,6 +294,7 @@ class ExchangePlacesBonus(Bonus):
 class Bomb(GameObject):
     '''A class introducing Bomb, which can be put by player'''
     image_files = ['bomb.png']
+    pooled = True
 
     def __init__(self, player, game, x, y, *args, **kwargs):
         self.player, self.game, self.x, self.y =player, game, x, y
@@ -263,35 +328,47 @@ class Bomb(GameObject):
     def collide_Bomb(self, bomb):
         return False
 
+    #: rays of the explosion as (dx, dy, distance of the first cell); the first ray also burns the bomb's own cell
+    rays = ((1, 0, 0), (-1, 0, 1), (0, 1, 1), (0, -1, 1))
+
     def explode(self):
-        '''Makes current bomb explode and releases the fire'''
+        '''Sets the bomb off. It explodes at the end of the tick together with the other bombs set off,
+        see Simulation.resolve_explosions.'''
+        self.game.set_off(self)
+
+    def detonate(self):
+        '''Takes the bomb off the level and finds where its fire goes.
+        @returns: (cells, box, hits) of each ray, see blast()
+        @rtype: list
+        '''
         self.kill()
-        random.choice(self.game.explosions).play()
+        self.game.play_explosion()
         self.player.bombs+=1
-        for xx in range(int(round(self.x)),int(round(self.x)+self.player.radius+1)):
-            if xx<self.game.width-1 and self.check(xx,round(self.y)): break
-            
-        for xx in range(int(round(self.x)-1),int(round(self.x)-self.player.radius-1),-1):
-            if xx>0 and self.check(xx,round(self.y)): break
-
-        for yy in range(int(round(self.y)+1),int(round(self.y)+self.player.radius+1)):
-            if yy<self.game.height-1 and self.check(round(self.x),yy): break
-
-        for yy in range(int(round(self.y)-1),int(round(self.y)-self.player.radius-1),-1):
-            if yy>0 and self.check(round(self.x),yy): break
-
-    def check(self,dx,dy):
-        '''Checks if fire can move futher'''
-        ret=False
-        fire=Fire(self.game,self.player,dx,dy,groups=(self.game.all,self.game.dynamic))
-        destroyed=pygame.sprite.spritecollide(fire,self.game.destroyable,False)
-        for obj in destroyed:
-            obj.collide(fire)
-            ret=True
-        if len(pygame.sprite.spritecollide(fire,self.game.walls,False))>0: 
-            fire.kill()
-            ret=True
-        return ret
+        x, y = int(round(self.x)), int(round(self.y))
+        return [self.blast(x, y, dx, dy, first) for dx, dy, first in self.rays]
+
+    def blast(self, x, y, dx, dy, first):
+        '''Finds how far one ray of the explosion goes, using the tile grid and the spatial index.
+        The ray stops before a wall and at the first cell where something can be destroyed.
+        @returns: the cells which burn, whether the last of them holds a box and the objects hit there
+        @rtype: tuple(list, bool, list)
+        '''
+        game = self.game
+        cells, hits = [], []
+        for distance in range(first, self.player.radius+1):
+            cx, cy = x+dx*distance, y+dy*distance
+            if not (0<cx<game.width-1 and 0<cy<game.height-1):
+                break
+            tile = game.grid.get(cx, cy)
+            if tile == spatial.WALL:
+                break
+            cells.append((cx, cy))
+            if tile == spatial.BOX:
+                return cells, True, []
+            hits = game.index.query(game.tile_rect(cx, cy), game.destroyable)
+            if hits:
+                break
+        return cells, False, hits
 
     def update(self):
         if self.dest != None:
@@ -307,6 +384,7 @@ class Bomb(GameObject):
 class Fire(GameObject):
     '''The class representing the fire which appears straight after the bomb explosion'''
     image_files = ['fire.jpg']
+    pooled = True
 
     def __init__(self, game, player, x, y, *args, **kwargs):
         self.player, self.game, self.x, self.y =player, game, x, y
@@ -329,42 +407,14 @@ class Fire(GameObject):
         return False
 
 
-class Wall(GameObject):
-    '''An obstacle which player can not get through.'''
-    image_files = ['wall.jpg']
+#: bonuses a destroyed box may leave, more frequent ones are listed several times
+BOX_BONUSES = (SpeedUpBonus, AddBombBonus, MoveBombsBonus, IncreaseRadiusBonus, ExchangePlacesBonus, ReduceRadiusBonus, SpeedDownBonus, IncreaseRadiusBonus, SpeedUpBonus, AddBombBonus)
 
-    def collide_Player(self, player):
-        return False
 
-    def collide_Fire(self, fire):
-        return False
-        
-    def collide_Bomb(self, bomb):
-        return False
-
-
-class Box(Wall):
-    '''An obstacle which can be ruined by a bomb explosion.'''
-    image_files = ['box.jpg']
-
-    def collide_Fire(self,fire):
-        '''When colliding fire, the wall may generate bonus''' 
-        x=random.choice([True,False])
-        #Only good bonuses by now
-        w=random.choice([SpeedUpBonus,AddBombBonus,MoveBombsBonus,IncreaseRadiusBonus, ExchangePlacesBonus, ReduceRadiusBonus, SpeedDownBonus,IncreaseRadiusBonus,SpeedUpBonus,AddBombBonus])
-        if x: w(self.game,self.x,self.y,[self.game.all,self.game.destroyable,self.game.bonuses])
-        self.kill()
-        return False
-
-    def collide_Player(self, player):
-        return False 
-
-    def collide_Bomb(self, bomb):
-        return False
-
-
-class Player(GameObject, ConnectionListener):
+class Player(GameObject):
     '''Represents a player in the game.'''
+    #: methods which can be called by a controller, in a network game they are sent to the server by their names
+    commands = ('go_up', 'go_down', 'go_left', 'go_right', 'stop', 'put_bomb')
 
     def __init__(self, game, x, y, id, *args, **kwargs):
         self.id = id
@@ -378,38 +428,40 @@ class Player(GameObject, ConnectionListener):
         self.moving = False
         super(Player, self).__init__(game, x,y, *args, **kwargs)
         self.create_images()
-        self.image = Player.player_images[id][0][0]
+        self.image = self.player_images[id][0][0]
 
     def collide_Player(self, player):
         return True #Player can move further
 
     def collide_Fire(self, fire):
-        if self.game.is_network_game:
-            if self.game.is_server:
-                connection.Send({'action': 'fire', 'player_id': self.id, 'fire_player_id': fire.player.id})
-                connection.Pump()
-                self.game.server.Pump()
-                self.fire(fire.player.id)
-        else:
-            self.fire(fire.player.id)
+        self.fire(fire.player.id)
         return False
 
     def create_images(self):
-        Player.player_images = [dirs for dirs in os.listdir(os.path.join('Data','players'))]
-        for dirs in os.listdir(os.path.join('Data','players')):
-            self.player_images[self.cur_line] = [dir for dir in sorted(os.listdir(os.path.join('Data','players',dirs)))]
-            for dir in os.listdir(os.path.join('Data','players',dirs)):
-                self.player_images[self.cur_line][self.cur_pic] = [self.load_image(os.path.join('players',dirs,dir,filename)) for filename in os.listdir(os.path.join('Data','players',dirs,dir))]
-                self.cur_pic += 1
-            self.cur_line += 1
-            self.cur_pic = 0
-        self.cur_line = 0
+        '''Builds the animation frames of all the players from the asset manifest:
+        player_images[player id][direction][frame], directions are sorted as down, left, right, up.
+        The frames are shared by all the players of the same size.'''
+        key = ('players', self.game.headless, self.width, self.height)
+        self.player_images = GameObject._shared_images.get(key)
+        if self.player_images is None:
+            listdir = self.game.assets.listdir
+            self.player_images = GameObject._shared_images[key] = [
+                [[self.load_image(os.path.join('players', dirs, dir, filename)) for filename in listdir(os.path.join('players', dirs, dir))]
+                    for dir in listdir(os.path.join('players', dirs))]
+                for dirs in listdir('players')]
+
+    def get_state(self):
+        state = super(Player, self).get_state()
+        state['steps'] = list(self.steps)
+        return state
+
+    def set_state(self, state):
+        super(Player, self).set_state(state)
+        self.steps = list(self.steps)
 
     def add_step(self, step_record):
         self.moving = True
         self.steps.append(step_record)
-        if self.game.is_network_game:
-            connection.Send({'action': 'step', 'dest': step_record.dest, 'cur_line': step_record.cur_line, 'x': self.x, 'y': self.y, 'player_id': self.id})
         self.last_step = step_record
 
     def stop(self):
@@ -433,7 +485,7 @@ class Player(GameObject, ConnectionListener):
             self.time_moving-=d
             self.cur_line = self.steps[0].cur_line
             self.move(self.steps[0].dest[0]*d*self.speed, self.steps[0].dest[1]*d*self.speed)
-            self.cur_pic = (self.cur_pic + 1)% len(Player.player_images[self.id][self.cur_line]) # let the animation go
+            self.cur_pic = (self.cur_pic + 1)% len(self.player_images[self.id][self.cur_line]) # let the animation go
             if self.time_moving == 0: #end of the current step
                 del self.steps[0]
         if self.time_moving == 0 and self.steps: # we have steps in the queue
@@ -441,31 +493,12 @@ class Player(GameObject, ConnectionListener):
 
     def put_bomb(self):
         '''Current player puts the bomb if he has the one'''
-        if not pygame.sprite.spritecollide(self,self.game.bombs,False):
+        if not self.game.index.collide(self,self.game.bombs):
             if self.bombs>0:
-                if self.game.is_network_game:
-                    connection.Send({'action': 'put_bomb', 'player_id': self.id, 'x': self.x, 'y': self.y})
                 self.bombs-=1
-                Bomb(self,self.game,round(self.x),round(self.y),groups=(self.game.all,self.game.bombs,self.game.destroyable))
-
-    def Network_put_bomb(self, data):
-        if not data['player_id']==self.id:
-            return
-            self.x = data['x']
-            self.y = data['y']
-        self.put_bomb()
-
-    def Network_step(self, data):
-        if not data['player_id']==self.id:
-            return
-        #self.steps = []
-        self.time_moving = self.game.step_length/self.speed
-        self.steps.append(StepRecord(data['dest'], data['cur_line']))
-        self.x = data['x']
-        self.y = data['y']
+                self.game.pools.create(Bomb,self,self.game,round(self.x),round(self.y),groups=(self.game.all,self.game.bombs,self.game.destroyable))
 
     def update(self):
-        self.Pump()
         self.update_rect()
         self.perform_step()
         if self.moving and not self.steps:
@@ -482,18 +515,13 @@ class Player(GameObject, ConnectionListener):
             if self.bad_radius<0:
                 self.radius=self.temp_radius
                 self.temp_radius=None
-        self.image = Player.player_images[self.id][self.cur_line][self.cur_pic]
+        self.image = self.player_images[self.id][self.cur_line][self.cur_pic]
 
     def move_up_to(self):
         '''Function for truncating the player added for easier getting to the position'''
         self.x=round(self.x)
         self.y=round(self.y)
 
-    def Network_fire(self, data):
-        if not data['player_id']==self.id:
-            return
-        self.fire(data['fire_player_id'])
-
     def fire(self, fire_player_id):
         self.game.players_alive-=1
         if self.id == fire_player_id: 
@@ -503,7 +531,8 @@ class Player(GameObject, ConnectionListener):
         self.kill()
 
     def kill(self):
-        if self.game.players_alive<2:
+        #players burnt by the same explosion are killed one by one, the match ends only once
+        if self.game.players_alive<2 and not self.game.finished:
             self.game.end_game()
         super(Player, self).kill()
 
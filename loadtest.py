@@ -0,0 +1,348 @@
+#loadtest.py
+#Copyright (C) 2011 PyTeam
+
+'''Load test of the network server with synthetic clients.
+A LobbyServer is started in a child process on localhost, so it has a CPU of its own, and any number of clients
+connect to it from this process. The clients play like people at the keyboard: they send movement commands
+and put bombs at the given rates, acknowledge snapshots, or with rollback netcode send the commands of every tick
+to be relayed to the others. They never simulate or draw anything, and nothing needs a display.
+A client leaves its match when the match is over or has been played long enough, and connects again.
+
+The report shows:
+    how long the server's ticks take and how many room steps were made late, more than a tick after they were due;
+    how late the snapshots and the relayed commands arrive, measured from the time the tick they belong to began
+    on the client's clock, which starts when the match does; messages later than --late-ms are counted as late;
+    bytes and messages per second in both directions;
+    messages dropped by the server's outboxes because a newer one of the same kind replaced them before they were sent.
+
+Running 32 clients against a server relaying their commands with rollback netcode for 30 seconds:
+    python loadtest.py --clients 32 --netcode rollback --duration 30
+'''
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+from timeit import default_timer
+#the report is printed to the standard output, where pygame would greet the user
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+from PodSixNet.Channel import Channel
+from PodSixNet.EndPoint import EndPoint
+from PodSixNet.asyncwrapper import poll
+import controllers
+import server
+from simulation import Simulation
+from snapshot import Snapshot
+
+#: commands a client walks with
+MOVES = ('go_up', 'go_down', 'go_left', 'go_right', 'stop')
+
+
+def percentiles(values, points=(50, 90, 99)):
+    '''Returns the percentiles and the maximum of the values by their names, None for each if there are no values.
+    @rtype: dict'''
+    values = sorted(values)
+    result = {}
+    for point in points:
+        result['p%d'%point] = values[min(len(values)-1, len(values)*point//100)] if values else None
+    result['max'] = values[-1] if values else None
+    return result
+
+
+class CountingOutbox(controllers.Outbox):
+    '''Outbox which counts the messages replaced by newer ones before they were sent.'''
+    dropped = 0
+
+    def put(self, data):
+        queued = len(self.messages)
+        controllers.Outbox.put(self, data)
+        self.dropped += queued+1-len(self.messages)
+
+
+class LoadChannel(server.LobbyChannel):
+    '''Connection of the server to a client, counting the traffic.'''
+
+    def __init__(self, *args, **kwargs):
+        server.LobbyChannel.__init__(self, *args, **kwargs)
+        self.outbox = CountingOutbox(self)
+
+    def collect_incoming_data(self, data):
+        self._server.bytes_in += len(data)
+        server.LobbyChannel.collect_incoming_data(self, data)
+
+    def found_terminator(self):
+        self._server.messages_in += 1
+        server.LobbyChannel.found_terminator(self)
+
+    def Send(self, data):
+        sent = server.LobbyChannel.Send(self, data)
+        self._server.bytes_out += sent
+        self._server.messages_out += 1
+        return sent
+
+    def Close(self):
+        self._server.dropped += self.outbox.dropped
+        self.outbox.dropped = 0
+        server.LobbyChannel.Close(self)
+
+
+class LoadServer(server.LobbyServer):
+    '''The dedicated server timing its ticks.'''
+    channelClass = LoadChannel
+
+    def __init__(self, *args, **kwargs):
+        server.LobbyServer.__init__(self, *args, **kwargs)
+        self.bytes_in = self.bytes_out = self.messages_in = self.messages_out = self.dropped = 0
+        #: seconds taken by the ticks which stepped some room
+        self.tick_times = []
+        #: seconds the rooms were behind their schedule when they were stepped
+        self.delays = []
+        self.matches_started = 0
+
+    def tick(self, now):
+        running = set(room for room in self.rooms.values() if room.match is not None)
+        due = [now-room.next_tick for room in running if now >= room.next_tick]
+        started = default_timer()
+        server.LobbyServer.tick(self, now)
+        if due:
+            self.tick_times.append(default_timer()-started)
+            self.delays.extend(due)
+        self.matches_started += sum(1 for room in self.rooms.values() if room.match is not None and room not in running)
+
+    def stats(self):
+        dropped = self.dropped+sum(channel.outbox.dropped for channel in self.channels)
+        return {'tick_times': self.tick_times, 'delays': self.delays, 'matches_started': self.matches_started,
+                'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out, 'messages_in': self.messages_in,
+                'messages_out': self.messages_out, 'dropped': dropped}
+
+
+def serve(pipe, maps_dir, start_delay, netcode):
+    '''Runs the server in the child process until the pipe asks for its statistics.'''
+    #PodSixNet prints a line for each connection, which would be mixed into the report
+    sys.stdout = open(os.devnull, 'w')
+    lobby = LoadServer(maps_dir, start_delay, netcode=netcode, localaddr=('127.0.0.1', 0))
+    pipe.send(lobby.socket.getsockname()[1])
+    while not pipe.poll():
+        lobby.tick(time.time())
+        for channel in lobby.channels:
+            channel.Pump()
+        poll(min(0.01, max(0.0, lobby.next_deadline(time.time())-time.time())), map=lobby._map)
+    pipe.send(lobby.stats())
+
+
+class SyntheticClient(EndPoint):
+    '''A client playing like a person at the keyboard.'''
+
+    def __init__(self, test, address, socket_map):
+        '''@param test: the LoadTest the client reports to'''
+        EndPoint.__init__(self, address, map=socket_map)
+        self.test = test
+        self.random = random.Random(test.random.getrandbits(32))
+        #: when the match started on the client's clock, None outside a match
+        self.started = None
+        self.netcode = None
+        #: the next tick whose commands a rollback client sends
+        self.tick = 0
+        self.closed = False
+        self.DoConnect()
+
+    def Network(self, data):
+        '''EndPoint queues every message for a reader, here they are handled by the Network_ methods.'''
+        pass
+
+    def collect_incoming_data(self, data):
+        self.test.bytes_received += len(data)
+        EndPoint.collect_incoming_data(self, data)
+
+    def found_terminator(self):
+        self.test.messages_received += 1
+        EndPoint.found_terminator(self)
+
+    def Send(self, data):
+        sent = EndPoint.Send(self, data)
+        self.test.bytes_sent += sent
+        self.test.messages_sent += 1
+        return sent
+
+    def Network_batch(self, data):
+        controllers.unpack_batch(self, data)
+
+    def Network_start_game(self, data):
+        self.started = default_timer()
+        self.netcode = data.get('netcode', 'snapshot')
+        self.tick = 0
+
+    def Network_snapshot(self, data):
+        if self.started is None:
+            return
+        tick, finished = Snapshot.peek(data['data'])
+        #the server makes the first step of a match as soon as it starts it
+        self.test.arrived(default_timer()-(self.started+(tick-1)*Simulation.tick_length))
+        if finished:
+            self.leave()
+        else:
+            self.Send({'action': 'ack', 'tick': tick})
+
+    def Network_inputs(self, data):
+        if self.started is not None:
+            self.test.arrived(default_timer()-(self.started+data['tick']*Simulation.tick_length))
+
+    def Close(self):
+        EndPoint.Close(self)
+        self.closed = True
+
+    def Error(self, error):
+        self.test.errors += 1
+        self.closed = True
+
+    def ConnectionError(self):
+        self.Error(None)
+
+    def leave(self):
+        '''Disconnects; the load test connects a new client instead.'''
+        self.close()
+        self.closed = True
+        self.started = None
+
+    def play(self, now):
+        '''Sends the commands of the ticks which have begun since the last call.'''
+        if self.started is None or self.closed:
+            return
+        test = self.test
+        if now-self.started > test.match_length:
+            self.leave()
+            return
+        while self.started+self.tick*Simulation.tick_length <= now:
+            commands = []
+            if self.random.random() < test.move_rate*Simulation.tick_length:
+                commands.append(self.random.choice(MOVES))
+            if self.random.random() < test.bomb_rate*Simulation.tick_length:
+                commands.append('put_bomb')
+            if self.netcode == 'rollback':
+                self.Send({'action': 'inputs', 'tick': self.tick, 'commands': commands})
+            else:
+                for command in commands:
+                    self.Send({'action': 'input', 'command': command})
+            self.tick += 1
+        #the sockets of all the clients are polled together by the load test
+        Channel.Pump(self)
+
+
+class LoadTest(object):
+    '''Runs synthetic clients against a server in a child process and collects the measurements.'''
+
+    def __init__(self, clients=16, duration=30.0, netcode='snapshot', maps_dir='Maps', move_rate=4.0, bomb_rate=0.5,
+                 match_length=60.0, ramp=2.0, start_delay=1.0, late_ms=100.0, seed=0):
+        '''@param move_rate: movement commands a client sends per second
+           @param bomb_rate: bombs a client puts per second
+           @param match_length: seconds after which a client leaves its match and connects again
+           @param ramp: seconds over which the clients connect
+           @param start_delay: seconds a room waits for more players, see server.LobbyServer
+           @param late_ms: milliseconds after which a snapshot or relayed commands are counted as late'''
+        self.clients, self.duration, self.netcode, self.maps_dir = clients, duration, netcode, maps_dir
+        self.move_rate, self.bomb_rate, self.match_length = move_rate, bomb_rate, match_length
+        self.ramp, self.start_delay, self.late = ramp, start_delay, late_ms/1000.0
+        self.random = random.Random(seed)
+        self.bytes_sent = self.bytes_received = self.messages_sent = self.messages_received = 0
+        #: seconds by which the snapshots and relayed commands arrived after their ticks began
+        self.lateness = []
+        self.reconnects = self.errors = 0
+
+    def arrived(self, lateness):
+        self.lateness.append(max(0.0, lateness))
+
+    def run(self):
+        '''Runs the test.
+        @returns: the results, see report()
+        @rtype: dict'''
+        pipe, child_pipe = multiprocessing.Pipe()
+        child = multiprocessing.Process(target=serve, args=(child_pipe, self.maps_dir, self.start_delay, self.netcode))
+        child.daemon = True
+        child.start()
+        try:
+            address = ('127.0.0.1', pipe.recv())
+            socket_map = {}
+            clients = []
+            started = default_timer()
+            now = started
+            while now-started < self.duration:
+                wanted = self.clients if self.ramp <= 0 else min(self.clients, int(self.clients*(now-started)/self.ramp)+1)
+                while len(clients) < wanted:
+                    clients.append(SyntheticClient(self, address, socket_map))
+                for number, client in enumerate(clients):
+                    if client.closed:
+                        self.reconnects += 1
+                        client = clients[number] = SyntheticClient(self, address, socket_map)
+                    client.play(now)
+                poll(0.001, map=socket_map)
+                now = default_timer()
+            elapsed = now-started
+            for client in clients:
+                if not client.closed:
+                    client.close()
+            pipe.send('stop')
+            stats = pipe.recv()
+        finally:
+            child.join(5)
+            if child.is_alive():
+                child.terminate()
+        late = sum(1 for lateness in self.lateness if lateness > self.late)
+        return {
+            'clients': self.clients, 'netcode': self.netcode, 'seconds': elapsed,
+            'matches_started': stats['matches_started'], 'reconnects': self.reconnects, 'errors': self.errors,
+            'tick_ms': dict((name, value*1000 if value is not None else None) for name, value in percentiles(stats['tick_times']).iteritems()),
+            'ticks': len(stats['tick_times']),
+            'late_steps': sum(1 for delay in stats['delays'] if delay > Simulation.tick_length),
+            'steps': len(stats['delays']),
+            'lateness_ms': dict((name, value*1000 if value is not None else None) for name, value in percentiles(self.lateness).iteritems()),
+            'late_messages': late, 'timed_messages': len(self.lateness),
+            'dropped_messages': stats['dropped'],
+            'server_bytes_in_per_second': stats['bytes_in']/elapsed, 'server_bytes_out_per_second': stats['bytes_out']/elapsed,
+            'server_messages_in_per_second': stats['messages_in']/elapsed, 'server_messages_out_per_second': stats['messages_out']/elapsed,
+            'client_bytes_sent': self.bytes_sent, 'client_bytes_received': self.bytes_received,
+        }
+
+
+def report(results):
+    '''Returns the lines of a readable report of the results of LoadTest.run().
+    @rtype: list'''
+    def ms(values):
+        return ', '.join('%s %s'%(name, '-' if values[name] is None else '%.2f ms'%values[name]) for name in ('p50', 'p90', 'p99', 'max'))
+    return [
+        '%d clients, %s netcode, %.1f s, %d matches started, %d reconnects, %d connection errors'%(
+            results['clients'], results['netcode'], results['seconds'], results['matches_started'], results['reconnects'], results['errors']),
+        'server ticks: %d, %s (a tick is %.0f ms)'%(results['ticks'], ms(results['tick_ms']), Simulation.tick_length*1000),
+        'late steps: %d of %d'%(results['late_steps'], results['steps']),
+        'message lateness: %s'%ms(results['lateness_ms']),
+        'late messages: %d of %d, dropped by the server: %d'%(results['late_messages'], results['timed_messages'], results['dropped_messages']),
+        'server in: %.0f B/s, %.0f msg/s; out: %.0f B/s, %.0f msg/s'%(
+            results['server_bytes_in_per_second'], results['server_messages_in_per_second'],
+            results['server_bytes_out_per_second'], results['server_messages_out_per_second']),
+    ]
+
+
+if __name__=="__main__":
+    import json
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--clients', type='int', default=16, help='number of synthetic clients')
+    parser.add_option('-d', '--duration', type='float', default=30.0, help='seconds the load lasts')
+    parser.add_option('-n', '--netcode', choices=sorted(controllers.matches), default='snapshot', help='snapshot or rollback')
+    parser.add_option('-m', '--maps', default='Maps', help='directory with the maps')
+    parser.add_option('--move-rate', type='float', default=4.0, help='movement commands a client sends per second')
+    parser.add_option('--bomb-rate', type='float', default=0.5, help='bombs a client puts per second')
+    parser.add_option('--match-length', type='float', default=60.0, help='seconds after which a client leaves its match and connects again')
+    parser.add_option('--ramp', type='float', default=2.0, help='seconds over which the clients connect')
+    parser.add_option('--start-delay', type='float', default=1.0, help='seconds a room waits for more players')
+    parser.add_option('--late-ms', type='float', default=100.0, help='milliseconds after which a message is late')
+    parser.add_option('-s', '--seed', type='int', default=0, help='seed of the clients\' random generators')
+    parser.add_option('-o', '--output', help='write the results as JSON into this file as well')
+    options, args = parser.parse_args()
+    test = LoadTest(options.clients, options.duration, options.netcode, options.maps, options.move_rate, options.bomb_rate,
+                    options.match_length, options.ramp, options.start_delay, options.late_ms, options.seed)
+    results = test.run()
+    print '\n'.join(report(results))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,237 @@
+#maps.py
+#Copyright (C) 2011 PyTeam
+
+'''Maps of the levels.
+The source format is the text .bff file: a line with the height, the width and the most players of the level,
+then a line of characters for each row of tiles: W is a wall, B a box, S a spawn point and a space the floor.
+A map is compiled into a .bffc file next to its source when it is loaded for the first time. The compiled file holds
+a header, the spawn points and the tiles packed into a byte each, and it is mapped into memory instead of parsed.
+It is used only while the source has the mtime and size it was compiled from, so editing a .bff is enough.
+
+MapIndex lists the maps of a directory without reading them: their metadata is kept in an index file
+and a map is loaded again only when its source has changed.
+'''
+
+import base64
+import glob
+import json
+import mmap
+import os
+import string
+import struct
+import zlib
+from collections import namedtuple
+import spatial
+
+MAGIC = 'PBMC'
+#: version of the compiled format
+VERSION = 1
+#: extension of the compiled maps
+COMPILED = '.bffc'
+
+#magic, version, mtime and size of the source, height, width, most players, number of spawn points
+_header = struct.Struct('<4sHdIHHHH')
+_spawn = struct.Struct('<HH')
+#characters of the source format -> kinds of tiles
+_tiles = string.maketrans('WBS ', chr(spatial.WALL)+chr(spatial.BOX)+chr(spatial.EMPTY)*2)
+_symbols = 'WBS '
+#kinds of tiles -> characters of the source format, spawn points are put in separately
+_symbols_of_tiles = string.maketrans(chr(spatial.EMPTY)+chr(spatial.WALL)+chr(spatial.BOX), ' WB')
+
+#: what MapIndex knows about a map
+MapInfo = namedtuple('MapInfo', ('name', 'path', 'height', 'width', 'max_players', 'spawns'))
+
+
+class Map(object):
+    '''The tiles and spawn points of a level.'''
+
+    def __init__(self, height, width, max_players, spawns, tiles):
+        '''@param spawns: (x, y) of the spawn points, row by row
+           @type spawns: list
+           @param tiles: a byte per tile, row by row, see spatial.TileGrid
+           @type tiles: str'''
+        self.height = height
+        self.width = width
+        self.max_players = max_players
+        self.spawns = spawns
+        self.tiles = tiles
+
+    @classmethod
+    def parse(cls, text):
+        '''Reads a map in the source format.
+        @raise RuntimeError: if the map is malformed'''
+        lines = text.splitlines()
+        height, width, max_players = [int(x) for x in lines[0].split()]
+        rows = [row.strip() for row in lines[1:]]
+        if len(rows) > height:
+            raise RuntimeError('Too many lines in the file')
+        if len(rows) < height:
+            raise RuntimeError('Insuficient number of rows')
+        spawns = []
+        for y, row in enumerate(rows):
+            if len(row) > width:
+                raise RuntimeError('Too many colums in row %d'%(y+1))
+            if len(row) < width:
+                raise RuntimeError('Insuficient number of colums in row %d'%(y+1))
+            if row.translate(None, _symbols):
+                x = [col for col, symbol in enumerate(row) if symbol not in _symbols][0]
+                raise RuntimeError('Unknown symbol "%s" in row %d, col %d'%(row[x], y+1, x+1))
+            x = row.find('S')
+            while x != -1:
+                spawns.append((x, y))
+                x = row.find('S', x+1)
+        return cls(height, width, max_players, spawns, ''.join(rows).translate(_tiles))
+
+    def source(self):
+        '''Returns the map in the source format.'''
+        grid = bytearray(self.tiles.translate(_symbols_of_tiles))
+        for x, y in self.spawns:
+            grid[y*self.width+x] = 'S'
+        rows = [str(grid[y*self.width:(y+1)*self.width]) for y in range(self.height)]
+        return '%d %d %d\n'%(self.height, self.width, self.max_players)+'\n'.join(rows)+'\n'
+
+    def pack(self, mtime=0.0, size=0):
+        '''Returns the map in the compiled format.
+        @param mtime: mtime of the source file
+        @param size: size of the source file'''
+        parts = [_header.pack(MAGIC, VERSION, mtime, size, self.height, self.width, self.max_players, len(self.spawns))]
+        parts.extend(_spawn.pack(x, y) for x, y in self.spawns)
+        parts.append(self.tiles)
+        return ''.join(parts)
+
+    @classmethod
+    def unpack(cls, data):
+        '''Reads a map in the compiled format.
+        @param data: the compiled map, a string or a memory-mapped file
+        @raise ValueError: if the data is not a compiled map of this version'''
+        magic, version, mtime, size, height, width, max_players, num_spawns = _header.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a compiled map of version %d'%VERSION)
+        offset = _header.size
+        spawns = [_spawn.unpack_from(data, offset+i*_spawn.size) for i in range(num_spawns)]
+        offset += num_spawns*_spawn.size
+        tiles = data[offset:offset+height*width]
+        if len(tiles) != height*width:
+            raise ValueError('The compiled map is truncated')
+        return cls(height, width, max_players, spawns, tiles)
+
+    def encode(self):
+        '''Returns the map as text to be sent over the network.'''
+        #PodSixNet splits its stream at '\0---\0', so the compressed bytes are sent as text
+        return base64.b64encode(zlib.compress(self.pack()))
+
+    @classmethod
+    def decode(cls, data):
+        '''Restores a map encoded by encode().'''
+        return cls.unpack(zlib.decompress(base64.b64decode(data)))
+
+
+def compiled_path(path):
+    '''Returns the path of the compiled form of a .bff file.'''
+    return os.path.splitext(path)[0]+COMPILED
+
+
+def _read_compiled(path, mtime, size):
+    '''Returns the compiled map if it was compiled from a source of the given mtime and size, None otherwise.'''
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError, mmap.error):
+        #missing or empty
+        return None
+    try:
+        if _header.unpack_from(data)[2:4] != (mtime, size):
+            return None
+        return Map.unpack(data)
+    except (ValueError, struct.error):
+        return None
+    finally:
+        data.close()
+
+
+def load(path):
+    '''Returns the map of a .bff file. Its compiled form is used if it is up to date, otherwise the map is parsed
+    and compiled for the next time.
+    @rtype: Map'''
+    info = os.stat(path)
+    compiled = compiled_path(path)
+    level = _read_compiled(compiled, info.st_mtime, info.st_size)
+    if level is not None:
+        return level
+    with open(path) as f:
+        level = Map.parse(f.read())
+    try:
+        #write to a temporary file first so a concurrent run never maps a half-written file
+        with open(compiled+'.tmp', 'wb') as f:
+            f.write(level.pack(info.st_mtime, info.st_size))
+        os.rename(compiled+'.tmp', compiled)
+    except (IOError, OSError):
+        #compiling is only an optimization, the maps directory may be read-only
+        pass
+    return level
+
+
+class MapIndex(object):
+    '''The metadata of the maps of a directory, kept in an index file in the directory.'''
+    file_name = 'index.json'
+    #: version of the index file
+    version = 1
+
+    def __init__(self, directory='Maps'):
+        self.directory = directory
+        #: file name -> MapInfo
+        self.maps = {}
+        #: file name -> (mtime, size) of the source the info was read from
+        self._sources = {}
+        self.refresh()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.file_name)
+
+    def refresh(self):
+        '''Brings the index up to date with the directory. Only the maps which have changed since they were indexed are read.'''
+        stored = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == self.version:
+                stored = data['maps']
+        except (IOError, ValueError, KeyError):
+            pass
+        maps, sources = {}, {}
+        changed = False
+        for path in glob.glob(os.path.join(self.directory, '*.bff')):
+            name = os.path.basename(path)
+            info = os.stat(path)
+            entry = stored.get(name)
+            if entry is None or (entry['mtime'], entry['size']) != (info.st_mtime, info.st_size):
+                level = load(path)
+                entry = {'mtime': info.st_mtime, 'size': info.st_size, 'height': level.height, 'width': level.width,
+                         'max_players': level.max_players, 'spawns': level.spawns}
+                changed = True
+            maps[name] = MapInfo(name, path, entry['height'], entry['width'], entry['max_players'], [tuple(spawn) for spawn in entry['spawns']])
+            sources[name] = (entry['mtime'], entry['size'])
+        #maps removed since the index was saved
+        changed = changed or set(stored) != set(maps)
+        self.maps, self._sources = maps, sources
+        if changed:
+            self.save()
+
+    def save(self):
+        entries = {}
+        for name, info in self.maps.iteritems():
+            mtime, size = self._sources[name]
+            entries[name] = {'mtime': mtime, 'size': size, 'height': info.height, 'width': info.width,
+                             'max_players': info.max_players, 'spawns': info.spawns}
+        try:
+            with open(self.path+'.tmp', 'w') as f:
+                json.dump({'version': self.version, 'maps': entries}, f)
+            os.rename(self.path+'.tmp', self.path)
+        except (IOError, OSError):
+            pass
+
+    def playable(self, players=0):
+        '''Returns the maps for at least the given number of players, sorted by their names.
+        @rtype: list'''
+        return [self.maps[name] for name in sorted(self.maps) if self.maps[name].max_players >= players]
@@ -0,0 +1,79 @@
+#pools.py
+#Copyright (C) 2011 PyTeam
+
+'''Pools of short-lived level objects.
+Fires, bombs and bonuses appear and disappear all the time during a fight. Instead of being left to the garbage
+collector, the killed ones are kept by the world's pools and initialized again the next time an object of the same
+class is needed, so a big fight allocates next to nothing and does not make the collector run.
+'''
+
+
+class Pool(object):
+    '''Killed objects of a class, ready to be used again.'''
+
+    def __init__(self, klass, size):
+        '''@param size: the most objects kept, more of them are left to the garbage collector'''
+        self.klass = klass
+        self.size = size
+        self.free = []
+        #: objects which were used again
+        self.hits = 0
+        #: objects which had to be created because the pool was empty
+        self.misses = 0
+        #: objects which did not fit into the pool
+        self.dropped = 0
+
+    def acquire(self, *args, **kwargs):
+        '''Returns an object initialized with the arguments of the class's constructor.'''
+        if self.free:
+            self.hits += 1
+            obj = self.free.pop()
+            obj.reset(*args, **kwargs)
+            return obj
+        self.misses += 1
+        return self.klass(*args, **kwargs)
+
+    def release(self, obj):
+        if len(self.free) < self.size:
+            self.free.append(obj)
+        else:
+            self.dropped += 1
+
+    def stats(self):
+        return {'free': len(self.free), 'hits': self.hits, 'misses': self.misses, 'dropped': self.dropped}
+
+
+class Pools(object):
+    '''The pools of a world, one for each class whose objects are pooled, see GameObject.pooled.'''
+
+    def __init__(self, size=512):
+        '''@param size: the most objects kept in each pool'''
+        self.size = size
+        #: class -> Pool
+        self.pools = {}
+
+    def pool(self, klass):
+        pool = self.pools.get(klass)
+        if pool is None:
+            pool = self.pools[klass] = Pool(klass, self.size)
+        return pool
+
+    def create(self, klass, *args, **kwargs):
+        '''Returns a new object of the class, taking a killed one from the pool if there is any.'''
+        return self.pool(klass).acquire(*args, **kwargs)
+
+    def release(self, obj):
+        '''Called when a pooled object is killed.'''
+        self.pool(obj.__class__).release(obj)
+
+    def revive(self, objects):
+        '''Takes the objects out of the pools; called when killed objects are brought back by loading a saved state.'''
+        revived = set(objects)
+        for pool in self.pools.itervalues():
+            if pool.free:
+                pool.free = [obj for obj in pool.free if obj not in revived]
+
+    def stats(self):
+        '''Returns the sizes and counters of the pools by the names of their classes.
+        @rtype: dict'''
+        return dict((klass.__name__, pool.stats()) for klass, pool in self.pools.iteritems())
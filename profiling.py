@@ -0,0 +1,165 @@
+#profiling.py
+#Copyright (C) 2011 PyTeam
+
+'''Finding out where the time of a frame goes.
+FrameProfiler splits each frame of the game's main loop into phases: handling events, updating the world,
+pumping the network, drawing, pushing the frame to the display and waiting for the next frame.
+The overlay showing the times of the phases, a graph of the last frame times and the sizes of the sprite groups
+is toggled with F3. F4 records the next frames with cProfile into a pstats file, which can be read with
+    python -m pstats profile-20110101-120000.pstats
+While the overlay is hidden and nothing is recorded the main loop only checks a flag now and then.
+'''
+
+import cProfile
+import os
+import time
+from collections import deque
+from timeit import default_timer
+import pygame
+
+#: phases of a frame in the order they happen
+PHASES = ('events', 'update', 'network', 'redraw', 'flip', 'idle')
+
+
+class FrameProfiler(object):
+    '''Times the phases of the frames and records cProfile captures.'''
+    #: number of frames shown by the graph and averaged by the overlay
+    history_length = 200
+    #: height of the graph in pixels, the middle of it is the time a frame may take at the configured framerate
+    graph_height = 60
+    text_size = 14
+    margin = 4
+
+    def __init__(self, game, capture_frames=300, capture_dir='.'):
+        '''@param capture_frames: how many frames a cProfile capture records
+           @param capture_dir: directory the captures are written into'''
+        self.game = game
+        self.capture_frames = capture_frames
+        self.capture_dir = capture_dir
+        #: whether the phases are timed and the overlay is shown
+        self.enabled = False
+        #: the running cProfile capture, None if nothing is being recorded
+        self.capture = None
+        self._capture_left = 0
+        #: path of the last capture written
+        self.last_capture = None
+        #: why the last capture could not be written, None if it was
+        self.capture_error = None
+        #: seconds the last frames took
+        self.frames = deque(maxlen=self.history_length)
+        #: seconds spent in the phases of the last frames
+        self.history = deque(maxlen=self.history_length)
+        #: phase -> seconds spent in it during the current frame
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._started = self._last = None
+        self._font = None
+        #: where the overlay was drawn last time
+        self.rect = None
+
+    def toggle(self):
+        '''Shows or hides the overlay.'''
+        self.enabled = not self.enabled
+        self.frames.clear()
+        self.history.clear()
+        self._started = self._last = None
+        if not self.enabled and self.rect is not None:
+            self.game.renderer.invalidate(self.rect)
+            self.rect = None
+
+    def frame(self):
+        '''Called when a frame starts. Finishes the timing of the last frame and ends a capture which has recorded enough frames.'''
+        if self.capture is not None:
+            self._capture_left -= 1
+            if self._capture_left <= 0:
+                self.stop_capture()
+        if not self.enabled:
+            return
+        now = default_timer()
+        if self._started is not None:
+            self.frames.append(now-self._started)
+            self.history.append(tuple(self.phases[phase] for phase in PHASES))
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._started = self._last = now
+
+    def mark(self, phase):
+        '''Counts the time since the last mark to the phase. It should be called only while the profiler is enabled.'''
+        now = default_timer()
+        if self._last is not None:
+            self.phases[phase] += now-self._last
+        self._last = now
+
+    def start_capture(self):
+        self.capture = cProfile.Profile()
+        self._capture_left = self.capture_frames
+        self.capture.enable()
+
+    def stop_capture(self):
+        '''Ends the capture and writes it into a pstats file, creating the capture directory if needed.
+        A capture which cannot be written is dropped and the error is shown by the overlay, the game goes on.
+        @returns: path of the file, None if it could not be written'''
+        self.capture.disable()
+        capture, self.capture = self.capture, None
+        path = os.path.join(self.capture_dir, time.strftime('profile-%Y%m%d-%H%M%S.pstats'))
+        try:
+            if not os.path.isdir(self.capture_dir):
+                os.makedirs(self.capture_dir)
+            capture.dump_stats(path)
+        except (IOError, OSError) as error:
+            self.capture_error = 'capture not saved: %s'%(error.strerror or error)
+            return None
+        self.capture_error = None
+        self.last_capture = path
+        return path
+
+    def toggle_capture(self):
+        '''Starts a capture of the next frames, or ends the running one early.'''
+        if self.capture is None:
+            self.start_capture()
+        else:
+            self.stop_capture()
+
+    def lines(self):
+        '''Returns the lines of text shown by the overlay.'''
+        game = self.game
+        count = len(self.history) or 1
+        frames = self.frames or [0.0]
+        lines = ['frame %5.1f ms, max %5.1f ms'%(sum(frames)*1000/len(frames), max(frames)*1000)]
+        for number, phase in enumerate(PHASES):
+            lines.append('%s %5.1f ms'%(phase, sum(times[number] for times in self.history)*1000/count))
+        lines.append(', '.join('%s %d'%(name, len(getattr(game, name))) for name in game.level_groups))
+        pools = sorted(game.pools.stats().iteritems())
+        if pools:
+            lines.append('pools: '+', '.join('%s %d free %d/%d'%(name, pool['free'], pool['hits'], pool['hits']+pool['misses'])
+                                               for name, pool in pools))
+        lines.append('sounds: %(requested)d asked for, %(played)d played, %(stolen)d cut off'%game.sounds.stats())
+        if self.capture is not None:
+            lines.append('profiling, %d frames left'%self._capture_left)
+        elif self.capture_error is not None:
+            lines.append(self.capture_error)
+        elif self.last_capture is not None:
+            lines.append('saved %s'%self.last_capture)
+        return lines
+
+    def draw(self, surface):
+        '''Draws the overlay in the top left corner of the surface.
+        @returns: the rect drawn over'''
+        if self._font is None:
+            self._font = pygame.font.Font(os.path.join('Data', 'freesansbold.ttf'), self.text_size)
+        texts = [self._font.render(line, True, (255, 255, 255)) for line in self.lines()]
+        line_height = self._font.get_linesize()
+        width = max([self.history_length]+[text.get_width() for text in texts])+2*self.margin
+        height = len(texts)*line_height+self.graph_height+3*self.margin
+        rect = pygame.Rect(0, 0, width, height)
+        surface.fill((0, 0, 0), rect)
+        for number, text in enumerate(texts):
+            surface.blit(text, (self.margin, self.margin+number*line_height))
+        bottom = height-self.margin
+        budget = 1.0/self.game.config['general']['framerate']
+        for number, seconds in enumerate(self.frames):
+            bar = min(self.graph_height, int(seconds*self.graph_height/(2*budget)))
+            colour = (0, 200, 0) if seconds <= budget else (220, 0, 0)
+            surface.fill(colour, (self.margin+number, bottom-bar, 1, bar))
+        middle = bottom-self.graph_height//2
+        pygame.draw.line(surface, (255, 255, 0), (self.margin, middle), (self.margin+self.history_length-1, middle))
+        self.rect = rect
+        return rect
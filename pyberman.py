@@ -4,10 +4,7 @@
 '''The Pyberman runner.
 '''
 
-import os
 import sys
-from cStringIO import StringIO
-import random
 import pygame
 from pygame.locals import *
 from PodSixNet.Connection import connection, ConnectionListener
@@ -15,121 +12,221 @@ from gameobjects import *
 from ui import MainMenu, Score, NetworkScore, ErrorMenu
 import events
 import controllers
+import assets
+import camera
+import maps
+import profiling
+import render
+import replay
+import rollback
+import snapshot
+import sound
+from simulation import Simulation
 
 
-class Game(events.AutoListeningObject, ConnectionListener):
+class Game(Simulation, events.AutoListeningObject, ConnectionListener):
     '''Represents a high-level game instance.
     Should be a singleton.
     '''
     _instance = None
+    headless = False
+    #: the most steps made before drawing a frame; when the game falls further behind, the time is dropped
+    max_frame_steps = 5
     #Todo: implement reading from a config file
+    #general/framerate limits how often the screen is drawn, the world is always stepped every tick_length seconds
+    #general/image_cache may name a directory where scaled images are kept between runs
+    #general/replay_dir may name a directory where local and hosted matches are recorded, see replay.py
+    #general/bots is how many bots join the two players of a local game, as many as the map has room for
+    #server/netcode is 'snapshot' to simulate hosted matches on the server or 'rollback' to let every client simulate them
+    #screen/width and screen/height of 0 use the desktop resolution
+    #profiler/capture_frames is how many frames F4 records with cProfile, the file is written into profiler/capture_dir
+    #camera/mode is 'fit' to shrink the level to the screen, 'follow' to show tiles of camera/tile_side pixels
+    #and follow the local players, or 'auto' to follow them only on levels which would not fit with tiles that big;
+    #camera/margin is how many tiles around the screen are drawn as well
+    #sound/backend is 'mixer', or 'null' to play nothing; sound/channels is how many mixer channels each category of
+    #the effects gets, sound/volumes their volumes from 0 to 1
     config = {'general':
-             {'framerate': 50},
-             'server': {'port': 8000}}
+             {'framerate': 50, 'renderer': 'dirty', 'image_cache': None, 'replay_dir': None, 'bots': 0},
+             'screen': {'width': 0, 'height': 0},
+             'server': {'port': 8000, 'netcode': 'snapshot'},
+             'profiler': {'capture_frames': 300, 'capture_dir': '.'},
+             'camera': {'mode': 'auto', 'tile_side': 40, 'margin': 1},
+             'sound': {'backend': 'mixer', 'channels': {'explosion': 4, 'ui': 2, 'music': 1},
+                       'volumes': {'explosion': 0.7, 'ui': 1.0, 'music': 1.0}}}
 
     def __init__(self):
         '''Initializes the game.'''
         pygame.init()
-        pygame.mixer.init()
-        self.menu_sound = pygame.mixer.Sound(os.path.join('Data', 'Pandemonium.ogg'))
-        self.explosions = [
-            pygame.mixer.Sound(os.path.join('Data', 'explosion.ogg')),
-            pygame.mixer.Sound(os.path.join('Data', 'explosion2.ogg')),
-            pygame.mixer.Sound(os.path.join('Data', 'explosion3.ogg'))
-        ]
+        #: plays the effects and the music, see sound.py
+        self.sounds = sound.SoundManager(**self.config['sound'])
         pygame.display.set_caption('Pyberman')
-        #self.surface = pygame.display.set_mode((self.config['screen']['width'], self.config['screen']['height']), FULLSCREEN|DOUBLEBUF     |HWSURFACE)
-        # use default resolution
-        self.surface = pygame.display.set_mode((0,0), FULLSCREEN|DOUBLEBUF     |HWSURFACE)
+        renderer = render.renderers[self.config['general']['renderer']]
+        self.surface = pygame.display.set_mode((self.config['screen']['width'], self.config['screen']['height']), renderer.flags)
+        events.allow_pygame_events()
         self.screen_height = pygame.display.Info().current_h
         self.screen_width = pygame.display.Info().current_w
-        self.step_length=0.25
+        self.renderer = renderer(self)
+        #: times the phases of the frames, see profiling.py
+        self.profiler = profiling.FrameProfiler(self, **self.config['profiler'])
         self.controller = None
-        self.create_groups()
+        #: what simulates the shown world instead of the game: a rollback.Rollback in a network game with rollback netcode
+        #: or a replay.Playback; the world is shown through a snapshot.Mirror
+        self.session = None
         self.player_names=['Player %s'%num for num in range(10)]
         self.players_colors=[(148,0,211),(255,255,0),(255,0,0),(0,255,0),(0,250,154),(0,0,238),(255,20,147),(255,140,0)]
         #: Whether the main loop should run
         self.done = False
-        self.is_network_game = self.is_server = False
+        #: how far the time has advanced past the last step, in steps; used to interpolate positions when drawing
+        self.alpha = 0.0
+        #: the camera.Camera showing a level larger than the screen, None when the level is fitted into the screen
+        self.camera = None
         super(Game, self).__init__()
 
     def __del__(self):
         '''Deinitializes the game.'''
         pygame.quit ()
 
-    def main_loop(self):
-        '''Starts the game's main loop.'''
+    def main_loop(self, replay=None):
+        '''Starts the game's main loop.
+        @param replay: a replay.Replay to show instead of the main menu'''
         #to control a framerate
         clock = pygame.time.Clock()
-        MainMenu(self)
-        self.menu_sound.play(loops=100)
+        if replay is not None:
+            self.start_replay(replay)
+        else:
+            MainMenu(self)
+        self.sounds.play('music', loops=100)
+        #the time which has passed but has not been simulated yet
+        lag = 0.0
+        profiler = self.profiler
         while not self.done:
-            for event in pygame.event.get():
-                events.Event.process_event(events.event_from_pygame_event(self, event)) 
-            self.delta=clock.get_time()/1000.0
-            self.update()
-            self.redraw()  
-            pygame.display.flip()
+            profiler.frame()
+            for event in events.events_from_pygame_events(self, pygame.event.get()):
+                events.Event.process_event(event)
+            if profiler.enabled:
+                profiler.mark('events')
+            lag += clock.get_time()/1000.0
+            steps = 0
+            while lag >= self.tick_length and steps < self.max_frame_steps:
+                self.step()
+                lag -= self.tick_length
+                steps += 1
+            if lag >= self.tick_length:
+                #too slow to catch up, the world is slowed down instead
+                lag = 0.0
+            self.alpha = lag/self.tick_length
+            if profiler.enabled:
+                profiler.mark('update')
+            self.redraw()
+            if profiler.enabled:
+                profiler.mark('flip')
             #Let other processes to work a bit, limiting the framerate
             clock.tick(self.config['general']['framerate'])
+            if profiler.enabled:
+                profiler.mark('idle')
 
     def event_keydown(self, event):
         if event.key==K_ESCAPE:
             event.stop_propagating = True
+            self.session = None
             for x in self.all:
                 x.kill()
             self.create_groups()
             MainMenu(self)
             #events.Event.process_event(events.QuitEvent(self))
+        elif event.key==K_F3:
+            event.stop_propagating = True
+            self.profiler.toggle()
+        elif event.key==K_F4:
+            event.stop_propagating = True
+            self.profiler.toggle_capture()
 
     def event_quit(self, event):
         '''Finish the main loop'''
         self.done = True
 
-    def load_level(self, f):
-        '''Loads the chosen map for a needed amount of players'''
-        GameObject.invalidate_cache()
-        Player.player_images = None
-        self.available=[]
-        self.height,self.width,self.max_players = [int(x) for x in f.readline().split()]
+    def event_active(self, event):
+        '''The screen may have been drawn over while the window was in the background, as after alt-tab.'''
+        if event.gain:
+            self.renderer.repaint()
+
+    def event_videoexpose(self, event):
+        self.renderer.repaint()
+
+    def event_videoresize(self, event):
+        self.renderer.repaint()
+
+    def layout(self):
+        '''Fits the level into the screen, or gives the tiles a fixed side and lets a camera show a part of the level.'''
+        config = self.config['camera']
         self.side=min((self.screen_height//self.height,self.screen_width//self.width))
+        if config['mode'] == 'follow' or config['mode'] == 'auto' and self.side < config['tile_side']:
+            self.side = config['tile_side']
+            self._absw = self._absh = 0
+            self.camera = camera.Camera(self, config['margin'])
+            return
+        self.camera = None
         self._absw = (self.screen_width-(self.width*self.side))//2
         self._absh = (self.screen_height-(self.height*self.side))//2
-        for row_num, row in enumerate(f):
-            if row_num == self.height: raise RuntimeError('Too many lines in the file')
-            for col_num, col in enumerate(row.strip()):
-                if col_num == self.width: raise RuntimeError('Too many colums in row %d'%row_num+1)
-                if col == 'W':
-                    Wall(self, col_num, row_num, groups=(self.all, self.obstacles, self.walls))
-                elif col == 'B':
-                    Box(self, col_num, row_num, groups=(self.all, self.dynamic, self.obstacles, self.destroyable))
-                elif col == ' ': 
-                    pass
-                elif col=='S':
-                        self.available.append((col_num,row_num))
-                else:
-                    raise RuntimeError('Unknown symbol "%s" in row %d, col %d'%(col, row_num+1, col_num+1))
-            if col_num<self.width-1:
-                raise RuntimeError('Insuficient number of colums in row %d'%row_num+1)
-        if row_num<self.height-1:
-            raise RuntimeError('Insuficient number of rows')
-        random.shuffle(self.available)
-        self.players = []
-        for i in range(self.num_players):
-            self.players.append(Player(self, self.available[i][0], self.available[i][1], i, groups=(self.all, self.destroyable)))
+
+    def followed_players(self):
+        '''Returns the players the camera follows: the local ones which are alive, or all the local ones if none is.'''
+        players = self.players[self.player_id:self.player_id+1] if self.is_network_game else self.players
+        return [player for player in players if player.alive()] or players
+
+    def create_assets(self):
+        return assets.AssetManager(cache_dir=self.config['general']['image_cache'])
+
+    def load_level(self, f):
+        super(Game, self).load_level(f)
+        self.renderer.level_loaded()
+
+    def create_groups(self):
+        super(Game, self).create_groups()
+        #: sprite -> its rect before the last step
+        self.previous_rects = {}
+        #the level is thrown away together with the groups, a new one gets its own camera
+        self.camera = None
+        self.renderer.reset()
+
+    def step(self, delta=None):
+        camera = self.camera
+        if camera is None:
+            self.previous_rects = dict((sprite, sprite.rect) for sprite in self.all)
+        else:
+            #sprites out of the camera's view are not drawn, so they are not interpolated
+            self.previous_rects = dict((sprite, sprite.rect) for sprite in self.all if camera.visible(sprite.rect))
+        super(Game, self).step(delta)
+        #the explosions and the clicks of the tick are heard together
+        self.sounds.flush()
+
+    def remove_tile(self, x, y):
+        super(Game, self).remove_tile(x, y)
+        self.renderer.tile_removed(x, y)
 
     def start_local_game(self, level):
-        self.num_players = 2
-        self.load_level(open(level))
-        self.controller = controllers.LocalController(*self.players)
-        self.players_alive = 2
+        level = maps.load(level)
+        num_players = max(2, min(level.max_players, 2+self.config['general']['bots']))
+        self.start_match(level, num_players)
+        self.controller = controllers.LocalController(*self.players[:2])
+        if num_players > 2:
+            self.bots = controllers.BotController(self, range(2, num_players))
+        if self.config['general']['replay_dir'] is not None:
+            replay.record(self, self.config['general']['replay_dir'])
+
+    def start_replay(self, recorded):
+        '''Shows a recorded match at the normal speed.
+        @type recorded: replay.Replay'''
+        self.session = replay.Playback(recorded)
+        self.num_players = recorded.num_players
+        self.finished = False
+        self.load_level(maps.Map.parse(recorded.level))
+        self.mirror = snapshot.Mirror(self)
+        self.players_alive = self.num_players
 
     def end_game(self):
-        for obj in self.all:
-            obj.unregister_all_event_handlers()
-            if not isinstance(obj, Player):
-                obj.kill()
-        self.create_groups()
+        super(Game, self).end_game()
+        self.session = None
         if self.is_network_game:
             connection.Close()
             NetworkScore(self)
@@ -137,50 +234,84 @@ class Game(events.AutoListeningObject, ConnectionListener):
             Score(self)
         self.is_network_game = self.is_server = False
 
-    def xcoord_to_screen(self, x):
-        '''Translates given x coordinate from the game coord system to screen coord system.'''
-        return self._absw+x*self.side
-
-    def ycoord_to_screen(self, y):
-        '''Translates given y coordinate from the game coord system to screen coord system.'''
-        return self._absh+y*self.side
-
-    def create_groups(self):
-        '''Creates sprite groups needed for the game'''
-        self.all = pygame.sprite.Group()
-        self.obstacles = pygame.sprite.Group()
-        self.dynamic = pygame.sprite.Group() 
-        self.bombs = pygame.sprite.Group()
-        self.destroyable = pygame.sprite.Group()
-        self.walls = pygame.sprite.Group()
-        self.bonuses = pygame.sprite.Group()
-
     def Network_start_game(self, data):
         if not self.is_server:
             self._waitbox.kill()
             del self._waitbox
         self.is_network_game = True
-        random.seed(data['random_seed'])
+        self.random.seed(data['random_seed'])
         self.player_id = data['player_id']
         self.num_players = data['num_players']
-        self.load_level(StringIO(data['level']))
-        self.controller = controllers.NetworkController(self.players[self.player_id])
+        self.finished = False
+        level = maps.Map.decode(data['map'])
+        self.load_level(level)
+        self.mirror = snapshot.Mirror(self)
         self.players_alive = self.num_players
+        if data.get('netcode') == 'rollback':
+            self.session = rollback.Rollback(level, self.num_players, self.player_id, data['random_seed'], controllers.send_inputs)
+            self.controller = controllers.RollbackController(self.session)
+        else:
+            self.controller = controllers.NetworkController()
+
+    def Network_snapshot(self, data):
+        tick = self.mirror.receive(data['data']).tick
+        if not self.finished:
+            controllers.outbox.put({'action': 'ack', 'tick': tick})
+
+    def Network_inputs(self, data):
+        if self.session is not None:
+            self.session.receive(data['player'], data['tick'], data['commands'])
+
+    def Network_left(self, data):
+        if self.session is not None:
+            self.session.player_left(data['player'], data['tick'])
+
+    def Network_batch(self, data):
+        controllers.unpack_batch(self, data)
 
     def redraw(self):
-        """Redraws the level. It is called each core pumb"""
-        #self.surface.blit(self.ground, (0,0))
-        self.surface.fill((0,0,0))
-        self.all.draw(self.surface)
+        """Redraws the level and shows it. It is called each core pumb"""
+        if self.camera is not None:
+            self.camera.follow(self.followed_players())
+        self.renderer.draw()
+
+    def play_explosion(self):
+        self.sounds.play('explosion')
 
     def update(self):
-        '''Updates all the objects on the level'''
-        self.all.update()
-        if self.is_network_game:
-            connection.Pump()
-            self.Pump()
-            if self.is_server:
-                self.server.Pump()
+        '''Updates all the objects on the level.
+        In a network game and during a replay the level is simulated by the server or by the session, and only the menus are updated here.'''
+        if not self.is_network_game and self.session is None:
+            return super(Game, self).update()
+        for sprite in self.all.sprites():
+            if not sprite.collidable:
+                sprite.update()
+        if self.session is not None:
+            self.session.advance()
+            self.show_session()
+        if not self.is_network_game:
+            return
+        profiler = self.profiler
+        if profiler.enabled:
+            profiler.mark('update')
+        controllers.outbox.flush()
+        connection.Pump()
+        self.Pump()
+        if self.is_server:
+            if profiler.enabled:
+                profiler.mark('network')
+            self.server.step()
+            if profiler.enabled:
+                profiler.mark('update')
+            self.server.Pump()
+        if profiler.enabled:
+            profiler.mark('network')
+
+    def show_session(self):
+        '''Shows the world of the session. Its end is shown only when nothing can undo it any more.'''
+        session = self.session
+        if not session.world.finished or session.settled:
+            self.mirror.apply(snapshot.Snapshot.capture(session.world))
 
     def start_server(self):
         self.active_players = [] # for displaying in the network menu
@@ -0,0 +1,242 @@
+#render.py
+#Copyright (C) 2011 PyTeam
+
+'''Renderers which draw the game on the screen.'''
+
+import pygame
+from pygame.locals import *
+from gameobjects import TILE_IMAGES
+
+
+class FullRenderer(object):
+    '''Clears and redraws the whole screen each frame.'''
+    #: flags of the display mode this renderer needs
+    flags = FULLSCREEN|DOUBLEBUF|HWSURFACE
+    #: colour of the floor
+    floor = (0, 0, 0)
+
+    def __init__(self, game):
+        self.game = game
+
+    def level_loaded(self):
+        '''Called when a level has been loaded.'''
+        pass
+
+    def reset(self):
+        '''Called when the level objects are thrown away, for example when returning to a menu.'''
+        pass
+
+    def tile_removed(self, x, y):
+        '''Called when a wall or a box disappears from the level.'''
+        pass
+
+    def invalidate(self, rect):
+        '''Called when something else than the renderer has drawn over the region of the screen.'''
+        pass
+
+    def repaint(self):
+        '''Called when the contents of the screen have been lost, for example when the window gets the focus back.
+        Everything is drawn each frame anyway.'''
+        pass
+
+    def draw_tiles(self, surface):
+        '''Draws the walls and boxes of the level's tile grid, only those the camera shows if there is one.'''
+        game = self.game
+        camera = game.camera
+        images = {}
+        for x, y, tile in game.grid.occupied(camera.tiles() if camera is not None else None):
+            image = images.get(tile)
+            if image is None:
+                image = images[tile] = game.assets.image(TILE_IMAGES[tile], (game.side-1, game.side-1))
+            rect = game.tile_rect(x, y)
+            surface.blit(image, rect if camera is None else camera.to_screen(rect))
+
+    def sprite_rect(self, sprite):
+        '''Returns where the sprite is drawn: between its rects before and after the last step, according to game.alpha.
+        Sprites which jumped further than a tile are drawn where they are.'''
+        rect = sprite.rect
+        previous = self.game.previous_rects.get(sprite)
+        if previous is None or previous == rect:
+            return rect
+        dx, dy = previous.x-rect.x, previous.y-rect.y
+        if abs(dx) > rect.width or abs(dy) > rect.height:
+            return rect
+        rest = 1.0-self.game.alpha
+        return rect.move(int(round(dx*rest)), int(round(dy*rest)))
+
+    def placed_sprites(self):
+        '''Yields the sprites which are drawn together with their rects on the screen.
+        Level objects out of the camera's view are skipped before anything is computed for them; menus are not moved by the camera.'''
+        camera = self.game.camera
+        for sprite in self.game.all:
+            if sprite.image is None:
+                continue
+            if camera is None or not sprite.collidable:
+                yield sprite, self.sprite_rect(sprite)
+            elif camera.visible(sprite.rect):
+                yield sprite, camera.to_screen(self.sprite_rect(sprite))
+
+    def draw(self):
+        '''Draws a frame and shows it.'''
+        surface = self.game.surface
+        surface.fill(self.floor)
+        self.draw_tiles(surface)
+        for sprite, rect in self.placed_sprites():
+            surface.blit(sprite.image, rect)
+        self.show()
+
+    def show(self, rects=None):
+        '''Pushes the frame to the display, only the given regions of it if there are any.
+        The overlay of the profiler is drawn over the frame while it is enabled.'''
+        profiler = self.game.profiler
+        if profiler.enabled:
+            rect = profiler.draw(self.game.surface)
+            if rects is not None:
+                rects.append(rect)
+            profiler.mark('redraw')
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+
+class DirtyRenderer(FullRenderer):
+    '''Draws the floor, walls and boxes once into a background surface when a level is loaded.
+    Each frame only the regions of sprites which moved, changed their image,
+    appeared or disappeared are restored from the background, redrawn and pushed to the screen.
+    Menus are drawn the same way as by FullRenderer, but only when one of them has composed a new image.
+    With a camera the background holds the tiles in its view and is drawn again whenever the camera moves.
+    '''
+    flags = FULLSCREEN
+
+    def __init__(self, game):
+        super(DirtyRenderer, self).__init__(game)
+        self.background = None
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        #: sprite -> (image, rect) as it was drawn in the last frame
+        self._drawn = {}
+        #: regions to redraw in the next frame in addition to the changed sprites
+        self._invalid = []
+        #: whether the whole screen should be pushed in the next frame
+        self._repaint = True
+        #: sprites shown by the last full draw
+        self._shown = None
+        #: the camera's number of moves when the background was drawn
+        self._camera_moves = None
+
+    def level_loaded(self):
+        self.reset()
+        game = self.game
+        self.background = pygame.Surface(game.surface.get_size()).convert()
+        self.draw_background()
+        self.active = True
+
+    def draw_background(self):
+        self.background.fill(self.floor)
+        self.draw_tiles(self.background)
+        if self.game.camera is not None:
+            self._camera_moves = self.game.camera.moves
+
+    def tile_removed(self, x, y):
+        if self.active:
+            rect = self.game.tile_rect(x, y)
+            if self.game.camera is not None:
+                rect = self.game.camera.to_screen(rect)
+            self.background.fill(self.floor, rect)
+            self._invalid.append(rect)
+
+    def invalidate(self, rect):
+        if self.active:
+            self._invalid.append(pygame.Rect(rect))
+        else:
+            self._shown = None
+
+    def repaint(self):
+        '''The whole screen is pushed in the next frame, the static background included.'''
+        self._repaint = True
+        self._shown = None
+
+    def draw_full(self):
+        '''Draws the whole frame unless it would look exactly as the last one.'''
+        sprites = self.game.all.sprites()
+        #sprites which do not say whether they have changed are drawn every frame, as is the profiler's overlay
+        if sprites == self._shown and not self.game.profiler.enabled and not any(getattr(sprite, 'dirty', True) for sprite in sprites):
+            return
+        self._shown = sprites
+        super(DirtyRenderer, self).draw()
+        for sprite in sprites:
+            if getattr(sprite, 'dirty', False):
+                sprite.dirty = False
+
+    def draw(self):
+        if not self.active:
+            return self.draw_full()
+        game = self.game
+        if game.camera is not None and game.camera.moves != self._camera_moves:
+            self.draw_background()
+            self._repaint = True
+        current = {}
+        for sprite, rect in self.placed_sprites():
+            if not sprite.collidable:
+                #a menu is shown over the level
+                self._repaint = True
+                self._drawn = {}
+                return self.draw_full()
+            current[sprite] = (sprite.image, pygame.Rect(rect))
+        self._shown = None
+        if self._repaint:
+            self._repaint = False
+            self._invalid = []
+            self._drawn = current
+            game.surface.blit(self.background, (0, 0))
+            for image, rect in current.itervalues():
+                game.surface.blit(image, rect)
+            self.show()
+            return
+        drawn = self._drawn
+        dirty = self._invalid
+        for sprite, (image, rect) in current.iteritems():
+            last = drawn.pop(sprite, None)
+            if last is None:
+                dirty.append(rect)
+            elif last[0] is not image or last[1] != rect:
+                dirty.append(last[1])
+                dirty.append(rect)
+        #what is left has disappeared since the last frame
+        for image, rect in drawn.itervalues():
+            dirty.append(rect)
+        self._drawn = current
+        self._invalid = []
+        if not dirty and not game.profiler.enabled:
+            return
+        #a sprite touching a dirty region is redrawn as a whole, so its whole rect has to be restored first,
+        #otherwise translucent pixels would be blended over themselves
+        redraw = []
+        pending = current.values()
+        while True:
+            touching, rest = [], []
+            for item in pending:
+                if item[1].collidelist(dirty) != -1:
+                    touching.append(item)
+                else:
+                    rest.append(item)
+            if not touching:
+                break
+            redraw.extend(touching)
+            dirty.extend(rect for image, rect in touching)
+            pending = rest
+        for rect in dirty:
+            game.surface.blit(self.background, rect, rect)
+        for image, rect in redraw:
+            game.surface.blit(image, rect)
+        self.show(dirty)
+
+
+#: renderers by their names in the configuration
+renderers = {
+    'full': FullRenderer,
+    'dirty': DirtyRenderer,
+}
@@ -0,0 +1,216 @@
+#replay.py
+#Copyright (C) 2011 PyTeam
+
+'''Recording of matches and their playback.
+A replay keeps the map, the random seed, the side of a tile and the commands given to the players at each tick,
+which is all a simulation needs to play the match again exactly as it went. The result of the match is kept too,
+so playing a replay tells whether a change of the code has changed the outcome.
+
+Playing a replay headless as fast as possible:
+    python replay.py replays/20110501-120000.pbr
+Showing it at the normal speed:
+    python replay.py replays/20110501-120000.pbr --show
+'''
+
+import os
+import struct
+import time
+import zlib
+from cStringIO import StringIO
+from gameobjects import Player
+from simulation import Simulation
+
+#: the first bytes of a replay file
+MAGIC = 'PBRP'
+#: version of the file format; it also changes when the rules do, as a replay is played by simulating the match again
+#: 2: bombs explode at the end of a tick, see Simulation.resolve_explosions
+VERSION = 2
+
+_magic = struct.Struct('<4sB')
+#seed, number of players, side of a tile, length of the map
+_header = struct.Struct('<IBHI')
+_count = struct.Struct('<I')
+#tick, player, number of the command in Player.commands
+_command = struct.Struct('<IBB')
+#ticks, whether the match has finished
+_result = struct.Struct('<IB')
+_score = struct.Struct('<h')
+
+
+class Replay(object):
+    '''A recorded match.'''
+
+    def __init__(self, seed, num_players, side, level, commands=None, ticks=0, finished=False, scores=None):
+        '''@param level: contents of the map file
+           @type level: str
+           @param commands: (tick, player id, number of the command) in the order they were given
+           @type commands: list
+           @param ticks: length of the match
+           @param scores: the points the players got in the match'''
+        self.seed = seed
+        self.num_players = num_players
+        self.side = side
+        self.level = level
+        self.commands = commands if commands is not None else []
+        self.ticks = ticks
+        self.finished = finished
+        self.scores = scores if scores is not None else [0]*num_players
+
+    def save(self, path):
+        parts = [_header.pack(self.seed, self.num_players, self.side, len(self.level)), self.level, _count.pack(len(self.commands))]
+        parts.extend(_command.pack(*command) for command in self.commands)
+        parts.append(_result.pack(self.ticks, self.finished))
+        parts.extend(_score.pack(score) for score in self.scores)
+        with open(path, 'wb') as f:
+            f.write(_magic.pack(MAGIC, VERSION)+zlib.compress(''.join(parts), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version = _magic.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise RuntimeError('%s is not a replay of this version of the game'%path)
+        data = zlib.decompress(data[_magic.size:])
+        seed, num_players, side, length = _header.unpack_from(data)
+        offset = _header.size
+        level = data[offset:offset+length]
+        offset += length
+        count, = _count.unpack_from(data, offset)
+        offset += _count.size
+        commands = [_command.unpack_from(data, offset+i*_command.size) for i in range(count)]
+        offset += count*_command.size
+        ticks, finished = _result.unpack_from(data, offset)
+        offset += _result.size
+        scores = [_score.unpack_from(data, offset+i*_score.size)[0] for i in range(num_players)]
+        return cls(seed, num_players, side, level, commands, ticks, bool(finished), scores)
+
+    def simulation(self):
+        '''Returns a headless simulation at the start of the match.'''
+        world = Simulation()
+        #positions are measured in pixels of tiles, so the tiles must be as large as when the match was played
+        world.tile_side = self.side
+        world.start_match(StringIO(self.level), self.num_players, self.seed)
+        return world
+
+    def script(self):
+        '''Returns a script for Simulation.run which gives the recorded commands.'''
+        return Script(self.commands)
+
+    def run(self):
+        '''Plays the match headless as fast as possible.
+        @returns: the simulation after the last tick
+        @rtype: Simulation'''
+        world = self.simulation()
+        world.run(self.script(), self.ticks)
+        if self.finished and not world.finished:
+            #the match was ended from the outside, as Playback does with a match which was left
+            world.end_game()
+        return world
+
+    def matches(self, world):
+        '''Returns whether the match played by the world has ended as the recorded one.'''
+        return (world.ticks, world.finished, world.players_score[:self.num_players]) == (self.ticks, self.finished, self.scores)
+
+
+class Script(object):
+    '''Gives the commands of a replay to the players of a simulation at the ticks they were recorded at.'''
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.next = 0
+
+    def __call__(self, world):
+        commands, i = self.commands, self.next
+        while i < len(commands) and commands[i][0] <= world.ticks:
+            tick, player_id, number = commands[i]
+            world.command(player_id, Player.commands[number])
+            i += 1
+        self.next = i
+
+
+class Recorder(object):
+    '''Records the match of a simulation, it is attached to the simulation after start_match().
+    The simulation tells the recorder about each command, and the replay is saved when the match is over.
+    '''
+
+    def __init__(self, world, path):
+        self.path = path
+        self.replay = Replay(world.seed, world.num_players, world.side, world.level)
+        #scores of a game add up over several matches
+        self.base_scores = world.players_score[:world.num_players]
+        world.recorder = self
+
+    def record(self, tick, player_id, command):
+        self.replay.commands.append((tick, player_id, Player.commands.index(command)))
+
+    def close(self, world):
+        '''Saves the replay. A match which was left before its end is saved as well.'''
+        replay = self.replay
+        replay.ticks, replay.finished = world.ticks, world.finished
+        replay.scores = [score-base for score, base in zip(world.players_score, self.base_scores)]
+        try:
+            replay.save(self.path)
+        except (IOError, OSError):
+            #a lost replay must not break the game
+            pass
+
+
+def record(world, directory):
+    '''Starts recording the match of the world into a new file of the directory.
+    @rtype: Recorder'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(directory, name+'.pbr')
+    number = 1
+    while os.path.exists(path):
+        number += 1
+        path = os.path.join(directory, '%s-%d.pbr'%(name, number))
+    return Recorder(world, path)
+
+
+class Playback(object):
+    '''Steps the world of a replay one tick at a time, the game shows it through a snapshot.Mirror.'''
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.world = replay.simulation()
+        self.script = replay.script()
+
+    @property
+    def settled(self):
+        return self.world.finished
+
+    def advance(self):
+        world = self.world
+        if world.finished:
+            return
+        if world.ticks >= self.replay.ticks:
+            #the match was left before its end
+            world.end_game()
+            return
+        self.script(world)
+        world.step()
+
+
+if __name__=="__main__":
+    import optparse
+    import sys
+    parser = optparse.OptionParser(usage='%prog [options] replay.pbr')
+    parser.add_option('-s', '--show', action='store_true', help='show the match at the normal speed instead of playing it headless')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('exactly one replay should be given')
+    replay = Replay.load(args[0])
+    if options.show:
+        import pyberman
+        pyberman.Game.instance().main_loop(replay)
+        sys.exit()
+    started = time.time()
+    world = replay.run()
+    elapsed = time.time()-started
+    print '%d ticks in %.2f s (%.0f ticks/s), scores %s'%(world.ticks, elapsed, world.ticks/max(elapsed, 1e-9), world.players_score[:replay.num_players])
+    if not replay.matches(world):
+        print 'the outcome differs from the recorded one: %d ticks, scores %s'%(replay.ticks, replay.scores)
+        sys.exit(1)
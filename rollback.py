@@ -0,0 +1,129 @@
+#rollback.py
+#Copyright (C) 2011 PyTeam
+
+'''Rollback netcode: each client of a network game simulates the whole match itself.
+The commands of the local player take effect at once. The commands of the other players arrive later;
+until they do, the others are predicted to give no new commands, which keeps them doing what they did.
+When a command arrives for a tick which has already been simulated, the world is restored to the state
+saved before that tick and simulated again up to the present, so the shown state is repaired.
+A client which gets too far ahead of the commands of the others waits for them, so a command can always be applied
+at the tick it was given for and every client simulates the same match.
+The server only passes the commands between the clients, see controllers.RelayMatch.
+'''
+
+import sys
+from gameobjects import Player
+from simulation import Simulation
+
+
+class Rollback(object):
+    '''Simulates a network match on a client.
+    The world is headless and uses the simulation's own coordinates, so it is stepped identically by every client
+    whatever its screen is; the game shows it through a snapshot.Mirror.
+    '''
+    #: the most ticks the world may be rolled back; the client waits rather than get further ahead of the confirmed tick
+    max_rollback = 32
+
+    def __init__(self, level, num_players, player_id, seed, send):
+        '''@type level: maps.Map
+           @param player_id: the player controlled by this client
+           @param seed: seed of the match, the same for all the clients
+           @param send: callable which is given a tick and the commands of the local player for it'''
+        self.world = Simulation()
+        self.world.start_match(level, num_players, seed)
+        self.player_id = player_id
+        self.send = send
+        #: the next tick to simulate; it goes on when the world has finished, as the end may be rolled back
+        self.tick = 0
+        #: commands of the local player for the next tick
+        self.pending = []
+        #: tick -> {player id: commands}, only ticks with some commands are kept
+        self.inputs = {}
+        #: tick -> the state of the world before the tick was simulated
+        self.states = {}
+        #: player id -> the last tick whose commands of the player are known
+        self.received = [-1]*num_players
+        #: the oldest tick which has to be simulated again
+        self.rewind_to = None
+        #: number of rollbacks and of the ticks simulated again, for statistics
+        self.rollbacks = self.resimulated = 0
+
+    @property
+    def confirmed(self):
+        '''The last tick whose commands of all the players are known.'''
+        return min(self.received)
+
+    @property
+    def settled(self):
+        '''Whether the world has finished and no late command can change it any more.'''
+        return self.world.finished and self.confirmed >= self.world.ticks-1
+
+    def command(self, command):
+        '''Gives a command of the local player, it is applied in the next tick.'''
+        self.pending.append(command)
+
+    def receive(self, player_id, tick, commands):
+        '''Takes the commands of another player for a tick.
+        The commands of each player must arrive in the order of their ticks, as they do over the server's connection.'''
+        commands = [command for command in commands if command in Player.commands]
+        if commands:
+            self.inputs.setdefault(tick, {})[player_id] = commands
+            if tick < self.tick and (self.rewind_to is None or tick < self.rewind_to):
+                self.rewind_to = tick
+        self.received[player_id] = max(self.received[player_id], tick)
+
+    def player_left(self, player_id, tick):
+        '''Called when another player has disconnected after sending the commands of the tick.
+        The player gives no commands afterwards, so it no longer holds back the confirmed tick.'''
+        self.receive(player_id, tick, [])
+        self.received[player_id] = sys.maxint
+
+    def advance(self):
+        '''Repairs the world if late commands have arrived, then simulates the next tick with the local commands.
+        Nothing is simulated while the commands of another player are missing for too many ticks; the local commands wait
+        for the next tick which is simulated.
+        @returns: whether a tick was simulated'''
+        if self.rewind_to is not None:
+            self.rollback(self.rewind_to)
+            self.rewind_to = None
+        if self.tick-self.confirmed > self.max_rollback:
+            #the states the missing commands need would be forgotten
+            return False
+        commands, self.pending = self.pending, []
+        if commands:
+            self.inputs.setdefault(self.tick, {})[self.player_id] = commands
+        self.received[self.player_id] = self.tick
+        self.send(self.tick, commands)
+        self.tick += 1
+        self.simulate()
+        self.prune()
+        return True
+
+    def rollback(self, tick):
+        '''Restores the world as it was before the tick and simulates it again up to the present.'''
+        if tick not in self.states:
+            return
+        self.world.load_state(self.states[tick])
+        self.rollbacks += 1
+        before = self.world.ticks
+        self.simulate()
+        self.resimulated += self.world.ticks-before
+
+    def simulate(self):
+        '''Steps the world up to the current tick, saving its state before each step.'''
+        world = self.world
+        while world.ticks < self.tick and not world.finished:
+            self.states[world.ticks] = world.save_state()
+            for player_id, commands in sorted(self.inputs.get(world.ticks, {}).iteritems()):
+                for command in commands:
+                    world.command(player_id, command)
+            world.step()
+
+    def prune(self):
+        '''Forgets the states and commands which can no longer be needed.'''
+        #a late command is always for a tick after the confirmed one, which advance() keeps within max_rollback ticks
+        oldest = self.confirmed+1
+        for tick in [tick for tick in self.states if tick < oldest]:
+            del self.states[tick]
+        for tick in [tick for tick in self.inputs if tick < oldest]:
+            del self.inputs[tick]
@@ -0,0 +1,233 @@
+#server.py
+#Copyright (C) 2011 PyTeam
+
+'''Dedicated server which hosts many network matches in one process, without a display.
+Clients are put into rooms. Each room plays a map and runs its own match, stepped at the simulation's rate.
+
+Running the server:
+    python server.py --port 8000
+
+Clients which just connect, like the game's 'Join Network Game' menu, are put into the first room which waits
+for players. The lobby messages (rooms, create_room, join_room, leave_room, start_room) allow choosing a room.
+A room whose match is over waits again: it starts a new match only when another player joins it or when one of its
+members asks for it with start_room, not with the players who are just leaving after the end of the last one.
+'''
+
+import time
+from PodSixNet.Server import Server
+from PodSixNet.asyncwrapper import poll
+from controllers import ClientChannel, matches
+import maps
+from simulation import Simulation
+
+
+class Room(object):
+    '''A group of clients which play a map together.'''
+
+    def __init__(self, name, map_info, match_class, replay_dir=None, bots=0):
+        '''@type map_info: maps.MapInfo
+           @param match_class: controllers.Match or controllers.RelayMatch
+           @param replay_dir: directory to record the matches into
+           @param bots: the most bots joining the players of a match, as many as the map has room for'''
+        self.name = name
+        self.match_class = match_class
+        self.replay_dir = replay_dir
+        self.bots = bots
+        self.map_name = map_info.name
+        self.map_path = map_info.path
+        self.max_players = map_info.max_players
+        self.members = []
+        #: the running match, None while the room waits for players
+        self.match = None
+        #: when the next step of the match should be made
+        self.next_tick = None
+        #: when the room starts by itself if there are enough players, None until somebody joins it
+        self.start_at = None
+
+    @property
+    def full(self):
+        return len(self.members) >= self.max_players
+
+    def describe(self):
+        return {'name': self.name, 'map': self.map_name, 'players': len(self.members),
+                'max_players': self.max_players, 'started': self.match is not None}
+
+    def join(self, channel, now, start_delay):
+        self.members.append(channel)
+        channel.room = self
+        self.start_at = now+start_delay
+
+    def leave(self, channel):
+        if channel in self.members:
+            self.members.remove(channel)
+        if channel.match is not None:
+            channel.match.leave(channel)
+        channel.room = None
+
+    def start(self, now):
+        #the compiled map is read when the match starts, so a map edited meanwhile is played as it is now
+        self.match = self.match_class(maps.load(self.map_path), self.members, replay_dir=self.replay_dir,
+                                      bots=max(0, min(self.bots, self.max_players-len(self.members))))
+        self.next_tick = now
+        self.start_at = None
+
+    def finish(self):
+        '''Ends the finished match. The room does not start again by itself until somebody joins it.'''
+        for channel in self.members:
+            if channel.match is self.match:
+                channel.match = None
+        self.match = None
+        self.start_at = None
+
+    def step(self, now, max_steps):
+        '''Makes the steps of the match which are due.
+        @returns: number of the steps made'''
+        steps = 0
+        while self.match is not None and now >= self.next_tick and steps < max_steps:
+            self.match.step()
+            self.next_tick += Simulation.tick_length
+            steps += 1
+            if self.match.finished:
+                self.finish()
+        if self.match is not None and steps == max_steps and now >= self.next_tick:
+            #the server is overloaded, the match is slowed down instead of falling behind forever
+            self.next_tick = now
+        return steps
+
+
+class LobbyChannel(ClientChannel):
+    '''Connection of the dedicated server to a client.'''
+    #: the room the client is in
+    room = None
+
+    def Network_rooms(self, data):
+        self._server.send_rooms(self)
+
+    def Network_create_room(self, data):
+        self._server.create_room(self, data.get('map'))
+
+    def Network_join_room(self, data):
+        self._server.join_room(self, data.get('room'))
+
+    def Network_leave_room(self, data):
+        self._server.leave_room(self)
+
+    def Network_start_room(self, data):
+        if self.room is not None and self.room.match is None and len(self.room.members) > 1:
+            self.room.start(time.time())
+
+
+class LobbyServer(Server):
+    '''Hosts any number of rooms, each of which runs a match independently of the others.'''
+    channelClass = LobbyChannel
+    #: the most steps a room makes at once when the server falls behind
+    max_room_steps = 5
+
+    def __init__(self, maps_dir='Maps', start_delay=10.0, autojoin=True, netcode='snapshot', replay_dir=None, bots=0, *args, **kwargs):
+        '''@param maps_dir: directory with the maps which can be played
+           @param start_delay: seconds a room with at least two players waits for more of them after the last one joined
+           @param autojoin: whether clients are put into a room as soon as they connect
+           @param netcode: 'snapshot' to simulate the matches on the server, 'rollback' to let the clients simulate them
+           @param replay_dir: directory to record the matches into, they are not recorded if omitted
+           @param bots: the most bots joining the players of each match, only with snapshot netcode'''
+        Server.__init__(self, *args, **kwargs)
+        #: map name -> maps.MapInfo
+        self.maps = maps.MapIndex(maps_dir).maps
+        if not self.maps:
+            raise RuntimeError('There are no maps in %s'%maps_dir)
+        self.start_delay = start_delay
+        self.autojoin = autojoin
+        self.match_class = matches[netcode]
+        self.replay_dir = replay_dir
+        self.bots = bots
+        #: room name -> room
+        self.rooms = {}
+        self._room_number = 0
+
+    def Connected(self, channel, addr):
+        if self.autojoin:
+            self.quick_join(channel)
+        self.send_rooms(channel)
+
+    def Disconnected(self, channel):
+        self.leave_room(channel)
+        if channel in self.channels:
+            self.channels.remove(channel)
+
+    def send_rooms(self, channel):
+        channel.outbox.put({'action': 'rooms', 'rooms': [room.describe() for room in sorted(self.rooms.values(), key=lambda room: room.name)]})
+
+    def create_room(self, channel, map_name=None):
+        info = self.maps.get(map_name) or self.maps[sorted(self.maps)[0]]
+        self._room_number += 1
+        room = self.rooms['room%d'%self._room_number] = Room('room%d'%self._room_number, info, self.match_class, self.replay_dir, self.bots)
+        self.join_room(channel, room.name)
+        return room
+
+    def join_room(self, channel, name):
+        room = self.rooms.get(name)
+        if room is None or room.match is not None or room.full:
+            channel.outbox.put({'action': 'room_error', 'room': name})
+            return
+        self.leave_room(channel)
+        room.join(channel, time.time(), self.start_delay)
+        self.send_rooms(channel)
+
+    def leave_room(self, channel):
+        room = channel.room
+        if room is None:
+            return
+        room.leave(channel)
+        if not room.members:
+            del self.rooms[room.name]
+
+    def quick_join(self, channel):
+        '''Puts the client into the first room which waits for players, creating one if there is none.'''
+        for name in sorted(self.rooms):
+            room = self.rooms[name]
+            if room.match is None and not room.full:
+                return self.join_room(channel, name)
+        self.create_room(channel)
+
+    def tick(self, now):
+        '''Starts the rooms which are ready and makes the steps which are due.'''
+        for room in self.rooms.values():
+            if room.match is None:
+                if len(room.members) > 1 and room.start_at is not None and (room.full or now >= room.start_at):
+                    room.start(now)
+            else:
+                room.step(now, self.max_room_steps)
+        for channel in self.channels:
+            channel.outbox.flush()
+
+    def next_deadline(self, now):
+        '''Returns when tick() should be called next.'''
+        deadlines = [room.next_tick for room in self.rooms.values() if room.match is not None]
+        deadlines.extend(room.start_at for room in self.rooms.values() if room.start_at is not None and len(room.members) > 1)
+        return min(deadlines) if deadlines else now+0.1
+
+    def serve_forever(self):
+        while True:
+            now = time.time()
+            self.tick(now)
+            for channel in self.channels:
+                channel.Pump()
+            #wait for network activity until the next step is due
+            poll(max(0.0, self.next_deadline(time.time())-time.time()), map=self._map)
+
+
+if __name__=="__main__":
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-a', '--address', default='0.0.0.0', help='address to listen on')
+    parser.add_option('-p', '--port', type='int', default=8000, help='port to listen on')
+    parser.add_option('-m', '--maps', default='Maps', help='directory with the maps')
+    parser.add_option('-d', '--start-delay', type='float', default=10.0, help='seconds a room waits for more players')
+    parser.add_option('-n', '--netcode', choices=sorted(matches), default='snapshot', help='snapshot or rollback')
+    parser.add_option('-r', '--record', metavar='DIR', help='directory to save a replay of each match into')
+    parser.add_option('-b', '--bots', type='int', default=0, help='bots filling the free places of each match')
+    options, args = parser.parse_args()
+    server = LobbyServer(options.maps, options.start_delay, netcode=options.netcode, replay_dir=options.record,
+                         bots=options.bots, localaddr=(options.address, options.port))
+    print 'listening on %s:%d, maps: %s'%(options.address, options.port, ', '.join(sorted(server.maps)))
+    server.serve_forever()
@@ -0,0 +1,409 @@
+#simulation.py
+#Copyright (C) 2011 PyTeam
+
+'''The game world without any presentation.
+Simulation knows how to load a level and run the rules of the game on it,
+but it never touches the display, the mixer or the clock, so a match can be
+stepped as fast as the CPU allows, for example on a server or a CI box.
+
+Running scripted matches from the command line:
+    python simulation.py Maps/map1.bff --matches 100
+Adding --record replays keeps each match as a replay, see replay.py, and --bots lets bots play instead of random actions.
+'''
+
+import random
+import time
+from collections import deque, namedtuple, OrderedDict
+import pygame
+from gameobjects import *
+import assets
+import bots
+import maps
+import pools
+import spatial
+
+#: everything which changes during a match, as returned by Simulation.save_state
+WorldState = namedtuple('WorldState', ('ticks', 'last_id', 'finished', 'players_alive', 'scores', 'random', 'tiles', 'objects'))
+
+
+class Simulation(object):
+    '''Represents the world of a single match: the level, its objects, rules and scoring.'''
+    #: whether objects are drawn; images are not loaded at all in a headless simulation
+    headless = True
+    #: side of a tile in the coordinate system of rects when nothing is drawn
+    tile_side = 16
+    #: the fixed time step used by step(), in seconds
+    tick_length = 0.02
+    #: names of the groups of level objects; the groups an object belongs to are a part of a saved state
+    level_groups = ('all', 'dynamic', 'bombs', 'destroyable', 'bonuses')
+
+    def __init__(self):
+        self.step_length=0.25
+        self.delta = 0
+        #: random generator of the world; network peers and replays seed it identically
+        self.random = random.Random()
+        self.players = []
+        self.num_players = self.players_alive = 0
+        self.players_score=[0]*10
+        self.is_network_game = self.is_server = False
+        #: whether the current match is over
+        self.finished = False
+        #: number of steps made in the current match
+        self.ticks = 0
+        #: the last id given to a level object, ids identify objects in network snapshots
+        self.last_id = 0
+        #: the maps.Map and the seed of the current match
+        self.map = self.seed = None
+        #: replay.Recorder told about the commands of the current match, if it is being recorded
+        self.recorder = None
+        #: bombs set off during the current tick, they explode when all the objects have been updated
+        self.set_off_bombs = []
+        #: killed fires, bombs and bonuses kept to be used again
+        self.pools = pools.Pools()
+        #: callable given the world before each step which drives the computer players, see controllers.BotController
+        self.bots = None
+        self.assets = self.create_assets()
+        self.create_groups()
+        super(Simulation, self).__init__()
+
+    def create_assets(self):
+        '''Returns the asset manager of the game. Only its manifest is used when the game is headless.'''
+        return assets.AssetManager()
+
+    def create_groups(self):
+        '''Creates sprite groups needed for the game'''
+        #objects are updated in the order of their creation, which is the same in every process
+        self.all = pygame.sprite.OrderedUpdates()
+        self.dynamic = pygame.sprite.Group()
+        self.bombs = pygame.sprite.Group()
+        self.destroyable = pygame.sprite.Group()
+        self.bonuses = pygame.sprite.Group()
+        #: spatial index of level objects, it is created again with the right cell size when a level is loaded
+        self.index = spatial.SpatialIndex(self.tile_side)
+        #: walls and boxes of the level, they are not sprites; it is created again when a level is loaded
+        self.grid = spatial.TileGrid(0, 0)
+        #: bots.DangerMap of the level, made when a bot first asks for it, see danger_map()
+        self.danger = None
+
+    def add_object(self, obj):
+        '''Called by a level object when it is created.'''
+        self.last_id += 1
+        obj.net_id = self.last_id
+        self.index.add(obj)
+        if self.danger is not None:
+            self.danger.added(obj)
+
+    def remove_object(self, obj):
+        '''Called by a level object when it is killed.'''
+        self.index.remove(obj)
+        if self.danger is not None:
+            self.danger.removed(obj)
+
+    def object_moved(self, obj):
+        '''Called by a level object after its rect has changed.'''
+        self.index.move(obj)
+        if self.danger is not None:
+            self.danger.moved(obj)
+
+    def remove_tile(self, x, y):
+        '''Clears a tile of the level.'''
+        self.grid.set(x, y, spatial.EMPTY)
+        if self.danger is not None:
+            self.danger.tile_removed(x, y)
+
+    def danger_map(self):
+        '''Returns the bots.DangerMap of the level. It is kept up to date from the time it is made until the level
+        is thrown away or a saved state is loaded, so nothing is spent on it in matches without bots.'''
+        if self.danger is None:
+            self.danger = bots.DangerMap(self)
+        return self.danger
+
+    def destroy_box(self, x, y):
+        '''Called when the fire reaches a box. The box may leave a bonus.'''
+        leave = self.random.choice([True,False])
+        bonus = self.random.choice(BOX_BONUSES)
+        if leave: self.pools.create(bonus,self,x,y,[self.all,self.destroyable,self.bonuses])
+        self.remove_tile(x, y)
+
+    def set_off(self, bomb):
+        '''Called by a bomb whose time is up or which the fire has reached.'''
+        self.set_off_bombs.append(bomb)
+
+    def resolve_explosions(self):
+        '''Explodes the bombs set off during the tick and, breadth first, the bombs their fire reaches.
+        A bomb reached by the fire is taken off the level at once, so other rays go on past it, and explodes in its turn;
+        each bomb explodes once however many rays reach it. Boxes and other objects stay on the level until all the blasts
+        are known. Then each burning cell gets a single fire, owned by the first bomb reaching it, the boxes are destroyed
+        and the objects hit are burnt, everything in the order it was reached.
+        '''
+        set_off, self.set_off_bombs = self.set_off_bombs, []
+        #the objects of a match which has ended during the tick have been thrown away
+        if not set_off or self.finished:
+            return
+        queue = deque()
+        taken = set()
+        def take(bomb):
+            if bomb not in taken:
+                taken.add(bomb)
+                queue.append(bomb)
+                #the rays computed before the bomb explodes must not stop at it
+                self.remove_object(bomb)
+        for bomb in set_off:
+            take(bomb)
+        #: cell -> player owning its fire
+        cells = OrderedDict()
+        boxes = OrderedDict()
+        #: object -> the cell where the fire reached it
+        hits = OrderedDict()
+        while queue:
+            bomb = queue.popleft()
+            for ray, box, ray_hits in bomb.detonate():
+                for cell in ray:
+                    cells.setdefault(cell, bomb.player)
+                if box:
+                    boxes[ray[-1]] = None
+                for obj in ray_hits:
+                    if isinstance(obj, Bomb):
+                        take(obj)
+                    elif obj not in hits:
+                        hits[obj] = ray[-1]
+        fires = {}
+        for (x, y), player in cells.iteritems():
+            fires[x, y] = self.pools.create(Fire, self, player, x, y, groups=(self.all, self.dynamic))
+        for x, y in boxes:
+            self.destroy_box(x, y)
+        for obj, cell in hits.iteritems():
+            obj.collide(fires[cell])
+
+    def blocked(self, rect):
+        '''Returns whether the rect collides with a wall or a box.
+        A tile covers the same pixels as the rect returned by tile_rect.'''
+        side, grid = self.side, self.grid
+        left, top = rect.left-self._absw, rect.top-self._absh
+        for y in range((top+1)//side, (top+rect.height-1)//side+1):
+            for x in range((left+1)//side, (left+rect.width-1)//side+1):
+                if grid.get(x, y):
+                    return True
+        return False
+
+    def layout(self):
+        '''Chooses the side of a tile and the offset of the level.
+        Nothing is shown, so tiles are of a fixed size and start at the origin.'''
+        self.side = self.tile_side
+        self._absw = self._absh = 0
+
+    @property
+    def level(self):
+        '''The map of the current match in the source format, as it is recorded into replays.'''
+        return self.map.source() if self.map is not None else None
+
+    def load_level(self, level):
+        '''Loads the chosen map for a needed amount of players
+        @type level: maps.Map'''
+        self.height,self.width,self.max_players = level.height, level.width, level.max_players
+        self.layout()
+        self.index = spatial.SpatialIndex(self.side)
+        self.grid = spatial.TileGrid(self.width, self.height)
+        self.grid.tiles[:] = level.tiles
+        self.danger = None
+        self.available = list(level.spawns)
+        self.random.shuffle(self.available)
+        self.players = []
+        for i in range(self.num_players):
+            self.players.append(Player(self, self.available[i][0], self.available[i][1], i, groups=(self.all, self.destroyable)))
+
+    def start_match(self, level, num_players, seed=None):
+        '''Loads the level and prepares a new match.
+        @param level: path to the map file, the opened file or the map itself
+        @type level: str, file or maps.Map
+        @param seed: seed of the world's random generator, a random one is used if omitted
+        '''
+        if self.recorder is not None:
+            #the last match was left before its end
+            self.recorder.close(self)
+            self.recorder = None
+        if isinstance(level, maps.Map):
+            self.map = level
+        elif isinstance(level, basestring):
+            self.map = maps.load(level)
+        else:
+            self.map = maps.Map.parse(level.read())
+        #the seed is chosen here rather than by the generator, so that it can be recorded
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.random.seed(self.seed)
+        self.num_players = num_players
+        self.finished = False
+        self.ticks = 0
+        #the bots of the last match, if any, leave with it
+        self.bots = None
+        self.load_level(self.map)
+        self.players_alive = num_players
+
+    def command(self, player_id, command):
+        '''Makes a player do what its controller asks. Commands of dead players are ignored.
+        @param command: one of Player.commands
+        @type command: str
+        '''
+        if command not in Player.commands:
+            return
+        player = self.players[player_id]
+        if not player.alive():
+            return
+        if self.recorder is not None:
+            self.recorder.record(self.ticks, player_id, command)
+        getattr(player, command)()
+
+    def save_state(self):
+        '''Returns the state of the match, which load_state() can bring back later.
+        Level objects are kept by reference together with copies of their attributes, which is much cheaper than pickling.
+        @rtype: WorldState
+        '''
+        groups = [(name, getattr(self, name).spritedict) for name in self.level_groups]
+        objects = [(obj, tuple(name for name, members in groups if obj in members), obj.get_state())
+                   for obj in self.all.sprites() if obj.collidable]
+        return WorldState(self.ticks, self.last_id, self.finished, self.players_alive, self.players_score[:],
+                          self.random.getstate(), bytearray(self.grid.tiles), objects)
+
+    def load_state(self, state):
+        '''Brings the match back to a state returned by save_state().
+        Objects created since are thrown away, killed ones come back. Menus shown over the level are kept.
+        @type state: WorldState
+        '''
+        menus = [obj for obj in self.all.sprites() if not obj.collidable]
+        for name in self.level_groups:
+            getattr(self, name).empty()
+        self.index = spatial.SpatialIndex(self.side)
+        #objects are put back in the order they were saved in, so they keep their order in the groups and in the index
+        for obj, names, attributes in state.objects:
+            obj.set_state(attributes)
+            obj.add(*[getattr(self, name) for name in names])
+            self.index.add(obj)
+        self.pools.revive(obj for obj, names, attributes in state.objects if obj.pooled)
+        self.all.add(*menus)
+        if len(self.grid.tiles) != len(state.tiles):
+            #the grid was thrown away by the end of the match
+            self.grid = spatial.TileGrid(self.width, self.height)
+        self.grid.tiles[:] = state.tiles
+        self.ticks, self.last_id, self.finished, self.players_alive = state.ticks, state.last_id, state.finished, state.players_alive
+        self.players_score[:] = state.scores
+        self.random.setstate(state.random)
+        #the danger map is made again from the loaded objects when it is needed
+        self.danger = None
+
+    def end_game(self):
+        '''Called when there is at most one player left.'''
+        for obj in self.all:
+            obj.unregister_all_event_handlers()
+            if not isinstance(obj, Player):
+                obj.kill()
+        self.create_groups()
+        self.finished = True
+        self.bots = None
+        if self.recorder is not None:
+            self.recorder.close(self)
+            self.recorder = None
+
+    def xcoord_to_screen(self, x):
+        '''Translates given x coordinate from the game coord system to screen coord system.'''
+        return self._absw+x*self.side
+
+    def ycoord_to_screen(self, y):
+        '''Translates given y coordinate from the game coord system to screen coord system.'''
+        return self._absh+y*self.side
+
+    def tile_rect(self, x, y):
+        '''Returns the rect of an object of the size of a tile standing at the given cell.'''
+        return pygame.rect.Rect(self.xcoord_to_screen(x), self.ycoord_to_screen(y), self.side-1, self.side-1)
+
+    def play_explosion(self):
+        '''Called when a bomb explodes. There is nothing to hear in the simulation.'''
+        pass
+
+    def update(self):
+        '''Updates all the objects on the level.
+        Objects killed earlier during the same update, for example by the end of the match, are not updated.
+        The bombs set off during the update explode after it.'''
+        for obj in self.all.sprites():
+            if obj in self.all.spritedict:
+                obj.update()
+        self.resolve_explosions()
+
+    def step(self, delta=None):
+        '''Advances the world by a fixed time step.'''
+        self.delta = self.tick_length if delta is None else delta
+        if self.bots is not None:
+            #the commands of the bots are recorded at the tick they are given, as those of a script of run()
+            self.bots(self)
+        #the tick is counted before it is simulated, so a match which ends during it is as long as the ticks made
+        self.ticks += 1
+        self.update()
+
+    def run(self, script=None, max_ticks=None):
+        '''Steps the world without any delay until the match is over.
+        @param script: callable which is given the simulation before each step, used to drive the players
+        @param max_ticks: stop after this number of steps even if the match is not over
+        @returns: the scores of the players
+        @rtype: list
+        '''
+        while not self.finished and (max_ticks is None or self.ticks < max_ticks):
+            if script is not None:
+                script(self)
+            self.step()
+        return self.players_score[:self.num_players]
+
+
+class RandomScript(object):
+    '''Drives all the players of a simulation by random actions.'''
+    actions = ('go_up', 'go_down', 'go_left', 'go_right')
+
+    def __init__(self, seed=None, bomb_rate=0.02, turn_rate=0.1, stop_rate=0.05):
+        self.random = random.Random(seed)
+        self.bomb_rate, self.turn_rate, self.stop_rate = bomb_rate, turn_rate, stop_rate
+
+    def __call__(self, simulation):
+        for player in simulation.players:
+            if not player.alive():
+                continue
+            r = self.random.random()
+            if r < self.bomb_rate:
+                simulation.command(player.id, 'put_bomb')
+            elif r < self.bomb_rate+self.turn_rate:
+                simulation.command(player.id, self.random.choice(self.actions))
+            elif r < self.bomb_rate+self.turn_rate+self.stop_rate:
+                simulation.command(player.id, 'stop')
+
+
+if __name__=="__main__":
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] map.bff')
+    parser.add_option('-m', '--matches', type='int', default=10, help='number of matches to run')
+    parser.add_option('-p', '--players', type='int', default=2, help='number of players')
+    parser.add_option('-t', '--max-ticks', type='int', default=30000, help='maximum length of a match in steps')
+    parser.add_option('-s', '--seed', type='int', default=0, help='seed of the first match')
+    parser.add_option('-r', '--record', metavar='DIR', help='directory to save a replay of each match into')
+    parser.add_option('-b', '--bots', action='store_true', help='let bots play instead of random actions')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('exactly one map should be given')
+    sim = Simulation()
+    started = time.time()
+    ticks = 0
+    for match in range(options.matches):
+        sim.players_score = [0]*10
+        sim.start_match(args[0], options.players, seed=options.seed+match)
+        if options.record:
+            import replay
+            replay.record(sim, options.record)
+        if options.bots:
+            import controllers
+            sim.bots = controllers.BotController(sim, range(options.players), options.seed+match)
+            script = None
+        else:
+            script = RandomScript(options.seed+match)
+        scores = sim.run(script, options.max_ticks)
+        ticks += sim.ticks
+        print 'match %d: %d ticks, scores %s'%(match, sim.ticks, scores)
+        if not sim.finished:
+            sim.end_game()
+    elapsed = time.time()-started
+    print '%d matches, %d ticks in %.2f s (%.0f ticks/s)'%(options.matches, ticks, elapsed, ticks/max(elapsed, 1e-9))
@@ -0,0 +1,240 @@
+#snapshot.py
+#Copyright (C) 2011 PyTeam
+
+'''Snapshots of the world which the server of a network game sends to its clients.
+A snapshot lists the level objects, the tiles and the scores after a step. It is sent as the difference
+against the last snapshot the client has acknowledged, packed with struct and compressed,
+so a tick when little happens costs a few bytes however many objects there are on the level.
+'''
+
+import base64
+import os
+import struct
+import zlib
+from gameobjects import *
+
+#: classes of the objects kept in snapshots, the position of a class is sent instead of its name
+KINDS = (Player, Bomb, Fire, SpeedUpBonus, AddBombBonus, MoveBombsBonus, IncreaseRadiusBonus,
+         SpeedDownBonus, ReduceRadiusBonus, ExchangePlacesBonus)
+_kind_numbers = dict((klass, number) for number, klass in enumerate(KINDS))
+
+#: base tick of a snapshot which does not depend on another one
+NO_BASE = 0xFFFFFFFF
+#: how many ticks old a snapshot may be to be used as a base
+HISTORY = 64
+
+#tick, base tick, players alive, finished, number of scores
+_header = struct.Struct('<IIBBB')
+_score = struct.Struct('<h')
+#changed objects, removed objects, changed tiles or the length of all the tiles
+_counts = struct.Struct('<III')
+#id, kind, x, y and three small numbers telling how the object looks
+_record = struct.Struct('<IBffBBB')
+_removed = struct.Struct('<I')
+_tile = struct.Struct('<IB')
+
+
+def _looks(obj):
+    '''Returns the three numbers which tell how the object looks.'''
+    if isinstance(obj, Player):
+        return obj.id, obj.cur_line, obj.cur_pic
+    if isinstance(obj, Bomb):
+        #the number of the countdown image, 0 while the bomb shows its usual image
+        return (int(obj.time*10) if 0.1 <= obj.time < 1.2 else 0), 0, 0
+    if isinstance(obj, Bonus):
+        return obj.cur_ind, 0, 0
+    return 0, 0, 0
+
+
+class Snapshot(object):
+    '''The state of the world after a step, as seen by the players.'''
+
+    def __init__(self, tick, players_alive, finished, scores, objects, tiles, base_tick=NO_BASE, tile_changes=None):
+        '''@param objects: id -> (kind, x, y, a, b, c)
+           @type objects: dict
+           @param tiles: the tiles of the level
+           @type tiles: bytearray
+           @param base_tick: tick of the snapshot this one was decoded against
+           @param tile_changes: indices of the tiles which differ from the base snapshot, None if all of them may differ
+           @type tile_changes: list'''
+        self.tick = tick
+        self.base_tick = base_tick
+        self.players_alive = players_alive
+        self.finished = finished
+        self.scores = scores
+        self.objects = objects
+        self.tiles = tiles
+        self.tile_changes = tile_changes
+
+    @classmethod
+    def capture(cls, world):
+        '''Takes a snapshot of a simulation.'''
+        objects = {}
+        for obj in world.all:
+            kind = _kind_numbers.get(obj.__class__)
+            if kind is not None:
+                objects[obj.net_id] = (kind, obj.x, obj.y)+_looks(obj)
+        return cls(world.ticks, world.players_alive, world.finished, world.players_score[:world.num_players],
+                   objects, bytearray(world.grid.tiles))
+
+    def encode(self, base=None):
+        '''Returns the snapshot as a string to be sent to a client which has the base snapshot.
+        The whole snapshot is encoded if there is no base.'''
+        if base is None:
+            changed = self.objects.items()
+            removed = []
+        else:
+            changed = [(id, record) for id, record in self.objects.iteritems() if base.objects.get(id) != record]
+            removed = [id for id in base.objects if id not in self.objects]
+        parts = [_header.pack(self.tick, NO_BASE if base is None else base.tick, self.players_alive, self.finished, len(self.scores))]
+        parts.extend(_score.pack(score) for score in self.scores)
+        if base is None:
+            parts.append(_counts.pack(len(changed), 0, len(self.tiles)))
+        else:
+            tiles = []
+            if self.tiles != base.tiles:
+                tiles = [(i, tile) for i, (tile, old) in enumerate(zip(self.tiles, base.tiles)) if tile != old]
+            parts.append(_counts.pack(len(changed), len(removed), len(tiles)))
+        parts.extend(_record.pack(id, *record) for id, record in changed)
+        parts.extend(_removed.pack(id) for id in removed)
+        if base is None:
+            parts.append(str(self.tiles))
+        else:
+            parts.extend(_tile.pack(i, tile) for i, tile in tiles)
+        #PodSixNet splits its stream at '\0---\0', which compressed bytes may contain, so they are sent as text
+        return base64.b64encode(zlib.compress(''.join(parts), 1))
+
+    @classmethod
+    def decode(cls, data, bases):
+        '''Restores a snapshot encoded by encode().
+        @param bases: tick -> snapshots received earlier, one of them may be the base of this one
+        @type bases: dict
+        '''
+        data = zlib.decompress(base64.b64decode(data))
+        tick, base_tick, players_alive, finished, num_scores = _header.unpack_from(data)
+        offset = _header.size
+        scores = [_score.unpack_from(data, offset+i*_score.size)[0] for i in range(num_scores)]
+        offset += num_scores*_score.size
+        num_changed, num_removed, num_tiles = _counts.unpack_from(data, offset)
+        offset += _counts.size
+        if base_tick == NO_BASE:
+            objects, tiles, tile_changes = {}, None, None
+        else:
+            base = bases[base_tick]
+            objects, tiles, tile_changes = dict(base.objects), bytearray(base.tiles), []
+        for i in range(num_changed):
+            record = _record.unpack_from(data, offset)
+            objects[record[0]] = record[1:]
+            offset += _record.size
+        for i in range(num_removed):
+            del objects[_removed.unpack_from(data, offset)[0]]
+            offset += _removed.size
+        if tiles is None:
+            tiles = bytearray(data[offset:offset+num_tiles])
+        else:
+            for i in range(num_tiles):
+                index, tile = _tile.unpack_from(data, offset)
+                tiles[index] = tile
+                tile_changes.append(index)
+                offset += _tile.size
+        return cls(tick, players_alive, bool(finished), scores, objects, tiles, base_tick, tile_changes)
+
+    @staticmethod
+    def peek(data):
+        '''Returns the tick of an encoded snapshot and whether the match is over, without restoring the snapshot.'''
+        tick, base_tick, players_alive, finished, num_scores = _header.unpack_from(zlib.decompress(base64.b64decode(data)))
+        return tick, bool(finished)
+
+
+class Mirror(object):
+    '''Keeps the level objects of a network client as the server's snapshots describe them.
+    The client does not run the rules of the game, it only shows what the server has simulated.
+    '''
+
+    def __init__(self, game):
+        self.game = game
+        #: id -> the object showing it
+        self.objects = {}
+        #: tick -> snapshot, kept while the server may use them as bases
+        self.snapshots = {}
+        #: the snapshot shown now
+        self.last = None
+
+    def receive(self, data):
+        '''Decodes a snapshot sent by the server and shows it.
+        @returns: the snapshot, which should be acknowledged
+        @rtype: Snapshot
+        '''
+        snapshot = Snapshot.decode(data, self.snapshots)
+        #acknowledgements arrive in order, so the server never goes back to a base older than the last one
+        oldest = snapshot.tick-HISTORY if snapshot.base_tick == NO_BASE else snapshot.base_tick
+        for tick in self.snapshots.keys():
+            if tick < oldest:
+                del self.snapshots[tick]
+        self.snapshots[snapshot.tick] = snapshot
+        self.apply(snapshot)
+        return snapshot
+
+    def apply(self, snapshot):
+        game = self.game
+        shown = self.last.objects if self.last is not None else {}
+        for id, record in snapshot.objects.iteritems():
+            obj = self.objects.get(id)
+            if obj is not None and obj.__class__ is not KINDS[record[0]]:
+                #a world which was rolled back may give the id to another object
+                GameObject.kill(self.objects.pop(id))
+                obj = None
+            if obj is None:
+                obj = self.objects[id] = self.create(record)
+            elif shown.get(id) == record:
+                continue
+            self.show(obj, record)
+        for id in self.objects.keys():
+            if id not in snapshot.objects:
+                obj = self.objects.pop(id)
+                if isinstance(obj, Bomb):
+                    game.play_explosion()
+                #Player.kill would end the game, the end is told by the snapshot
+                GameObject.kill(obj)
+        tiles = game.grid.tiles
+        if snapshot.tile_changes is not None:
+            changes = snapshot.tile_changes
+        elif tiles != snapshot.tiles:
+            #the tiles of a finished world are thrown away
+            changes = range(min(len(tiles), len(snapshot.tiles)))
+        else:
+            changes = ()
+        for i in changes:
+            if tiles[i] != snapshot.tiles[i]:
+                x, y = i%game.grid.width, i//game.grid.width
+                if snapshot.tiles[i] == spatial.EMPTY:
+                    game.remove_tile(x, y)
+                else:
+                    game.grid.set(x, y, snapshot.tiles[i])
+        game.players_alive = snapshot.players_alive
+        game.players_score[:len(snapshot.scores)] = snapshot.scores
+        self.last = snapshot
+        if snapshot.finished:
+            game.end_game()
+
+    def create(self, record):
+        '''Creates an object which shows a new object of the server.'''
+        kind, x, y = KINDS[record[0]], record[1], record[2]
+        if kind is Player:
+            return self.game.players[record[3]]
+        #the object only has to look right, so none of the constructors' rules are run
+        obj = kind.__new__(kind)
+        GameObject.__init__(obj, self.game, x, y, groups=(self.game.all, ))
+        return obj
+
+    def show(self, obj, record):
+        obj.x, obj.y = record[1], record[2]
+        obj.update_rect()
+        if isinstance(obj, Player):
+            obj.cur_line, obj.cur_pic = record[4], record[5]
+            obj.image = obj.player_images[obj.id][obj.cur_line][obj.cur_pic]
+        elif isinstance(obj, Bomb):
+            obj.image = obj.load_image(os.path.join('bomb', '%d.png'%record[3])) if record[3] else obj.images[0]
+        elif isinstance(obj, Bonus):
+            obj.cur_ind = record[3]
+            obj.image = obj.images[obj.cur_ind]
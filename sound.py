@@ -0,0 +1,174 @@
+#sound.py
+#Copyright (C) 2011 PyTeam
+
+'''Sound effects and music.
+SoundManager loads each effect once and plays it on mixer channels reserved for the effect's category, so a chain
+of explosions cannot take the channels of the menu clicks or of the music. When all the channels of a category are busy,
+the one playing for the longest time is taken over. Effects asked for during a tick are played together by flush(),
+called after each step: the same effect asked for several times is played once, louder the more times it was asked for.
+NullBackend plays nothing and loads nothing; it is used in headless runs and when there is no audio device.
+'''
+
+import os
+import random
+import pygame
+
+#: effect -> (category, files in the Data directory); one of the files is chosen at random each time
+EFFECTS = {
+    'explosion': ('explosion', ('explosion.ogg', 'explosion2.ogg', 'explosion3.ogg')),
+    'click': ('ui', ('click.ogg', )),
+    'music': ('music', ('Pandemonium.ogg', )),
+}
+
+
+class MixerBackend(object):
+    '''Plays the sounds through pygame.mixer.'''
+
+    def __init__(self, channels):
+        '''@param channels: number of the channels to reserve
+           @raise pygame.error: if there is no audio device'''
+        pygame.mixer.init()
+        if pygame.mixer.get_num_channels() < channels:
+            pygame.mixer.set_num_channels(channels)
+        #sounds played by pygame itself never take the reserved channels
+        pygame.mixer.set_reserved(channels)
+
+    def load(self, path):
+        return pygame.mixer.Sound(path)
+
+    def channel(self, number):
+        return pygame.mixer.Channel(number)
+
+
+class NullChannel(object):
+    '''A channel which plays nothing and is never busy.'''
+
+    def play(self, sound, loops=0):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+    def get_busy(self):
+        return False
+
+
+class NullBackend(object):
+    '''Plays nothing, for headless runs and machines without an audio device.'''
+
+    def __init__(self, channels):
+        pass
+
+    def load(self, path):
+        return None
+
+    def channel(self, number):
+        return NullChannel()
+
+
+#: backends by their names in the configuration
+backends = {
+    'mixer': MixerBackend,
+    'null': NullBackend,
+}
+
+
+class SoundManager(object):
+    '''Plays the effects on the channels of their categories.'''
+    #: how much louder an effect gets for each other time it is asked for in the same tick
+    merge_gain = 0.25
+
+    def __init__(self, backend='mixer', channels=None, volumes=None, directory='Data'):
+        '''@param backend: name of the backend; the null one is used instead of the mixer if there is no audio device
+           @param channels: category -> number of its channels
+           @type channels: dict
+           @param volumes: category -> volume of its effects, from 0 to 1; an effect asked for many times gets louder up to 1
+           @type volumes: dict'''
+        channels = channels if channels is not None else {'explosion': 4, 'ui': 2, 'music': 1}
+        total = sum(channels.itervalues())
+        try:
+            self.backend = backends[backend](total)
+        except pygame.error:
+            self.backend = NullBackend(total)
+        self.directory = directory
+        #: category -> its channels
+        self.channels = {}
+        number = 0
+        for category in sorted(channels):
+            self.channels[category] = [self.backend.channel(number+i) for i in range(channels[category])]
+            number += channels[category]
+        self.volumes = dict.fromkeys(self.channels, 1.0)
+        self.volumes.update(volumes or {})
+        #: effect -> loaded sounds of its files
+        self.sounds = {}
+        #: (effect, loops) -> number of times it was asked for since the last flush, in the order they were first asked for
+        self.pending = {}
+        self._order = []
+        #: channel -> number of the play it started, the lowest one has been playing for the longest time
+        self._started = {}
+        self._plays = 0
+        self.random = random.Random()
+        #: effects asked for, played and played over another sound
+        self.requested = self.played = self.stolen = 0
+
+    def play(self, effect, loops=0):
+        '''Asks for an effect to be played by the next flush().
+        @param loops: how many times the sound is repeated'''
+        key = (effect, loops)
+        self.requested += 1
+        if key in self.pending:
+            self.pending[key] += 1
+        else:
+            self.pending[key] = 1
+            self._order.append(key)
+
+    def flush(self):
+        '''Plays the effects asked for since the last flush.'''
+        if not self._order:
+            return
+        order, pending = self._order, self.pending
+        self._order, self.pending = [], {}
+        for key in order:
+            effect, loops = key
+            category = EFFECTS[effect][0]
+            volume = min(1.0, self.volumes[category]*(1+self.merge_gain*(pending[key]-1)))
+            self._start(category, self.load(effect), volume, loops)
+
+    def _start(self, category, sounds, volume, loops):
+        channels = self.channels[category]
+        if not channels:
+            return
+        free = [channel for channel in channels if not channel.get_busy()]
+        if free:
+            channel = free[0]
+        else:
+            channel = min(channels, key=lambda channel: self._started.get(channel, 0))
+            self.stolen += 1
+        self._plays += 1
+        self._started[channel] = self._plays
+        self.played += 1
+        channel.set_volume(volume)
+        channel.play(self.random.choice(sounds), loops)
+
+    def load(self, effect):
+        '''Returns the sounds of the effect, which are loaded the first time they are needed.'''
+        sounds = self.sounds.get(effect)
+        if sounds is None:
+            sounds = self.sounds[effect] = [self.backend.load(os.path.join(self.directory, name)) for name in EFFECTS[effect][1]]
+        return sounds
+
+    def set_volume(self, category, volume):
+        '''Sets the volume of the category, the sounds playing in it change at once.'''
+        self.volumes[category] = volume
+        for channel in self.channels.get(category, ()):
+            channel.set_volume(volume)
+
+    def stop(self, category):
+        for channel in self.channels.get(category, ()):
+            channel.stop()
+
+    def stats(self):
+        return {'requested': self.requested, 'played': self.played, 'stolen': self.stolen}
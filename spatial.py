@@ -0,0 +1,159 @@
+#spatial.py
+#Copyright (C) 2011 PyTeam
+
+'''Spatial structures which speed up collision detection.'''
+
+#: kinds of tiles kept in a TileGrid
+EMPTY, WALL, BOX = 0, 1, 2
+
+
+class SpatialIndex(object):
+    '''A uniform grid of cells, each of which holds the objects whose rects overlap it.
+    Objects are kept in the index by the game as they are created, moved and killed,
+    so collision checks only test the few objects sharing cells with a rect
+    instead of every sprite on the level.
+    '''
+
+    def __init__(self, cell_size):
+        '''@param cell_size: side of a cell in pixels, usually the side of a tile
+           @type cell_size: int'''
+        self.cell_size = max(1, int(cell_size))
+        #: (cell_x, cell_y) -> {object: None}
+        self._buckets = {}
+        #: object -> tuple of cells it occupies
+        self._cells = {}
+        #: object -> insertion number, which keeps query results in a stable order
+        self._order = {}
+        self._counter = 0
+
+    def __contains__(self, obj):
+        return obj in self._cells
+
+    def __len__(self):
+        return len(self._cells)
+
+    def cells_for(self, rect):
+        '''Returns the cells covered by the rect.'''
+        size = self.cell_size
+        x0, y0 = rect.left//size, rect.top//size
+        x1, y1 = (rect.right-1)//size, (rect.bottom-1)//size
+        if x0 == x1 and y0 == y1:
+            return ((x0, y0), )
+        return tuple((x, y) for x in range(x0, x1+1) for y in range(y0, y1+1))
+
+    def add(self, obj):
+        '''Puts the object into the index using its current rect.'''
+        if obj in self._cells:
+            self.move(obj)
+            return
+        self._counter += 1
+        self._order[obj] = self._counter
+        cells = self.cells_for(obj.rect)
+        self._cells[obj] = cells
+        for cell in cells:
+            bucket = self._buckets.get(cell)
+            if bucket is None:
+                bucket = self._buckets[cell] = {}
+            bucket[obj] = None
+
+    def remove(self, obj):
+        '''Takes the object out of the index. Unknown objects are ignored.'''
+        cells = self._cells.pop(obj, None)
+        if cells is None:
+            return
+        del self._order[obj]
+        for cell in cells:
+            bucket = self._buckets[cell]
+            del bucket[obj]
+            if not bucket:
+                del self._buckets[cell]
+
+    def move(self, obj):
+        '''Must be called after the object's rect was changed.'''
+        old = self._cells.get(obj)
+        if old is None:
+            return
+        cells = self.cells_for(obj.rect)
+        if cells == old:
+            return
+        buckets = self._buckets
+        for cell in old:
+            bucket = buckets[cell]
+            del bucket[obj]
+            if not bucket:
+                del buckets[cell]
+        for cell in cells:
+            bucket = buckets.get(cell)
+            if bucket is None:
+                bucket = buckets[cell] = {}
+            bucket[obj] = None
+        self._cells[obj] = cells
+
+    def query(self, rect, group=None):
+        '''Returns the objects whose rects collide with the given rect.
+        @param group: if specified, only members of this sprite group are returned
+        @type group: pygame.sprite.AbstractGroup
+        @rtype: list
+        '''
+        buckets = self._buckets
+        cells = self.cells_for(rect)
+        if len(cells) == 1:
+            candidates = buckets.get(cells[0], ())
+        else:
+            candidates = {}
+            for cell in cells:
+                bucket = buckets.get(cell)
+                if bucket:
+                    candidates.update(bucket)
+        if group is not None:
+            members = group.spritedict
+            found = [obj for obj in candidates if obj in members and rect.colliderect(obj.rect)]
+        else:
+            found = [obj for obj in candidates if rect.colliderect(obj.rect)]
+        if len(found) > 1:
+            found.sort(key=self._order.__getitem__)
+        return found
+
+    def collide(self, sprite, group=None):
+        '''The same as pygame.sprite.spritecollide(sprite, group, False), but uses the index.
+        The sprite itself is included in the result if it is in the index.'''
+        return self.query(sprite.rect, group)
+
+
+class TileGrid(object):
+    '''Occupancy of the level's tiles by walls and boxes, packed into a byte per tile.
+    Everything outside the level is considered to be a wall.
+    '''
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.tiles = bytearray(width*height)
+
+    def get(self, x, y):
+        '''Returns the kind of the tile at the given cell.'''
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.tiles[y*self.width+x]
+        return WALL
+
+    def set(self, x, y, tile):
+        '''Changes the kind of the tile at the given cell.'''
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.tiles[y*self.width+x] = tile
+
+    def occupied(self, area=None):
+        '''Yields (x, y, tile) for each tile which is not empty.
+        @param area: (left, top, right, bottom) of the tiles to look at, right and bottom excluded; all of them if omitted
+        @type area: tuple'''
+        width = self.width
+        if area is None:
+            for i, tile in enumerate(self.tiles):
+                if tile:
+                    yield i%width, i//width, tile
+            return
+        left, top, right, bottom = area
+        for y in range(top, bottom):
+            start = y*width
+            for x, tile in enumerate(self.tiles[start+left:start+right], left):
+                if tile:
+                    yield x, y, tile
@@ -0,0 +1,97 @@
+#test_rollback.py
+#Copyright (C) 2011 PyTeam
+
+'''Tests of the rollback netcode, run from the game's directory with
+    python -m unittest test_rollback
+Several clients play a match together, each hearing from the others after its own delay, and have to end
+in the same world as a simulation given all the commands at their ticks, whatever they have rolled back.
+'''
+
+import random
+import unittest
+import maps
+from rollback import Rollback
+from simulation import Simulation
+
+
+def describe(world):
+    '''Returns what the players could see differ between two worlds.'''
+    return {'ticks': world.ticks, 'finished': world.finished, 'scores': world.players_score[:world.num_players],
+            'tiles': str(world.grid.tiles),
+            'objects': sorted((obj.__class__.__name__, round(obj.x, 6), round(obj.y, 6)) for obj in world.all)}
+
+
+class RollbackTest(unittest.TestCase):
+    #: frames the commands of each client take to reach the others
+    delays = (0, 2, 5, 9)
+    max_frames = 3000
+
+    def setUp(self):
+        self.level = maps.load('Maps/map2.bff')
+
+    def play(self, seed):
+        '''Plays a match of clients giving random commands.
+        @returns: the clients and tick -> {player id: commands} of all the commands given'''
+        count = len(self.delays)
+        inputs = {}
+        #(frame of the arrival, receiving client, sending player, tick, commands) in the order they were sent
+        wire = []
+        frame = [0]
+        def sender(player_id):
+            def send(tick, commands):
+                if commands:
+                    inputs.setdefault(tick, {})[player_id] = commands
+                for other in range(count):
+                    if other != player_id:
+                        wire.append((frame[0]+self.delays[player_id], other, player_id, tick, commands))
+            return send
+        clients = [Rollback(self.level, count, player_id, seed, sender(player_id)) for player_id in range(count)]
+        rnd = random.Random(seed)
+        for frame[0] in range(self.max_frames):
+            arrived = [message for message in wire if message[0] <= frame[0]]
+            wire[:] = [message for message in wire if message[0] > frame[0]]
+            for at, receiver, player_id, tick, commands in arrived:
+                clients[receiver].receive(player_id, tick, commands)
+            for client in clients:
+                chance = rnd.random()
+                if chance < 0.03:
+                    client.command('put_bomb')
+                elif chance < 0.15:
+                    client.command(rnd.choice(['go_up', 'go_down', 'go_left', 'go_right']))
+                elif chance < 0.2:
+                    client.command('stop')
+                client.advance()
+            if all(client.settled for client in clients):
+                break
+        return clients, inputs
+
+    def replay(self, seed, inputs, ticks):
+        '''Plays the commands in a world which is never rolled back.'''
+        world = Simulation()
+        world.start_match(self.level, len(self.delays), seed)
+        while world.ticks < ticks and not world.finished:
+            for player_id, commands in sorted(inputs.get(world.ticks, {}).iteritems()):
+                for command in commands:
+                    world.command(player_id, command)
+            world.step()
+        return world
+
+    def test_clients_agree_with_simulation(self):
+        for seed in range(1, 5):
+            clients, inputs = self.play(seed)
+            self.assertTrue(all(client.settled for client in clients), 'seed %d'%seed)
+            self.assertTrue(any(client.rollbacks for client in clients), 'seed %d'%seed)
+            expected = describe(self.replay(seed, inputs, clients[0].world.ticks))
+            for client in clients:
+                self.assertEqual(describe(client.world), expected, 'seed %d, player %d'%(seed, client.player_id))
+                self.check_pools(client.world)
+
+    def check_pools(self, world):
+        '''Objects brought back by a rollback must have left the pools, or they would be used twice.'''
+        for pool in world.pools.pools.itervalues():
+            self.assertEqual(len(set(pool.free)), len(pool.free))
+            self.assertFalse([obj for obj in pool.free if obj.alive()])
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#test_server.py
+#Copyright (C) 2011 PyTeam
+
+'''Tests of the rooms of the dedicated server, run from the game's directory with
+    python -m unittest test_server
+The clients are stand-ins which keep the messages sent to them, so no connection is made.
+'''
+
+import unittest
+import server
+from controllers import Outbox
+from simulation import Simulation
+
+
+class Client(object):
+    '''Takes the place of the server's connection to a client.'''
+    room = match = player_id = acked = None
+
+    def __init__(self):
+        self.outbox = Outbox(self)
+        self.sent = []
+
+    def Send(self, data):
+        self.sent.append(data)
+
+    def started_games(self):
+        '''Returns how many matches the client was put into.'''
+        messages = []
+        for data in self.sent:
+            messages.extend(data['messages'] if data['action'] == 'batch' else [data])
+        return len([data for data in messages if data['action'] == 'start_game'])
+
+
+class RoomTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = server.LobbyServer(start_delay=1.0, autojoin=False, localaddr=('127.0.0.1', 0))
+        self.now = 0.0
+        self.clients = [Client(), Client()]
+        #the server flushes the messages of its channels every tick
+        self.server.channels.extend(self.clients)
+        self.room = self.server.create_room(self.clients[0])
+        self.server.join_room(self.clients[1], self.room.name)
+        #two players fill the room, so it starts at once
+        self.room.max_players = 2
+
+    def tearDown(self):
+        self.server.close()
+
+    def tick(self, count=1):
+        for tick in range(count):
+            self.now += Simulation.tick_length
+            self.server.tick(self.now)
+
+    def play_match(self):
+        '''Starts the match of the room and lets the first player blow itself up.'''
+        self.tick()
+        match = self.room.match
+        self.assertTrue(match is not None)
+        match.command(self.clients[0], 'put_bomb')
+        for tick in range(1000):
+            if self.room.match is None:
+                break
+            self.tick()
+        self.assertTrue(match.finished)
+        self.assertTrue(self.room.match is None)
+
+    def test_full_room_waits_after_match(self):
+        self.play_match()
+        self.tick(100)
+        self.assertTrue(self.room.match is None)
+        self.assertEqual([client.started_games() for client in self.clients], [1, 1])
+        self.assertEqual([client.match for client in self.clients], [None, None])
+        self.assertFalse(self.room.describe()['started'])
+
+    def test_room_starts_again_when_asked(self):
+        self.play_match()
+        #the handler of the lobby message, called on the stand-in
+        server.LobbyChannel.Network_start_room.im_func(self.clients[1], {'action': 'start_room'})
+        self.assertTrue(self.room.match is not None)
+        self.tick()
+        self.assertEqual([client.started_games() for client in self.clients], [2, 2])
+
+    def test_room_starts_again_when_somebody_joins(self):
+        self.play_match()
+        self.server.leave_room(self.clients[1])
+        newcomer = Client()
+        self.server.channels.append(newcomer)
+        self.server.join_room(newcomer, self.room.name)
+        self.tick()
+        self.assertEqual(newcomer.started_games(), 1)
+        self.assertTrue(self.room.match is not None)
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -1,15 +1,24 @@
-import glob
 import os
 import socket
 import sys
+from collections import OrderedDict
 import pygame
 from pygame.locals import *
 from PodSixNet.Connection import connection, ConnectionListener
 from gameobjects import GameObject 
 import events
+import maps
 
 class TextBox(GameObject):
-    '''Basic class, which shows text lines and a title on a game screen'''
+    '''Basic class, which shows text lines and a title on a game screen.
+    The image is composed only when the content has changed, the last rendered texts are cached.
+    '''
+    collidable = False
+    #: the most rendered texts a text box keeps, the least recently used one is dropped first
+    render_cache_size = 32
+    #: size -> font, shared by all the text boxes
+    _fonts = {}
+
     def __init__(self, game, title, strings):
         self.strings=strings
         self.title  = title
@@ -19,8 +28,17 @@ class TextBox(GameObject):
         super(TextBox, self).__init__(game, 0, 0, groups=[game.all])
         self.background = self.load_image('menu.jpg')
         self.image=pygame.Surface((self.width,self.height))
-        self.text_font = pygame.font.Font(os.path.join('Data', 'freesansbold.ttf'), self.text_size)
-        self.rendered_title=self.text_font.render(self.title, True, (255,0,0))
+        self.text_font = self._fonts.get(self.text_size)
+        if self.text_font is None:
+            self.text_font = self._fonts[self.text_size] = pygame.font.Font(os.path.join('Data', 'freesansbold.ttf'), self.text_size)
+        self._rendered = OrderedDict()
+        self.rendered_title=self.render(self.title, (255,0,0))
+        #: the strings as they were composed last time, the list may be changed by its owner
+        self._shown_strings = None
+        #: whether the image should be composed again
+        self.changed = True
+        #: set when the image has been composed, renderers reset it after showing the image
+        self.dirty = True
 
     @property
     def width(self):
@@ -37,9 +55,39 @@ class TextBox(GameObject):
     @property
     def abs_height(self):
         return (self.height-(self.lines_count)*self.text_size)//2
-        
+
+    def render(self, text, color):
+        '''Returns the rendered text, a text is rendered again only if it has not been used lately.'''
+        key = (text, color)
+        surface = self._rendered.pop(key, None)
+        if surface is None:
+            surface = self.text_font.render(text, True, color)
+            if len(self._rendered) >= self.render_cache_size:
+                self._rendered.popitem(last=False)
+        self._rendered[key] = surface
+        return surface
+
+    def string_color(self, number):
+        return (0,128,255)
+
+    def string_top(self, number):
+        return self.abs_height+number*self.text_size
+
+    def compose(self):
+        '''Draws the content on the image.'''
+        self.image.blit(self.background,(0,0))
+        self.image.blit(self.rendered_title,((self.width-self.rendered_title.get_width())//2,self.text_size))
+        for number,text in enumerate(self.strings):
+            self.image.blit(self.render(text, self.string_color(number)),(self.width//2,self.string_top(number)))
+
     def update(self):
-        pass
+        if self._shown_strings != self.strings:
+            self._shown_strings = list(self.strings)
+            self.changed = True
+        if self.changed:
+            self.compose()
+            self.changed = False
+            self.dirty = True
 
 
 class Menu(TextBox):
@@ -51,39 +99,56 @@ class Menu(TextBox):
         '''@param str_func: list of tuples(str,func), where str is displayed name, func is callable function   @type str_func:list
            @param title: title of the current menu                                                             @type title:str     '''
         self.str_func=str_func
+        self._item_rects = None
         self.menu_length=len(str_func)
         super(Menu, self).__init__(game, title, strings if strings is not None else [])
         self.current=0
-        self.menu_click = pygame.mixer.Sound(os.path.join('Data', 'click.ogg'))
+
+    @property
+    def current(self):
+        return self._current
+
+    @current.setter
+    def current(self, value):
+        if value != getattr(self, '_current', None):
+            self._current = value
+            self.changed = True
 
     @property
     def lines_count(self):
         return super(Menu,self).lines_count+self.menu_length
-    
-    def update(self):
-        self.image.blit(self.background,(0,0))
-        self.image.blit(self.rendered_title,((self.width-self.rendered_title.get_width())//2,self.text_size))
-        
-        for number,text in enumerate(self.strings):
-            self.image.blit(self.text_font.render(text, True, (0,128,255)),(self.width//2,self.abs_height+number*self.text_size))
-        
+
+    def item_top(self, number):
+        return self.abs_height+(super(Menu,self).lines_count+number)*self.text_size
+
+    def item_rects(self):
+        '''Returns the rects where the items react on the mouse.'''
+        if self._item_rects is None or self._shown_strings != self.strings:
+            self._item_rects = [pygame.rect.Rect(self.width//2, self.item_top(number), len(text)*self.text_size+1, self.text_size+1)
+                for number,(text,func) in enumerate(self.str_func)]
+        return self._item_rects
+
+    def compose(self):
+        super(Menu, self).compose()
+        self._item_rects = None
         for number,(text,func) in enumerate(self.str_func):
-            if number==self.current: self.image.blit(self.text_font.render(text, True, (0,255,0)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
-            else: self.image.blit(self.text_font.render(text, True, (0,154,205)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
+            color = (0,255,0) if number==self.current else (0,154,205)
+            self.image.blit(self.render(text, color),(self.width//2,self.item_top(number)))
     
     def event_keydown(self,event):
         if event.key==K_DOWN:
-            self.menu_click.play()
+            self.game.sounds.play('click')
             self.current=(self.current+1)%self.menu_length
         elif event.key==K_UP:
-            self.menu_click.play()
+            self.game.sounds.play('click')
             self.current=(self.current-1)%self.menu_length
         elif event.key==K_RETURN: self.str_func[self.current][1]()
         
     def event_mousemotion(self, event):
-        for line in range(self.menu_length):
-            if (pygame.mouse.get_pos()[0] in range(self.width//2, self.width//2 + len(self.str_func[line][0]) * self.text_size + 1) and pygame.mouse.get_pos()[1] in range(self.abs_height+(super(Menu,self).lines_count+line) * self.text_size, self.abs_height+(super(Menu,self).lines_count+line) * self.text_size + self.text_size + 1)):
-                self.menu_click.play()
+        pos = pygame.mouse.get_pos()
+        for line, rect in enumerate(self.item_rects()):
+            if rect.collidepoint(pos):
+                self.game.sounds.play('click')
                 self.current = line
                 return True
         return False
@@ -140,10 +205,9 @@ class ChooseLevelMenu(Menu):
         self.file_names = []
         self.game = game
         self.players = players
-        for filename in glob.glob(os.path.join('Maps', '*.bff')):
-            if int(open(filename).readline().split()[2])>=players:
-                self.list_of_good_maps.append((os.path.split(filename)[1].split('.')[0].capitalize(), self.load_level))
-                self.file_names.append(filename)
+        for info in maps.MapIndex('Maps').playable(players):
+            self.list_of_good_maps.append((info.name.split('.')[0].capitalize(), self.load_level))
+            self.file_names.append(info.path)
         self.list_of_good_maps.append(['Back', self.back])
         super(ChooseLevelMenu, self).__init__(game, self.list_of_good_maps, 'Choose Map') 
 
@@ -202,7 +266,7 @@ class MusicMenu(Menu):
     '''This menu is a settings menu for musical settings'''
     def __init__(self, game):
         self.game=game
-        self.vol=1.0
+        self.vol=game.sounds.volumes['music']
         self.items=(
             ('Volume+', self.vol_plus),
             ('Volume-', self.vol_minus),
@@ -215,12 +279,12 @@ class MusicMenu(Menu):
         MainMenu(self.game)
     
     def vol_plus(self):
-        if self.vol<1: self.vol+=0.1 
-        self.game.menu_sound.set_volume(self.vol)
+        if self.vol<1: self.vol=min(1.0, self.vol+0.1)
+        self.game.sounds.set_volume('music', self.vol)
         
     def vol_minus(self):
-        if self.vol>0: self.vol-=0.1
-        self.game.menu_sound.set_volume(self.vol)
+        if self.vol>0: self.vol=max(0.0, self.vol-0.1)
+        self.game.sounds.set_volume('music', self.vol)
         
 class Score(Menu):
     '''Shows score after the game''' 
@@ -236,18 +300,9 @@ class Score(Menu):
                 self.strings.append('%s        %s'%(self.game.player_names[player.id], self.game.players_score[player.id]))
         super(Score, self).__init__(self.game, self.items, 'Score', self.strings) 
 
-    def update(self):
-        self.image.blit(self.background,(0,0))
-        self.image.blit(self.rendered_title,((self.width-self.rendered_title.get_width())//2,self.text_size))
-        
-        for number,text in enumerate(self.strings):
-            self.image.blit(self.text_font.render(text, True, self.game.players_colors[number]),(self.width//2,self.abs_height+number*self.text_size))
-        
-        for number,(text,func) in enumerate(self.str_func):
-            if number==self.current: self.image.blit(self.text_font.render(text, True, (0,255,0)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
-            else: self.image.blit(self.text_font.render(text, True, (0,154,205)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
-    
-    
+    def string_color(self, number):
+        return self.game.players_colors[number]
+
     def start_local_game(self):
         self.kill()
         ChooseLevelMenu(self.game, 2)
@@ -270,17 +325,9 @@ class NetworkScore(Menu):
                 self.strings.append('%s        %s'%(self.game.player_names[player.id], self.game.players_score[player.id]))
         super(NetworkScore, self).__init__(self.game, self.items, 'Score', self.strings) 
 
-    def update(self):
-        self.image.blit(self.background,(0,0))
-        self.image.blit(self.rendered_title,((self.width-self.rendered_title.get_width())//2,self.text_size))
-        
-        for number,text in enumerate(self.strings):
-            self.image.blit(self.text_font.render(text, True, self.game.players_colors[number]),(self.width//2,self.abs_height+number*self.text_size))
-        
-        for number,(text,func) in enumerate(self.str_func):
-            if number==self.current: self.image.blit(self.text_font.render(text, True, (0,255,0)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
-            else: self.image.blit(self.text_font.render(text, True, (0,154,205)),(self.width//2,self.abs_height+(super(Menu,self).lines_count+number)*self.text_size))
-    
+    def string_color(self, number):
+        return self.game.players_colors[number]
+
     def quit(self):
         self.kill()
         MainMenu(self.game)
@@ -300,16 +347,16 @@ class EditBox(TextBox):
     def lines_count(self):
         return super(EditBox,self).lines_count+1
     
-    def update(self):
-        self.image.blit(self.background,(0,0))
-        self.image.blit(self.rendered_title,((self.width-self.rendered_title.get_width())//2,self.text_size))
-        
-        for number,text in enumerate(self.strings):
-            self.image.blit(self.text_font.render(text, True, (0,128,255)),(self.width//2,self.abs_height+self.text_size))
+    def string_top(self, number):
+        return self.abs_height+self.text_size
+
+    def compose(self):
+        super(EditBox, self).compose()
+        #the input changes with every key, so it is not cached
         self.image.blit(self.text_font.render(self.inp, True, (255,0,0)),(self.width//2,self.abs_height+self.text_size*self.lines_count))
-            
-        
+
     def event_keydown(self,event):
+        self.changed = True
         if event.key==K_LEFT:
             if self.cur_pos>0: self.cur_pos-=1
         elif event.key==K_RIGHT:
@@ -404,7 +451,7 @@ class ChooseLevelNetworkMenu(ChooseLevelMenu):
 
     def load_level(self):
         self.kill()
-        self.game.server.start_game(open(self.file_names[self.current]).read())
+        self.game.server.start_game(maps.load(self.file_names[self.current]))
 
 
 class WaitBox(Menu):